@@ -1,10 +1,12 @@
-﻿from libpydetector import YoloDetector
-import os, io, time
+﻿import os, io, sys, time
 import numpy as np
-from mvnc import mvncapi as mvnc
 from skimage.transform import resize
 import cv2
 from utils import cfgGetVal
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "rapidus"))
+from regionDecoder import RegionDecoder
+from deviceScheduler import DeviceScheduler, InferenceError
+from inferenceBackend import InferenceBackend, createBackend
 
 #NUM_CLASSES = 1
 #THRESH = 0.6
@@ -12,48 +14,29 @@ from utils import cfgGetVal
 BLOCK_WD = 13
 TARGET_BLOCK_WD = 13
 NMS = 0.4
+# tensors queued per graph, the NCS processes them one after the other while
+# the host transfers the next one
+MAX_IN_FLIGHT = 2
 
 def createYoloDetector(numClasses, anchors):
     # parse cfg file to find dimensions, #classes etc.
     #classes = cfgGetVal(cfgfile, "region", "classes")
     #biases = cfgGetVal(cfgfile, "region", "anchors")
-    c = (numClasses+5) * 5
-
-    return YoloDetector(1, c, BLOCK_WD, BLOCK_WD, numClasses, 
-                        NMS, TARGET_BLOCK_WD, anchors)
+    return RegionDecoder(numClasses, anchors, NMS)
 
 class MvDetector():
-    mvnc.SetGlobalOption(mvnc.GlobalOption.LOG_LEVEL, 1)
-    devices = mvnc.EnumerateDevices()
-    devNum = len(devices)
-    if len(devices) == 0:
-        print('No MVNC devices found')
-        quit()
-    devHandle = []
-    graphHandle = []
-    def __init__(self, graphfile, cfgfile = None):       
+    def __init__(self, graphfile, cfgfile = None, policy = 'leastloaded', backend = 'ncs', **backendArgs):
+        # backend: 'ncs', 'cpu' (caffe model next to the graph file), 'sim'
+        # or an InferenceBackend instance
+        self.backend = None
+        self.scheduler = None
         if cfgfile == None:
             cfgfile = graphfile.replace(".graph", ".cfg")
 
-        if not os.path.exists(graphfile):
-            print("Error: Could not find graph file {}".format(graphfile))
-            return
         if not os.path.exists(cfgfile):
             print("Error: Could not find darknet config file {}".format(cfgfile))
             return
 
-        for i in range(MvDetector.devNum):
-            MvDetector.devHandle.append(mvnc.Device(MvDetector.devices[i]))
-            MvDetector.devHandle[i].OpenDevice()
-            opt = MvDetector.devHandle[i].GetDeviceOption(mvnc.DeviceOption.OPTIMISATION_LIST)
-            # load blob
-            with open(graphfile, mode='rb') as f:
-                blob = f.read()
-            MvDetector.graphHandle.append(MvDetector.devHandle[i].AllocateGraph(blob))
-            MvDetector.graphHandle[i].SetGraphOption(mvnc.GraphOption.ITERATIONS, 1)
-            #MvDetector.graphHandle[i].SetGraphOption(mvnc.GraphOption.DONTBLOCK, 1)
-            iterations = MvDetector.graphHandle[i].GetGraphOption(mvnc.GraphOption.ITERATIONS)
-
         imgWidth   = cfgGetVal(cfgfile, "net", "width")
         imgHeight  = cfgGetVal(cfgfile, "net", "height")
         numClasses = cfgGetVal(cfgfile, "region", "classes")
@@ -68,11 +51,24 @@ class MvDetector():
         self.classes = numClasses
         self.nms = NMS
 
+        if isinstance(backend, InferenceBackend):
+            self.backend = backend
+        else:
+            outputSize = self.wh * (numClasses+5) * 5
+            self.backend = createBackend(backend, graphfile, outputSize, **backendArgs)
+        if self.backend is None or len(self.backend.graphs) == 0:
+            print("Error: No graphs available for inference")
+            return
+
+        # frames are distributed over all sticks
+        self.scheduler = DeviceScheduler(self.backend.graphs, policy, MAX_IN_FLIGHT)
 
     def __del__(self):
-        for i in range(MvDetector.devNum):
-            MvDetector.graphHandle[i].DeallocateGraph()
-            MvDetector.devHandle[i].CloseDevice()
+        if self.scheduler is not None:
+            self.scheduler.Close()
+        if self.backend is not None:
+            self.backend.Close()
+
     def PrepareImage(self, img, dim):
         tPrep0 = time.time()
 
@@ -116,27 +112,46 @@ class MvDetector():
     def GetDetector(self):
         return self.detector
 
-    def Detect(self, img, thresh):
-        #imgw = img.shape[1]
-        #imgh = img.shape[0]
-
-        #im,offx,offy,xscale,yscale = self.PrepareImage(img, self.dim)
-        #print('xscale = {}, yscale = {}'.format(xscale, yscale))
-        #print("in shape = {}".format(img.shape))
-        MvDetector.graphHandle[0].LoadTensor(img, 'user object')
-        out, userobj = MvDetector.graphHandle[0].GetResult()
-        #print("out shape = {}".format(out.shape))
+    def _convert(self, out):
+        # None for frames the sticks failed on
+        if isinstance(out, InferenceError):
+            print("Error: Skipping frame, inference failed on {}".format(out))
+            return None
         out = self._reshape(out)
-        out = out.astype(np.float32)
-
-        #with open("mvout.txt", "w") as fh:
-        #    outStr = [str(x) for x in out]
-        #    fh.writelines("\n".join(outStr))
-
-
-        #print("out shape after reshape = {}".format(out.shape))
+        return out.astype(np.float32)
+
+    def _output(self, results):
+        outputs = [(self._convert(out), userobj) for out, userobj in results]
+        return [(out, userobj) for out, userobj in outputs if out is not None]
+
+    def Submit(self, img, userobj=None):
+        # queues img on one of the sticks and returns the results which are
+        # finished in sequence as a list of (out, userobj), oldest first.
+        # Failed frames are reported and skipped.
+        return self._output(self.scheduler.Submit(img, userobj))
+
+    def Collect(self):
+        # waits for the oldest submitted tensor which did not fail,
+        # returns (out, userobj) or None if nothing is pending
+        while self.scheduler.pending() > 0:
+            res = self._output([self.scheduler.Collect()])
+            if len(res) > 0:
+                return res[0]
+        return None
+
+    def Flush(self):
+        return self._output(self.scheduler.Flush())
+
+    def DetectBatch(self, imgs):
+        # keeps up to MAX_IN_FLIGHT tensors per device in flight,
+        # the outputs are returned in the order of imgs, None for failed ones.
+        # Don't mix with Submit: pending results are dropped here.
+        self.Flush()
+        results = []
+        for img in imgs:
+            results.extend(self.scheduler.Submit(img))
+        results.extend(self.scheduler.Flush())
+        return [self._convert(out) for out, userobj in results]
 
-        #out = self.detector.Detect(out, thresh) # 4ms
-        #pyresults = [BBox(x,xscale,yscale, offx, offy) for x in internalresults]
-
-        return out
+    def Detect(self, img, thresh):
+        return self.DetectBatch([img])[0]
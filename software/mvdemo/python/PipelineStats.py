@@ -0,0 +1,128 @@
+import csv
+import json
+import threading
+import time
+import numpy as np
+
+# Stages of the demo pipeline. Each stage records its start and end time
+# per frame; 'device' is the time from submitting a frame to the sticks
+# until its result arrives (including the time it waits in the sticks'
+# queues), 'total' is the time from capture until the frame is shown.
+STAGES = ['capture', 'preprocess', 'submit', 'device', 'decode', 'visualize', 'write', 'total']
+
+class PipelineStats(object):
+    # reportInterval: seconds between the periodic reports (0: only at exit)
+    # outFile: .json or .csv file the reports are written to at exit
+    def __init__(self, reportInterval=5., outFile=None):
+        self.reportInterval = reportInterval
+        self.outFile = outFile
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.frameStart = {}
+        self.reports = []
+        self.startTime = time.time()
+        self.allTimes = dict((s, []) for s in STAGES)
+        self.allDepths = {}
+        self._resetInterval(self.startTime)
+
+    def _resetInterval(self, t):
+        self.intervalStart = t
+        self.times = dict((s, []) for s in STAGES)
+        self.depths = dict((name, []) for name in self.queues)
+
+    def addQueue(self, name, queue):
+        with self.lock:
+            self.queues[name] = queue
+            self.depths[name] = []
+            self.allDepths[name] = []
+
+    def record(self, frameId, stage, tStart, tEnd=None):
+        if tEnd is None:
+            tEnd = time.time()
+        with self.lock:
+            self.times[stage].append(tEnd - tStart)
+            self.allTimes[stage].append(tEnd - tStart)
+            if stage == 'capture':
+                self.frameStart[frameId] = tStart
+                # queue depths are sampled once per captured frame
+                for name, queue in self.queues.items():
+                    self.depths[name].append(queue.qsize())
+                    self.allDepths[name].append(queue.qsize())
+
+    def finish(self, frameId, tEnd=None):
+        # frame has been shown, records its end to end latency
+        with self.lock:
+            tStart = self.frameStart.pop(frameId, None)
+        if tStart is not None:
+            self.record(frameId, 'total', tStart, tEnd)
+
+    def _summary(self, times, depths, duration):
+        summary = {'duration': duration, 'stages': {}, 'queues': {}}
+        for stage in STAGES:
+            t = np.array(times[stage]) * 1000.
+            if len(t) == 0:
+                continue
+            p50, p95, p99 = np.percentile(t, [50, 95, 99])
+            # share of the wall time the stage was busy; stages with several
+            # frames in flight (device) can exceed 1
+            summary['stages'][stage] = {'frames': len(t), 'p50': p50, 'p95': p95, 'p99': p99,
+                                        'util': t.sum() / 1000. / duration if duration > 0 else 0.}
+        for name, d in depths.items():
+            if len(d) > 0:
+                summary['queues'][name] = {'mean': float(np.mean(d)), 'max': int(np.max(d))}
+        return summary
+
+    def _print(self, summary, title):
+        print("{} ({:.1f}s):".format(title, summary['duration']))
+        print("  {:<10} {:>7} {:>8} {:>8} {:>8} {:>6}".format("stage", "frames", "p50 ms", "p95 ms", "p99 ms", "util"))
+        for stage in STAGES:
+            if stage in summary['stages']:
+                s = summary['stages'][stage]
+                print("  {:<10} {:>7} {:>8.2f} {:>8.2f} {:>8.2f} {:>6.2f}".format(stage, s['frames'],
+                      s['p50'], s['p95'], s['p99'], s['util']))
+        for name, q in sorted(summary['queues'].items()):
+            print("  queue {:<10} mean depth {:.1f}, max depth {}".format(name, q['mean'], q['max']))
+
+    def maybeReport(self):
+        if self.reportInterval <= 0:
+            return
+        t = time.time()
+        if t - self.intervalStart < self.reportInterval:
+            return
+        with self.lock:
+            summary = self._summary(self.times, self.depths, t - self.intervalStart)
+            self._resetInterval(t)
+            # forget frames which have been dropped on the way
+            for frameId in [f for f, tStart in self.frameStart.items() if t - tStart > 60.]:
+                del self.frameStart[frameId]
+        summary['time'] = t - self.startTime
+        self.reports.append(summary)
+        self._print(summary, "Pipeline stats")
+
+    def close(self):
+        t = time.time()
+        with self.lock:
+            summary = self._summary(self.allTimes, self.allDepths, t - self.startTime)
+        summary['time'] = t - self.startTime
+        self._print(summary, "Pipeline stats (total)")
+        if self.outFile:
+            self._write(summary)
+        return summary
+
+    def _write(self, total):
+        if self.outFile.lower().endswith(".csv"):
+            with open(self.outFile, "w") as fh:
+                writer = csv.writer(fh)
+                writer.writerow(["report", "time", "stage", "frames", "p50", "p95", "p99", "util"])
+                for i, r in enumerate(self.reports + [total]):
+                    name = "total" if i == len(self.reports) else str(i)
+                    for stage in STAGES:
+                        if stage in r['stages']:
+                            s = r['stages'][stage]
+                            writer.writerow([name, "{:.3f}".format(r['time']), stage, s['frames'],
+                                             "{:.3f}".format(s['p50']), "{:.3f}".format(s['p95']),
+                                             "{:.3f}".format(s['p99']), "{:.3f}".format(s['util'])])
+        else:
+            with open(self.outFile, "w") as fh:
+                json.dump({'reports': self.reports, 'total': total}, fh, indent=2)
+        print("Saved pipeline stats to {}".format(self.outFile))
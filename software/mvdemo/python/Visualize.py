@@ -37,18 +37,77 @@ def getColor(classId, numClasses):
 
     return colors[idx]
 
-def Visualize(img, results, numClasses):
-    img_cp = img.copy()
+# Labels are drawn from sprites which are composed once per text and color
+# from the character bitmaps of darknet in data/labels ({ascii}_{size}.png,
+# black text on white). If they are missing, the sprite is rendered once
+# with cv2.putText.
+LABEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "labels")
+labelChars = {}
+labelSprites = {}
+
+def _loadChars(size):
+    if not size in labelChars:
+        chars = {}
+        for c in range(32, 127):
+            img = cv2.imread(os.path.join(LABEL_DIR, "{}_{}.png".format(c, size)), cv2.IMREAD_GRAYSCALE)
+            if img is not None:
+                chars[chr(c)] = img
+        labelChars[size] = chars
+    return labelChars[size]
+
+def getLabelSprite(txt, clr, size=1):
+    key = (txt, tuple(clr), size)
+    if not key in labelSprites:
+        chars = _loadChars(size)
+        if len(chars) > 0:
+            imgs = [chars.get(c, chars.get(" ")) for c in txt]
+            imgs = [img for img in imgs if img is not None]
+            h = max([img.shape[0] for img in imgs]) if imgs else 1
+            gray = np.full((h, sum([img.shape[1] for img in imgs]) + 1), 255, dtype=np.uint8)
+            x = 0
+            for img in imgs:
+                gray[:img.shape[0],x:x+img.shape[1]] = img
+                x += img.shape[1]
+            # black text on the class color
+            sprite = (gray[:,:,np.newaxis] / 255. * np.array(clr, dtype=np.float64)).astype(np.uint8)
+        else:
+            (w, h), baseline = cv2.getTextSize(txt, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
+            sprite = np.empty((h + baseline + 6, w + 10, 3), dtype=np.uint8)
+            sprite[:] = clr
+            cv2.putText(sprite, txt, (5, h + 3), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,0), 2)
+        labelSprites[key] = sprite
+    return labelSprites[key]
+
+def _blit(img, sprite, x, y):
+    h, w = sprite.shape[:2]
+    x0 = max(x, 0)
+    y0 = max(y, 0)
+    x1 = min(x + w, img.shape[1])
+    y1 = min(y + h, img.shape[0])
+    if x1 > x0 and y1 > y0:
+        img[y0:y1,x0:x1] = sprite[y0-y:y1-y,x0-x:x1-x]
+
+def getClassName(r, classNames=None):
+    # BBox objects carry their name, records of BBOX_DTYPE only the class id
+    if classNames is not None:
+        return classNames[int(r.objType)]
+    name = getattr(r, 'name', None)
+    return str(int(r.objType)) if name is None else name
+
+def Visualize(img, results, numClasses, classNames=None, inPlace=False, labelSize=1):
+    # inPlace: draw into img instead of a copy
+    img_cp = img if inPlace else img.copy()
     for r in results:
-        clr     = getColor(r.objType, numClasses)
-        txt     = r.name
-        left    = r.left
-        top     = r.top
-        right   = r.right
-        bottom  = r.bottom
+        clr     = getColor(int(r.objType), numClasses)
+        txt     = getClassName(r, classNames)
+        left    = int(r.left)
+        top     = int(r.top)
+        right   = int(r.right)
+        bottom  = int(r.bottom)
 
+        sprite = getLabelSprite(txt, clr, labelSize)
         cv2.rectangle(img_cp, (left,top), (right,bottom), clr, thickness=3)
-        cv2.rectangle(img_cp, (left,top-20),(right,top), clr,-1)
-        cv2.putText(img_cp,txt,(left+5,top-7),cv2.FONT_HERSHEY_SIMPLEX,0.5,(0,0,0), 2)
+        cv2.rectangle(img_cp, (left,top-sprite.shape[0]),(right,top), clr,-1)
+        _blit(img_cp, sprite, left, top-sprite.shape[0])
 
     return img_cp
@@ -0,0 +1,280 @@
+import cv2
+import glob
+import json
+import os
+import time
+import argparse
+from threading import Thread, local
+from multiprocessing.pool import ThreadPool
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+from utils import *
+from MvDetector import MvDetector
+from PipelineStats import PipelineStats
+import Visualize
+
+# Headless batch processing: runs the detector on a directory, a glob
+# pattern, a list file (.txt, one path per line) or a single image/video and
+# writes the detections of every frame as a JSON line. Videos are decoded
+# in a reader thread into a bounded queue, images are read and all frames
+# preprocessed in a thread pool, inference runs on all sticks and decoding
+# in the main thread, so all stages work in parallel.
+
+def expandSources(source):
+    if os.path.isdir(source):
+        files = [os.path.join(source, f) for f in sorted(os.listdir(source))]
+        return [f for f in files if f.lower().endswith(IMG_EXTS + VIDEO_EXTS)]
+    if any(c in source for c in "*?["):
+        return sorted(glob.glob(source))
+    if source.lower().endswith(".txt"):
+        with open(source, "r") as fh:
+            return [line.strip() for line in fh if line.strip() != ""]
+    return [source]
+
+class _FrameReader(object):
+    # decodes all files in its own thread, frames() yields (frame id, path,
+    # frame index, image or None for images) from a queue of queueSize frames.
+    # The frame id counts all frames of all files in the order they are read.
+    def __init__(self, files, queueSize, stats):
+        self.files = files
+        self.queue = Queue(queueSize)
+        self.stats = stats
+        self.stopped = False
+        self.thread = Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, item):
+        # blocks while the queue is full, gives up when stopped
+        while not self.stopped:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _run(self):
+        frameId = 0
+        for path in self.files:
+            if path.lower().endswith(IMG_EXTS):
+                # images are read by the preprocessing workers
+                self.stats.record(frameId, 'capture', time.time())
+                if not self._put((frameId, path, 0, None)):
+                    return
+                frameId += 1
+                continue
+            vc = cv2.VideoCapture(path)
+            if not vc.isOpened():
+                print("Could not open source {}".format(path))
+                continue
+            frameIdx = 0
+            while True:
+                t = time.time()
+                ret, img = vc.read()
+                if not ret:
+                    break
+                self.stats.record(frameId, 'capture', t)
+                if not self._put((frameId, path, frameIdx, img)):
+                    vc.release()
+                    return
+                frameId += 1
+                frameIdx += 1
+            vc.release()
+        self._put(None)
+
+    def frames(self):
+        return iter(self.queue.get, None)
+
+    def stop(self):
+        self.stopped = True
+        self.thread.join()
+
+_preparers = local()
+
+def _preparer(dim):
+    # one ImagePreparer per worker thread, its buffers are reused for all
+    # frames of the worker
+    preparer = getattr(_preparers, 'preparer', None)
+    if preparer is None or preparer.dim != dim:
+        preparer = ImagePreparer(dim, 1)
+        _preparers.preparer = preparer
+    return preparer
+
+def _prepareFrame(args):
+    frameId, path, frameIdx, img, dim = args
+    t = time.time()
+    if img is None:
+        img = cv2.imread(path)
+        if img is None:
+            print("Could not read image {}".format(path))
+            return frameId, path, frameIdx, None, None, None, None
+    imgScaled, scalingData = _preparer(dim).prepare(img)
+    # the buffer is overwritten by the next frame of this worker, the copy
+    # is handed to the sticks
+    imgScaled = imgScaled.copy()
+    return frameId, path, frameIdx, img, imgScaled, scalingData, (t, time.time())
+
+def _chunks(frames, dim, chunkSize):
+    chunk = []
+    for frameId, path, frameIdx, img in frames:
+        chunk.append((frameId, path, frameIdx, img, dim))
+        if len(chunk) == chunkSize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+class _AnnotationWriter(object):
+    # writes annotated images and videos to annotateDir, the videos get the
+    # fps of their source, encoder and kwargs are passed to createVideoWriter
+    def __init__(self, annotateDir, encoder="opencv", **kwargs):
+        self.annotateDir = annotateDir
+        self.encoder = encoder
+        self.kwargs = kwargs
+        self.videoPath = None
+        self.vw = None
+        if not os.path.isdir(annotateDir):
+            os.makedirs(annotateDir)
+
+    def write(self, path, img):
+        name = os.path.basename(path)
+        if path.lower().endswith(IMG_EXTS):
+            cv2.imwrite(os.path.join(self.annotateDir, name), img)
+            return
+        if path != self.videoPath:
+            self.close()
+            self.videoPath = path
+            ext = ".mp4" if self.encoder == "ffmpeg" else ".avi"
+            outFile = os.path.join(self.annotateDir, os.path.splitext(name)[0] + ext)
+            vc = cv2.VideoCapture(path)
+            fps = sourceFps(vc)
+            vc.release()
+            self.vw = createVideoWriter(outFile, fps, self.encoder, **self.kwargs)
+        self.vw.write(img)
+
+    def close(self):
+        if self.vw is not None:
+            self.vw.close()
+            self.vw = None
+
+def mvbatch(source, cfgFile, thresh, outFile="detections.jsonl", annotateDir=None,
+            backend="ncs", numWorkers=4, chunkSize=32, statsFile=None, queueSize=64,
+            encoder="opencv", codec="libx264", segmentTime=None):
+    # queueSize: max. number of decoded frames waiting for preprocessing.
+    # encoder, codec and segmentTime are used for the annotated videos like in mvdemo
+    graphFile, classNames = findModelFiles(cfgFile, backend)
+    if graphFile is None:
+        return
+
+    files = expandSources(source)
+    if len(files) == 0:
+        print("Could not find any images or videos in {}".format(source))
+        return
+
+    inputWidth = cfgGetVal(cfgFile, "net", "width")
+    numClasses = cfgGetVal(cfgFile, "region", "classes")
+    dim = (inputWidth, inputWidth)
+
+    mvd = MvDetector(graphFile, backend=backend)
+    if mvd.scheduler is None:
+        return
+    det = mvd.GetDetector()
+
+    stats = PipelineStats(0, statsFile)
+    writer = None
+    if annotateDir:
+        if encoder == "ffmpeg":
+            writer = _AnnotationWriter(annotateDir, encoder, codec=codec, segmentTime=segmentTime)
+        else:
+            writer = _AnnotationWriter(annotateDir, encoder)
+    numFrames = 0
+    startTime = time.time()
+
+    def writeResult(out, data, fh):
+        frameId, path, frameIdx, img, scalingData, tSubmit = data
+        stats.record(frameId, 'device', tSubmit)
+        t = time.time()
+        bboxesRaw = det.Detect(out, thresh)
+        bboxes = convertToBBoxes(bboxesRaw, scalingData)
+        stats.record(frameId, 'decode', t)
+
+        t = time.time()
+        dets = [{"class": classNames[int(b.objType)], "classId": int(b.objType),
+                 "confidence": round(float(b.confidence), 4),
+                 "left": int(b.left), "top": int(b.top), "right": int(b.right), "bottom": int(b.bottom)}
+                for b in bboxes]
+        fh.write(json.dumps({"source": path, "frame": frameIdx,
+                             "width": img.shape[1], "height": img.shape[0],
+                             "detections": dets}) + "\n")
+        if writer is not None:
+            writer.write(path, Visualize.Visualize(img, bboxes, numClasses, classNames, inPlace=True))
+        stats.record(frameId, 'write', t)
+        stats.finish(frameId)
+
+    reader = _FrameReader(files, queueSize, stats)
+    stats.addQueue('read', reader.queue)
+    pool = ThreadPool(numWorkers)
+    try:
+        with open(outFile, "w") as fh:
+            # the next chunk is prepared while the current one is inferred
+            chunks = _chunks(reader.frames(), dim, chunkSize)
+            nextChunk = next(chunks, None)
+            pending = pool.map_async(_prepareFrame, nextChunk) if nextChunk else None
+            while pending is not None:
+                prepared = pending.get()
+                nextChunk = next(chunks, None)
+                pending = pool.map_async(_prepareFrame, nextChunk) if nextChunk else None
+
+                for frameId, path, frameIdx, img, imgScaled, scalingData, tPrep in prepared:
+                    if imgScaled is None:
+                        continue
+                    stats.record(frameId, 'preprocess', *tPrep)
+                    t = time.time()
+                    done = mvd.Submit(imgScaled, [frameId, path, frameIdx, img, scalingData, t])
+                    stats.record(frameId, 'submit', t)
+                    for out, data in done:
+                        writeResult(out, data, fh)
+                        numFrames += 1
+            for out, data in mvd.Flush():
+                writeResult(out, data, fh)
+                numFrames += 1
+    finally:
+        reader.stop()
+        pool.close()
+        pool.join()
+        if writer is not None:
+            writer.close()
+
+    duration = time.time() - startTime
+    stats.close()
+    print("Processed {} frames of {} files in {:.1f}s ({:.1f} fps)".format(numFrames, len(files),
+          duration, numFrames / duration if duration > 0 else 0.))
+    print("Saved detections to {}".format(outFile))
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a darknet model on images and videos without display',
+                                     epilog="Graph and names file must lie next to cfg file")
+    parser.add_argument("source",          type=str,   help="an image/video file, a directory, a glob pattern or a .txt file list")
+    parser.add_argument("cfg",             type=str,   help="a darknet model .cfg file")
+    parser.add_argument("-t", "--thresh",  type=float, help="threshold for object detection", default=0.25)
+    parser.add_argument("-o", "--output",  type=str,   help="JSON lines file for the detections", default="detections.jsonl")
+    parser.add_argument("-a", "--annotate", type=str,  help="directory for annotated images and videos", default=None)
+    parser.add_argument("-b", "--backend", type=str,   help="inference backend", choices=["ncs", "cpu", "sim"], default="ncs")
+    parser.add_argument("-w", "--workers", type=int,   help="number of threads for reading and preprocessing", default=4)
+    parser.add_argument("-q", "--queue-size", type=int, help="max. number of decoded frames waiting for preprocessing", default=64)
+    parser.add_argument("--stats-file",    type=str,   help="save the latency report to a .json or .csv file", default=None)
+    parser.add_argument("-e", "--encoder", type=str,   help="video encoder for annotated videos: opencv or ffmpeg (external process)",
+                        choices=VIDEO_ENCODERS, default="opencv")
+    parser.add_argument("--codec",         type=str,   help="ffmpeg video codec, e.g. h264_omx for the Pi's hardware encoder", default="libx264")
+    parser.add_argument("--segment",       type=float, help="split the ffmpeg output into files of this many seconds", default=None)
+
+    args = parser.parse_args()
+    mvbatch(args.source, args.cfg, args.thresh, args.output, args.annotate,
+            args.backend, args.workers, statsFile=args.stats_file, queueSize=args.queue_size,
+            encoder=args.encoder, codec=args.codec, segmentTime=args.segment)
+
+if __name__ == "__main__":
+    main()
@@ -4,96 +4,105 @@ from threading import Thread
 import argparse
 import os
 #from multiprocessing import Process, Queue
-from queue import Queue
 from utils import *
-from MvDetector import MvDetector
-
-frameDrops = 0
-imgQueue = Queue(10)
-imgScaledQueue = Queue(10)
-resQueue = Queue(10)
-imgVisQueue = Queue(10)
+from MvDetector import MvDetector, MAX_IN_FLIGHT
+from PipelineStats import PipelineStats
+from mvbatch import mvbatch
+
+# the queues between the stages are created in mvdemo() with their policies:
+# frames to the sticks, results to the main thread and images to the writer
+imgScaledQueue = None
+resQueue = None
+imgVisQueue = None
 stopThreads = False
 
-def thrdNextImage(vc, dim):
+def thrdNextImage(vc, preparer, stats):
     global stopThreads
+    frameId = 0
     while not stopThreads:
+        t = time.time()
         ret, img = vc.read()
         if not ret:
             print("No images left")
-            imgQueue.put(None)
-            imgScaledQueue.put([None, None])
+            imgScaledQueue.put(None)
             #stopThreads = True
             break
-        imgScaled, scalingData = prepareImage(img, (dim,dim))
-        imgQueue.put(img)
-        imgScaledQueue.put([imgScaled, scalingData])
+        stats.record(frameId, 'capture', t)
+        t = time.time()
+        imgScaled, scalingData = preparer.prepare(img)
+        stats.record(frameId, 'preprocess', t)
+        # the original image travels with the frame, so dropped frames
+        # can not get out of sync
+        imgScaledQueue.put([imgScaled, scalingData, img, frameId])
+        frameId += 1
     print("thrdNextImage: exit thread")
 
-def thrdMov(mvd, thresh):
+def putResult(results, data, stats):
+    [scalingData, img, frameId, tSubmit] = data
+    stats.record(frameId, 'device', tSubmit)
+    resQueue.put([results, scalingData, img, frameId])
+
+def thrdMov(mvd, thresh, stats):
     global stopThreads
     while not stopThreads:
-        [imgScaled, scalingData] = imgScaledQueue.get()
-        if imgScaled is None:
+        item = imgScaledQueue.get()
+        if item is None:
             imgScaledQueue.task_done()
             break
-        results = mvd.Detect(imgScaled, thresh)
+        [imgScaled, scalingData, img, frameId] = item
+        # keep several frames in flight on the sticks, results come in order
+        t = time.time()
+        done = mvd.Submit(imgScaled, [scalingData, img, frameId, t])
+        stats.record(frameId, 'submit', t)
+        for results, data in done:
+            putResult(results, data, stats)
         imgScaledQueue.task_done()
-        resQueue.put([results, scalingData])
+    if not stopThreads:
+        for results, data in mvd.Flush():
+            putResult(results, data, stats)
+        resQueue.put(None)
     print("thrdMov: exit thread")
 
-def thrdWrite(filename):
+def thrdWrite(writer, stats):
     global stopThreads
-    vw = None
-    fourcc = cv2.VideoWriter_fourcc(*"DIVX")
-    print("fourcc".format(fourcc))
-    fps = 20
     while not stopThreads:
-        img = imgVisQueue.get()
-        if img is None:
+        item = imgVisQueue.get()
+        if item is None:
             imgVisQueue.task_done()
             break
-
-        if vw is None:
-            vw = cv2.VideoWriter(filename, fourcc, fps, (img.shape[1], img.shape[0]), True)
-            if not vw.isOpened():
-                print("Could not write video to {}".format(filename))
-                break
-            else:
-                print("Saving video to {}".format(filename))
-        vw.write(img)
+        [img, frameId] = item
+        t = time.time()
+        # after an error the queue is still drained, so the main loop can not block
+        if writer is not None and not writer.write(img):
+            writer.close()
+            writer = None
+        stats.record(frameId, 'write', t)
         imgVisQueue.task_done()
-    if not vw is None:
-        vw.release()
+    if writer is not None:
+        writer.close()
     print("thrdWrite: exit thread")
 
 
-def mvdemo(source, cfgFile, thresh, outFile=""):
-    global stopThreads
+def mvdemo(source, cfgFile, thresh, outFile="", backend="ncs",
+           capturePolicy="block", resultPolicy="block", queueSize=10,
+           statsInterval=5., statsFile=None, encoder="opencv", codec="libx264",
+           segmentTime=None, writePolicy="block"):
+    # capturePolicy/resultPolicy: what happens with new frames when the
+    # sticks or the main thread can not keep up, see QUEUE_POLICIES.
+    # Use keep-latest with a live camera to bound the latency.
+    # encoder: opencv (VideoWriter in the write thread) or ffmpeg (external
+    # process, codec and segmentTime in seconds are passed to ffmpeg)
+    global stopThreads, imgScaledQueue, resQueue, imgVisQueue
 
     if not os.path.isfile(source):
         print("Could not find source {}".format(source))
         return
 
-    if not os.path.isfile(cfgFile):
-        print("Could not find model cfg {}".format(cfgFile))
-        return
-
-    graphFile = cfgFile.replace(".cfg", ".graph")
-    if not os.path.isfile(graphFile):
-        print("Could not find graph file {}".format(graphFile))
-        print("Graph file must be in same dir as cfg file.")
-        return
-
-    namesFile = cfgFile.replace(".cfg", ".names")
-    if not os.path.isfile(namesFile):
-        print("Could not find names file {}".format(namesFile))
-        print("Names file must be in same dir as cfg file.")
+    graphFile, classNames = findModelFiles(cfgFile, backend)
+    if graphFile is None:
         return
 
-    imgExts = (".jpg", ".dib", ".jpeg", ".jpg", ".jpe", 
-               ".png", ".pbm", ".pgm", ".ppm", ".tiff", ".tif")
-    isImage = True if source.lower().endswith(imgExts) else False
+    isImage = True if source.lower().endswith(IMG_EXTS) else False
 
     # timeout = 0: show image once
     # timeout = 1: show images in loop (for video and cam)
@@ -105,13 +114,6 @@ def mvdemo(source, cfgFile, thresh, outFile=""):
         writeOutput = True
         outFile = os.path.abspath(outFile)
 
-
-    classNames = []
-    with open(namesFile, "r") as f:
-        for line in f:
-            line = line.strip()
-            classNames.append(line)
-
     inputWidth = cfgGetVal(cfgFile, "net", "width")
     numClasses = cfgGetVal(cfgFile, "region", "classes")
     vc = cv2.VideoCapture(source)
@@ -119,13 +121,34 @@ def mvdemo(source, cfgFile, thresh, outFile=""):
         print("Could not open source {}".format(source))
         return
 
-    mvd = MvDetector(graphFile)
+    imgScaledQueue = FrameQueue(queueSize, capturePolicy)
+    resQueue = FrameQueue(queueSize, resultPolicy)
+    imgVisQueue = FrameQueue(queueSize, writePolicy)
+
+    mvd = MvDetector(graphFile, backend=backend)
+    if mvd.scheduler is None:
+        vc.release()
+        return
     det = mvd.GetDetector()
 
-    thrdImg = Thread(target=thrdNextImage, args=(vc, inputWidth))
-    thrdDet = Thread(target=thrdMov, args=(mvd,thresh))
+    # a prepared image must stay untouched while it is queued or in flight
+    numSlots = imgScaledQueue.maxsize + 2 + MAX_IN_FLIGHT * len(mvd.backend.graphs)
+    preparer = ImagePreparer((inputWidth, inputWidth), numSlots)
+
+    stats = PipelineStats(statsInterval, statsFile)
+    stats.addQueue("capture", imgScaledQueue)
+    stats.addQueue("results", resQueue)
+    stats.addQueue("write", imgVisQueue)
+
+    thrdImg = Thread(target=thrdNextImage, args=(vc, preparer, stats))
+    thrdDet = Thread(target=thrdMov, args=(mvd, thresh, stats))
     #thrdVis = Thread(target=thrdVisual)
-    thrdWrt = Thread(target=thrdWrite, args=(outFile,))
+    # the output video gets the fps of the source
+    if encoder == "ffmpeg":
+        writer = createVideoWriter(outFile, sourceFps(vc), encoder, codec=codec, segmentTime=segmentTime)
+    else:
+        writer = createVideoWriter(outFile, sourceFps(vc), encoder)
+    thrdWrt = Thread(target=thrdWrite, args=(writer, stats))
 
     thrdImg.start()
     thrdDet.start()
@@ -139,30 +162,34 @@ def mvdemo(source, cfgFile, thresh, outFile=""):
     startTime = time.time()
     # our main thread handles conversion and visualization
     while not stopThreads:
-        [results, scalingData] = resQueue.get()
-        if results is None:
+        item = resQueue.get()
+        if item is None:
             break
+        [results, scalingData, imgOrig, frameId] = item
 
+        t = time.time()
         bboxesRaw = det.Detect(results, thresh) # process final region layer
         resQueue.task_done()
+        stats.record(frameId, 'decode', t)
 
         # convert and visualize boxes
+        t = time.time()
         bboxes = convertToBBoxes(bboxesRaw, scalingData, classNames)
-        imgOrig = imgQueue.get()
-        if imgOrig is None:
-            break
-        imgVis = visualize(imgOrig, bboxes, fps, numClasses)
-        imgQueue.task_done()
+        # every frame is a new image, so the boxes can be drawn into it
+        imgVis = visualize(imgOrig, bboxes, fps, numClasses, classNames, inPlace=True)
 
         if writeOutput:
             if isImage:
                 cv2.imwrite(outFile, imgVis)
                 print("Saved image to {}".format(outFile))
             else:
-                imgVisQueue.put(imgVis)
+                imgVisQueue.put([imgVis, frameId])
 
         # render imgVis
         cv2.imshow("Demo", imgVis)
+        stats.record(frameId, 'visualize', t)
+        stats.finish(frameId)
+        stats.maybeReport()
         # stop program with key 'q'
         if (cv2.waitKey(waitforTimeout) & 0xFF) in (ord('q'), 27):            
             break
@@ -180,12 +207,12 @@ def mvdemo(source, cfgFile, thresh, outFile=""):
 
     # put None into each queue to wake up threads which are waiting for queue.get()
     print("Cleaning up queues")
-    cleanQueue(imgQueue)
+    cleanQueue(imgScaledQueue)
     cleanQueue(resQueue)
     cleanQueue(imgVisQueue)
 
     print("Waking up threads")
-    imgQueue.put(None, timeout=1)
+    imgScaledQueue.put(None, timeout=1)
     resQueue.put(None, timeout=1)
     imgVisQueue.put(None, timeout=1)
 
@@ -200,6 +227,8 @@ def mvdemo(source, cfgFile, thresh, outFile=""):
     vc.release()
     cv2.destroyAllWindows()
 
+    stats.close()
+    print("Dropped frames: {} before inference, {} after inference".format(imgScaledQueue.drops, resQueue.drops))
     print("Exit demo")
 
 def main():
@@ -209,9 +238,33 @@ def main():
     parser.add_argument("cfg",            type=str,   help="a darknet model .cfg file")
     parser.add_argument("-t", "--thresh", type=float, help="threshold for object detection", default=0.25)
     parser.add_argument("-o", "--output", type=str,   help="output file for video or image", default="")
+    parser.add_argument("-b", "--backend", type=str,  help="inference backend: ncs, cpu (caffe model next to cfg file) or sim (simulated sticks)", 
+                        choices=["ncs", "cpu", "sim"], default="ncs")
+    parser.add_argument("-c", "--capture-policy", type=str, help="what to do with new frames if inference can not keep up (keep-latest for live cameras)",
+                        choices=QUEUE_POLICIES, default="block")
+    parser.add_argument("-r", "--result-policy", type=str, help="what to do with new results if visualization can not keep up",
+                        choices=QUEUE_POLICIES, default="block")
+    parser.add_argument("-q", "--queue-size", type=int, help="max. number of frames queued between the stages", default=10)
+    parser.add_argument("-s", "--stats", type=float, help="seconds between pipeline latency reports (0: only at exit)", default=5.)
+    parser.add_argument("--stats-file", type=str,     help="save the latency reports to a .json or .csv file", default=None)
+    parser.add_argument("-w", "--write-policy", type=str, help="what to do with new frames if writing the video can not keep up",
+                        choices=QUEUE_POLICIES, default="block")
+    parser.add_argument("-e", "--encoder", type=str,  help="video encoder: opencv or ffmpeg (external process)",
+                        choices=VIDEO_ENCODERS, default="opencv")
+    parser.add_argument("--codec", type=str,          help="ffmpeg video codec, e.g. h264_omx for the Pi's hardware encoder", default="libx264")
+    parser.add_argument("--segment", type=float,      help="split the ffmpeg output into files of this many seconds", default=None)
+    parser.add_argument("--headless", action="store_true", help="no display: write detections of all frames as JSON lines to --output "
+                        "(source can also be a directory, glob pattern or .txt file list, see mvbatch.py)")
 
     args = parser.parse_args()
-    mvdemo(args.source, args.cfg, args.thresh, args.output)
+    if args.headless:
+        mvbatch(args.source, args.cfg, args.thresh, args.output or "detections.jsonl",
+                backend=args.backend, statsFile=args.stats_file, encoder=args.encoder,
+                codec=args.codec, segmentTime=args.segment)
+        return
+    mvdemo(args.source, args.cfg, args.thresh, args.output, args.backend,
+           args.capture_policy, args.result_policy, args.queue_size, args.stats, args.stats_file,
+           args.encoder, args.codec, args.segment, args.write_policy)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,7 +1,12 @@
 import cv2
 import os
+import subprocess
 import numpy as np
 import Visualize
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 def cfgGetVal(cfgfile, section, value):
     secStr = "[{}]".format(section)
@@ -37,7 +42,38 @@ def cfgGetVal(cfgfile, section, value):
     print("Error: Could not find section/val ({}/{}) in file {}".format(section, value, cfgfile))
     return None
 
+IMG_EXTS = (".jpg", ".dib", ".jpeg", ".jpg", ".jpe",
+            ".png", ".pbm", ".pgm", ".ppm", ".tiff", ".tif")
+VIDEO_EXTS = (".avi", ".mp4", ".mov", ".mkv", ".mpg", ".mpeg", ".m4v", ".wmv", ".h264")
+
+def findModelFiles(cfgFile, backend="ncs"):
+    # graph and names file must lie next to the cfg file,
+    # returns graph file and class names or (None, None)
+    if not os.path.isfile(cfgFile):
+        print("Could not find model cfg {}".format(cfgFile))
+        return None, None
+
+    graphFile = cfgFile.replace(".cfg", ".graph")
+    if backend == "ncs" and not os.path.isfile(graphFile):
+        print("Could not find graph file {}".format(graphFile))
+        print("Graph file must be in same dir as cfg file.")
+        return None, None
+
+    namesFile = cfgFile.replace(".cfg", ".names")
+    if not os.path.isfile(namesFile):
+        print("Could not find names file {}".format(namesFile))
+        print("Names file must be in same dir as cfg file.")
+        return None, None
+
+    classNames = []
+    with open(namesFile, "r") as f:
+        for line in f:
+            line = line.strip()
+            classNames.append(line)
+    return graphFile, classNames
+
 class BBox(object):
+    __slots__ = ('left', 'right', 'top', 'bottom', 'confidence', 'objType', 'name')
     def __init__(self, left, right, top, bottom, confidence, classId, className):
         self.left       = left
         self.right      = right
@@ -47,53 +83,94 @@ class BBox(object):
         self.objType    = classId
         self.name       = className
 
-def convertToBBoxes(results, scalingData, classNames):
-    boxes = []
+# boxes in pixels of the original image
+BBOX_DTYPE = np.dtype([('left',       '<i4'),
+                       ('right',      '<i4'),
+                       ('top',        '<i4'),
+                       ('bottom',     '<i4'),
+                       ('confidence', '<f4'),
+                       ('objType',    '<i4')])
+
+def convertToBBoxes(results, scalingData, classNames=None):
+    # results: (n,6) array of the region decoder (left, right, top, bottom,
+    # confidence, class id relative to the network input) or a list of
+    # objects with these attributes. Returns a record array of BBOX_DTYPE,
+    # the class names are looked up when drawing.
+    if not isinstance(results, np.ndarray):
+        results = [[r.left, r.right, r.top, r.bottom, r.confidence, r.objType] for r in results]
+    det = np.asarray(results, dtype=np.float64).reshape(-1, 6)
     [ox, oy, sx, sy] = scalingData
-    for res in results:
-        l = int(res.left*sx)-ox
-        r = int(res.right*sx)-ox
-        t = int(res.top*sy)-oy
-        b = int(res.bottom*sy)-oy
-        c = res.confidence
-        o = res.objType
-        n = classNames[o]
 
-        box = BBox(l, r, t, b, c, o, n)
-        boxes.append(box)
-    return boxes
+    # int() truncates towards zero, like astype
+    coords = (det[:,:4] * [sx, sx, sy, sy]).astype(np.int32) - [ox, ox, oy, oy]
+    boxes = np.empty(len(det), dtype=BBOX_DTYPE)
+    boxes['left']       = coords[:,0]
+    boxes['right']      = coords[:,1]
+    boxes['top']        = coords[:,2]
+    boxes['bottom']     = coords[:,3]
+    boxes['confidence'] = det[:,4]
+    boxes['objType']    = det[:,5]
+    return boxes.view(np.recarray)
 
+# uint8 -> float16 in [0,1] as uint16 bit patterns, so cv2.LUT can write
+# the float16 network input directly
+FP16_LUT = (np.arange(256) / 255.).astype(np.float16).view(np.uint16).reshape(1, 256)
 
-def prepareImage(img, dim):
-    imgw = img.shape[1]
-    imgh = img.shape[0]
-    imgb = np.empty((dim[0], dim[1], 3))
-    imgb.fill(0.5)
-
-    if imgh/imgw > dim[1]/dim[0]:
-        neww = int(imgw * dim[1] / imgh)
-        newh = dim[1]
-    else:
-        newh = int(imgh * dim[0] / imgw)
-        neww = dim[0]
-    offx = int((dim[0] - neww)/2)
-    offy = int((dim[1] - newh)/2)
-
-    #img01 = img.copy()/255.0
-    #imgb[offy:offy+newh,offx:offx+neww,:] = resize(img01,(newh,neww),1)
-    imgNet = cv2.resize(img, (neww, newh), cv2.INTER_LINEAR)
-    imgNet = np.divide(imgNet, 255.)
-    imgb[offy:offy+newh,offx:offx+neww,:] = imgNet
-    im = imgb[:,:,(2,1,0)]
-    im = im.astype(np.float16)
+class ImagePreparer(object):
+    # Letterboxes frames into preallocated float16 buffers. The buffers are
+    # used round robin, so a prepared image stays valid for numSlots frames:
+    # numSlots must be larger than the number of frames queued or in flight.
+    def __init__(self, dim, numSlots=4):
+        self.dim = dim
+        self.numSlots = numSlots
+        self.buffers = [np.empty((dim[1], dim[0], 3), dtype=np.float16) for i in range(numSlots)]
+        self.bufferGeometry = [None] * numSlots
+        self.slot = 0
+        self.geometry = {}
 
-    ox = int(offx*imgw/neww)
-    oy = int(offy*imgh/newh)
-    sx = neww/dim[0]
-    sx = imgw/sx
-    sy = newh/dim[1]
-    sy = imgh/sy
-    return im, [ox, oy, sx, sy]
+    def _geometry(self, imgw, imgh):
+        # letterbox geometry and scratch buffers per input resolution
+        key = (imgw, imgh)
+        if not key in self.geometry:
+            dim = self.dim
+            if imgh/imgw > dim[1]/dim[0]:
+                neww = int(imgw * dim[1] / imgh)
+                newh = dim[1]
+            else:
+                newh = int(imgh * dim[0] / imgw)
+                neww = dim[0]
+            offx = int((dim[0] - neww)/2)
+            offy = int((dim[1] - newh)/2)
+
+            ox = int(offx*imgw/neww)
+            oy = int(offy*imgh/newh)
+            sx = imgw / (neww/dim[0])
+            sy = imgh / (newh/dim[1])
+            resized = np.empty((newh, neww, 3), dtype=np.uint8)
+            rgb = np.empty((newh, neww, 3), dtype=np.uint8)
+            self.geometry[key] = (offx, offy, neww, newh, [ox, oy, sx, sy], resized, rgb)
+        return self.geometry[key]
+
+    def prepare(self, img):
+        key = (img.shape[1], img.shape[0])
+        offx, offy, neww, newh, scalingData, resized, rgb = self._geometry(*key)
+
+        i = self.slot
+        self.slot = (i + 1) % self.numSlots
+        im = self.buffers[i]
+        # the padding only has to be written if the geometry changes
+        if self.bufferGeometry[i] != key:
+            im.fill(0.5)
+            self.bufferGeometry[i] = key
+
+        cv2.resize(img, (neww, newh), dst=resized, interpolation=cv2.INTER_LINEAR)
+        cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=rgb)
+        cv2.LUT(rgb, FP16_LUT, dst=im[offy:offy+newh,offx:offx+neww].view(np.uint16))
+        return im, list(scalingData)
+
+def prepareImage(img, dim):
+    # returns a new buffer, use ImagePreparer in loops
+    return ImagePreparer(dim, 1).prepare(img)
 
 def prepareImage2(img, dim):
     im = cv2.resize(img, dim, cv2.INTER_LINEAR)
@@ -107,13 +184,140 @@ def prepareImage2(img, dim):
     sy = 1.
     return im, ox, oy, sx, sy
 
-def visualize(img, result, fps, numClasses):
-    img = Visualize.Visualize(img, result, numClasses)
+def visualize(img, result, fps, numClasses, classNames=None, inPlace=False):
+    img = Visualize.Visualize(img, result, numClasses, classNames, inPlace)
     img = cv2.putText(img, "fps: %.1f" % fps, (10, 20), 
         cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
 
     return img
 
+# what a FrameQueue does with a new frame if it is full:
+#   block:       wait until there is room
+#   drop-oldest: drop the oldest queued frame
+#   drop-newest: drop the new frame
+#   keep-latest: drop all queued frames, only the newest frame is kept
+QUEUE_POLICIES = ['block', 'drop-oldest', 'drop-newest', 'keep-latest']
+
+class FrameQueue(Queue):
+    # None is used to stop threads and is never dropped
+    def __init__(self, maxsize=10, policy='block'):
+        if not policy in QUEUE_POLICIES:
+            raise ValueError("Unknown queue policy {}, use one of {}".format(policy, QUEUE_POLICIES))
+        Queue.__init__(self, maxsize)
+        self.policy = policy
+        self.drops = 0
+
+    def put(self, item, block=True, timeout=None):
+        if item is None or self.policy == 'block':
+            return Queue.put(self, item, block, timeout)
+
+        with self.not_full:
+            full = self.maxsize > 0 and self._qsize() >= self.maxsize
+            if self.policy == 'drop-newest':
+                if full:
+                    self.drops += 1
+                    return
+                numDrop = 0
+            elif self.policy == 'drop-oldest':
+                numDrop = 1 if full else 0
+            else:
+                numDrop = self._qsize()
+
+            for i in range(numDrop):
+                self._get()
+                self.unfinished_tasks -= 1
+                self.drops += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+VIDEO_ENCODERS = ['opencv', 'ffmpeg']
+
+class OpenCvVideoWriter(object):
+    def __init__(self, filename, fps=20., fourcc="DIVX"):
+        self.filename = filename
+        self.fps = fps
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.vw = None
+
+    def write(self, img):
+        if self.vw is None:
+            self.vw = cv2.VideoWriter(self.filename, self.fourcc, self.fps, (img.shape[1], img.shape[0]), True)
+            if not self.vw.isOpened():
+                print("Could not write video to {}".format(self.filename))
+                return False
+            print("Saving video to {}".format(self.filename))
+        self.vw.write(img)
+        return True
+
+    def close(self):
+        if self.vw is not None:
+            self.vw.release()
+            self.vw = None
+
+class FfmpegVideoWriter(object):
+    # Pipes raw BGR frames to an ffmpeg process, which encodes them on its own
+    # cores (or the hardware encoder, e.g. codec h264_omx on the Pi).
+    # With segmentTime the video is split into files of segmentTime seconds
+    # (name_0000.ext, name_0001.ext, ...).
+    def __init__(self, filename, fps=20., codec="libx264", segmentTime=None, ffmpeg="ffmpeg"):
+        self.filename = filename
+        self.fps = fps
+        self.codec = codec
+        self.segmentTime = segmentTime
+        self.ffmpeg = ffmpeg
+        self.proc = None
+
+    def _open(self, width, height):
+        cmd = [self.ffmpeg, "-loglevel", "error", "-y",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", "{}x{}".format(width, height),
+               "-r", "{:.3f}".format(self.fps), "-i", "-",
+               "-an", "-c:v", self.codec, "-pix_fmt", "yuv420p"]
+        if self.segmentTime:
+            root, ext = os.path.splitext(self.filename)
+            cmd += ["-f", "segment", "-segment_time", str(self.segmentTime), "-reset_timestamps", "1",
+                    root + "_%04d" + ext]
+        else:
+            cmd += [self.filename]
+        try:
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        except OSError as e:
+            print("Could not start {}: {}".format(self.ffmpeg, e))
+            return False
+        print("Saving video to {} with {}".format(self.filename, self.ffmpeg))
+        return True
+
+    def write(self, img):
+        if self.proc is None and not self._open(img.shape[1], img.shape[0]):
+            return False
+        try:
+            self.proc.stdin.write(np.ascontiguousarray(img).data)
+        except (IOError, OSError) as e:
+            print("Could not write video to {}: {}".format(self.filename, e))
+            return False
+        return True
+
+    def close(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+            except (IOError, OSError):
+                pass
+            self.proc.wait()
+            self.proc = None
+
+def createVideoWriter(filename, fps=20., encoder="opencv", **kwargs):
+    if encoder == "ffmpeg":
+        return FfmpegVideoWriter(filename, fps, **kwargs)
+    return OpenCvVideoWriter(filename, fps, **kwargs)
+
+def sourceFps(vc, default=20.):
+    # fps of a video file or camera, default if it is unknown
+    fps = vc.get(cv2.CAP_PROP_FPS)
+    if not fps > 0 or fps > 1000:
+        fps = default
+    return fps
+
 def cleanQueue(queue):
     while not queue.empty():
         queue.get()
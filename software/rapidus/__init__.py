@@ -1,5 +1,14 @@
 from .downloadCoco          import downloadCoco
 from .createYoloDatabase    import createYoloDatabase
-from .convertYoloToCaffe    import convertYoloToCaffe
+from .convertYoloToCaffe    import convertYoloToCaffe, exportPrecisions
 from .mvTools               import MvDetector
-from .drawLossFromLog       import drawLossFromLog
\ No newline at end of file
+from .drawLossFromLog       import drawLossFromLog
+from .packedDataset         import PackedDataset
+from .letterboxCache        import LetterboxCache
+from .regionDecoder         import RegionDecoder
+from .deviceScheduler       import DeviceScheduler, FakeGraph, InferenceError
+from .inferenceBackend      import createBackend, NcsBackend, CpuBackend, SimBackend
+from .darknetWeights        import DarknetWeights
+from .darknetReference      import DarknetReference
+from .verifyCaffeModel      import verifyCaffeModel
+from .precisionReport       import precisionReport
\ No newline at end of file
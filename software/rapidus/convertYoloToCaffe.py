@@ -1,11 +1,30 @@
-from configparser import ConfigParser
-from collections import OrderedDict
 import logging
 import os
+import re
+import json
 import numpy as np
+from .darknetWeights import DarknetWeights, parseCfg, foldBatchNormParams, PRECISIONS
+from .darknetReference import DarknetReference, loadImages, calibrateActivations
 
-os.environ['GLOG_minloglevel'] = '2' 
-import caffe
+# darknet layers convertCfgToPrototxt can convert. The region layer is not
+# converted, its output is decoded on the host by the RegionDecoder.
+SUPPORTED_LAYERS = ['net', 'convolutional', 'connected', 'maxpool', 'avgpool', 'dropout', 'softmax',
+                    'route', 'reorg', 'shortcut', 'upsample', 'region', 'crop', 'cost']
+
+# caffe layer types written for reorg and upsample layers. They are not part
+# of BVLC caffe: the NCSDK compiler reads them, but loading the prototxt with
+# pycaffe (convertWeightsToCaffemodel, verifyCaffeModel) needs a caffe fork
+# which implements them.
+FORK_LAYERS = ['Reorg', 'Upsample']
+
+def prototxtLayerTypes(prototxtFile):
+    with open(prototxtFile, "r") as fh:
+        return re.findall(r'type:\s*"(\w+)"', fh.read())
+
+def missingCaffeLayers(caffe, prototxtFile):
+    # layer types of prototxtFile which the installed caffe does not know
+    known = set(caffe.layer_type_list())
+    return sorted(set(t for t in prototxtLayerTypes(prototxtFile) if not t in known))
 
 class CaffeLayerGenerator(object):
     def __init__(self, name, ltype):
@@ -20,7 +39,7 @@ layer {{{{
   type: "{}"
   bottom: "{}"
   top: "{}"{{}}
-}}}}""".format(self.name, self.type, self.bottom[0], self.top[0])
+}}}}""".format(self.name, self.type, '"\n  bottom: "'.join(self.bottom), self.top[0])
 
 class CaffeInputLayer(CaffeLayerGenerator):
     def __init__(self, name, channels, width, height):
@@ -139,12 +158,55 @@ class CaffeSoftmaxLayer(CaffeLayerGenerator):
     def write(self, f):
         f.write(self.get_template().format(""))
 
+class CaffeConcatLayer(CaffeLayerGenerator):
+    def __init__(self, name):
+        super(CaffeConcatLayer, self).__init__(name, 'Concat')
+    def write(self, f):
+        f.write(self.get_template().format(""))
+
+class CaffeEltwiseLayer(CaffeLayerGenerator):
+    def __init__(self, name, operation='SUM'):
+        super(CaffeEltwiseLayer, self).__init__(name, 'Eltwise')
+        self.operation = operation
+    def write(self, f):
+        param_str = """
+  eltwise_param {{
+    operation: {}
+  }}""".format(self.operation)
+        f.write(self.get_template().format(param_str))
+
+class CaffeReorgLayer(CaffeLayerGenerator):
+    # darknet's passthrough layer of yolov2, supported by the NCSDK
+    def __init__(self, name, stride):
+        super(CaffeReorgLayer, self).__init__(name, 'Reorg')
+        self.stride = stride
+    def write(self, f):
+        param_str = """
+  reorg_param {{
+    stride: {}
+  }}""".format(self.stride)
+        f.write(self.get_template().format(param_str))
+
+class CaffeUpsampleLayer(CaffeLayerGenerator):
+    # nearest neighbour upsampling
+    def __init__(self, name, scale):
+        super(CaffeUpsampleLayer, self).__init__(name, 'Upsample')
+        self.scale = scale
+    def write(self, f):
+        param_str = """
+  upsample_param {{
+    scale: {}
+  }}""".format(self.scale)
+        f.write(self.get_template().format(param_str))
+
 class CaffeProtoGenerator:
     def __init__(self, name):
         self.name = name
         self.sections = []
         self.lnum = 0
         self.layer = None
+        # top blob of every darknet layer, for route and shortcut
+        self.tops = []
     def add_layer(self, l):
         self.sections.append( l )
     def add_input_layer(self, items):
@@ -153,8 +215,6 @@ class CaffeProtoGenerator:
         self.layer = CaffeInputLayer(lname, items['channels'], items['width'], items['height'])
         self.layer.top.append( lname )
         self.add_layer( self.layer )
-    def update_last_convolution_layer(self):
-        self.sections[len(self.sections)-1].pad = 0
     def add_convolution_layer(self, items):
         self.lnum += 1
         prev_blob = self.layer.top[0]
@@ -162,7 +222,10 @@ class CaffeProtoGenerator:
         filters = items['filters']
         ksize = items['size'] if 'size' in items else None
         stride = items['stride'] if 'stride' in items else None
-        pad = items['pad'] if 'pad' in items else None
+        pad = None
+        if ksize is not None:
+            # darknet's pad is a flag: pad by half the kernel size, else by padding
+            pad = int(ksize) // 2 if int(items.get('pad', 0)) else int(items.get('padding', 0))
         bias = not bool(items['batch_normalize']) if 'batch_normalize' in items else True
         self.layer = CaffeConvolutionLayer( lname, filters, ksize=ksize, stride=stride, pad=pad, bias=bias )
         self.layer.bottom.append( prev_blob )
@@ -201,9 +264,10 @@ class CaffeProtoGenerator:
         self.layer.bottom.append( prev_blob )
         self.layer.top.append( lname )
         self.add_layer( self.layer )
-    def add_relu_layer(self, items):
+    def add_relu_layer(self, items, lname=None):
         prev_blob = self.layer.top[0]
-        lname = "relu"+str(self.lnum)
+        if lname is None:
+            lname = "relu"+str(self.lnum)
         if items['activation'] == "relu":
             self.layer = CaffeReluLayer( lname )
         elif items['activation'] == "leaky":
@@ -227,6 +291,44 @@ class CaffeProtoGenerator:
         self.layer.bottom.append( prev_blob )
         self.layer.top.append( lname )
         self.add_layer( self.layer )
+    def add_route_layer(self, items):
+        idx = [int(i) for i in items['layers'].split(',')]
+        bottoms = [self.tops[i if i >= 0 else len(self.tops) + i] for i in idx]
+        lname = "route"+str(len(self.tops))
+        if len(bottoms) == 1:
+            # no layer needed, the next layer reads the blob directly
+            self.layer = CaffeLayerGenerator( lname, 'Route' )
+            self.layer.top.append( bottoms[0] )
+            return
+        self.layer = CaffeConcatLayer( lname )
+        self.layer.bottom.extend( bottoms )
+        self.layer.top.append( lname )
+        self.add_layer( self.layer )
+    def add_reorg_layer(self, items):
+        prev_blob = self.layer.top[0]
+        lname = "reorg"+str(len(self.tops))
+        self.layer = CaffeReorgLayer( lname, items['stride'] if 'stride' in items else 2 )
+        self.layer.bottom.append( prev_blob )
+        self.layer.top.append( lname )
+        self.add_layer( self.layer )
+    def add_shortcut_layer(self, items):
+        prev_blob = self.layer.top[0]
+        i = int(items['from'])
+        lname = "shortcut"+str(len(self.tops))
+        self.layer = CaffeEltwiseLayer( lname )
+        self.layer.bottom.append( prev_blob )
+        self.layer.bottom.append( self.tops[i if i >= 0 else len(self.tops) + i] )
+        self.layer.top.append( lname )
+        self.add_layer( self.layer )
+        if 'activation' in items and items['activation'] != 'linear':
+            self.add_relu_layer(items, "relu_"+lname)
+    def add_upsample_layer(self, items):
+        prev_blob = self.layer.top[0]
+        lname = "upsample"+str(len(self.tops))
+        self.layer = CaffeUpsampleLayer( lname, items['stride'] if 'stride' in items else 2 )
+        self.layer.bottom.append( prev_blob )
+        self.layer.top.append( lname )
+        self.add_layer( self.layer )
     def finalize(self, name):
         self.layer.top[0] = name    # replace
     def write(self, fname):
@@ -237,15 +339,10 @@ class CaffeProtoGenerator:
         logging.info('{} is generated'.format(fname))
 
 ###################################################################33
-class uniqdict(OrderedDict):
-    _unique = 0
-    def __setitem__(self, key, val):
-        if isinstance(val, OrderedDict):
-            self._unique += 1
-            key += "_"+str(self._unique)
-        OrderedDict.__setitem__(self, key, val)
-
-def convertCfgToPrototxt(cfgfile, targetDir):
+
+def convertCfgToPrototxt(cfgfile, targetDir, foldBatchNorm=False):
+    # foldBatchNorm: no BatchNorm and Scale layers, the batch norm is folded
+    # into the weights and bias of the convolution by convertWeightsToCaffemodel
     
     if targetDir == None:
         targetDir = os.path.dirname(cfgfile)
@@ -257,20 +354,41 @@ def convertCfgToPrototxt(cfgfile, targetDir):
     ptxtfile = os.path.splitext(ptxtfile)[0]
     ptxtfile += ".prototxt"
     ptxtfile = os.path.join(targetDir, ptxtfile)
-        
-    parser = ConfigParser(dict_type=uniqdict, strict=False)
-    parser.read(cfgfile)
+
+    gen = createProtoGenerator(cfgfile, foldBatchNorm)
+    if gen == None:
+        return None
+    #gen.finalize('result')
+    gen.write(ptxtfile)
+    forkLayers = sorted(set(l.type for l in gen.sections if l.type in FORK_LAYERS))
+    if len(forkLayers) > 0:
+        print("Warning: {} uses {} layers, which are not part of BVLC caffe".format(ptxtfile, ", ".join(forkLayers)))
+    return ptxtfile
+
+def createProtoGenerator(cfgfile, foldBatchNorm=False):
+    # gen.tops is the caffe blob holding the output of every darknet layer,
+    # gen.groups the names of the caffe layers created for it
+    sections = parseCfg(cfgfile)
+    unsupported = [(i, s) for i, (s, items) in enumerate(sections) if not s in SUPPORTED_LAYERS]
+    if len(unsupported) > 0:
+        for i, s in unsupported:
+            print("Error: {} layer {} is not supported".format(s, i - 1))
+        print("Could not convert {}".format(cfgfile))
+        return None
+
     netname = os.path.basename(cfgfile).split('.')[0]
     #print netname
     gen = CaffeProtoGenerator(netname)
-    for section in parser.sections():
-        _section = section.split('_')[0]
-        if _section in ["crop", "cost"]:
+    gen.groups = []
+    for _section, items in sections:
+        if _section in ["crop", "cost", "region"]:
+            gen.tops.append( gen.layer.top[0] )
+            gen.groups.append( [] )
             continue
+        start = len(gen.sections)
         #
         batchnorm_followed = False
         relu_followed = False
-        items = dict(parser.items(section))
         if 'batch_normalize' in items and items['batch_normalize']:
             batchnorm_followed = True
         if 'activation' in items and items['activation'] != 'linear':
@@ -280,7 +398,9 @@ def convertCfgToPrototxt(cfgfile, targetDir):
             gen.add_input_layer(items)
         elif _section == 'convolutional':
             gen.add_convolution_layer(items)
-            if batchnorm_followed:
+            if batchnorm_followed and foldBatchNorm:
+                gen.layer.bias = True
+            elif batchnorm_followed:
                 gen.add_batchnorm_layer(items)
                 gen.add_scale_layer(items)
             if relu_followed:
@@ -297,14 +417,23 @@ def convertCfgToPrototxt(cfgfile, targetDir):
             gen.add_dropout_layer(items)
         elif _section == 'softmax':
             gen.add_softmax_layer(items)
-        else:
-            logging.warning("{} layer is not supported".format(_section))
-    gen.update_last_convolution_layer()
-    #gen.finalize('result')
-    gen.write(ptxtfile)
-    return ptxtfile
+        elif _section == 'route':
+            gen.add_route_layer(items)
+        elif _section == 'reorg':
+            gen.add_reorg_layer(items)
+        elif _section == 'shortcut':
+            gen.add_shortcut_layer(items)
+        elif _section == 'upsample':
+            gen.add_upsample_layer(items)
+        if _section != 'net':
+            gen.tops.append( gen.layer.top[0] )
+            gen.groups.append( [l.name for l in gen.sections[start:]] )
+    return gen
 
-def convertWeightsToCaffemodel(weightsFile, targetDir, prototxtFile = None):
+def convertWeightsToCaffemodel(weightsFile, targetDir, prototxtFile = None, cfgFile = None):
+    # the darknet cfg the weights were trained with is required: the layer
+    # shapes of the weights file are taken from it, not from the prototxt.
+    # Default is the .cfg next to the weights, returns None if it is missing.
     if targetDir == None:
         targetDir = os.path.dirname(weightsFile)
     targetDir = os.path.abspath(targetDir)
@@ -318,100 +447,107 @@ def convertWeightsToCaffemodel(weightsFile, targetDir, prototxtFile = None):
     if not os.path.isfile(prototxtFile):
         print("Could not find file {}".format(prototxtFile))
         return None
+
+    if cfgFile == None:
+        cfgFile = os.path.splitext(weightsFile)[0] + ".cfg"
+    if not os.path.isfile(cfgFile):
+        print("Could not find darknet cfg {} for {}, it is needed for the layer shapes "
+              "of the weights: pass cfgFile or put it next to the weights".format(cfgFile, weightsFile))
+        return None
     
     caffeFile = os.path.basename(weightsFile)
     caffeFile = os.path.splitext(caffeFile)[0]
     caffeFile += ".caffemodel"
     caffeFile = os.path.join(targetDir, caffeFile)
-    
+
+    weights = DarknetWeights(cfgFile, weightsFile)
+
+    # caffe is only needed to write the caffemodel
+    os.environ['GLOG_minloglevel'] = '2'
+    import caffe
+    missing = missingCaffeLayers(caffe, prototxtFile)
+    if len(missing) > 0:
+        print("Error: caffe has no {} layers, use a caffe fork which implements them".format(", ".join(missing)))
+        print("Could not load {}".format(prototxtFile))
+        return None
     net = caffe.Net(prototxtFile, caffe.TEST)
-    params = net.params.keys()
-        # read weights from file and assign to the network
-    netWeightsInt = np.fromfile(weightsFile, dtype=np.int32)
-    transFlag = (netWeightsInt[0]>1000 or netWeightsInt[1]>1000) 
-    # transpose flag, the first 4 entries are major, minor, revision and net.seen
-    start = 4   
-    if (netWeightsInt[0]*10 + netWeightsInt[1]) >= 2:
-        start = 5
-
-
-    netWeightsFloat = np.fromfile(weightsFile, dtype=np.float32)
-    netWeights = netWeightsFloat[start:] # start from the 5th entry, the first 4 entries are major, minor, revision and net.seen
-    count = 0
-
-    #print("#Total Net Layer", len(net.layers))
-
-    layercnt = 0
-    for pr in params:
-        layercnt = layercnt + 1
-        lidx = list(net._layer_names).index(pr)
-        layer = net.layers[lidx]
-        if count == netWeights.shape[0] and (layer.type != 'BatchNorm' and layer.type != 'Scale'):
-            print("WARNING: no weights left for %s" % pr)
-            break
-        if layer.type == 'Convolution':
-            #print(pr+"(conv)" + "-"+str(layercnt)+"-"+str(len(net.params[pr]) > 1))
-            # bias
-            if len(net.params[pr]) > 1:
-                bias_dim = net.params[pr][1].data.shape
-            else:
-                bias_dim = (net.params[pr][0].data.shape[0], )
-            biasSize = np.prod(bias_dim)
-            conv_bias = np.reshape(netWeights[count:count+biasSize], bias_dim)
-            if len(net.params[pr]) > 1:
-                assert(bias_dim == net.params[pr][1].data.shape)
-                net.params[pr][1].data[...] = conv_bias
-                conv_bias = None
-            count = count + biasSize
-            # batch_norm
-            if lidx+1 < len(net.layers) and net.layers[lidx+1].type == 'BatchNorm':
-                bn_dims = (3, net.params[pr][0].data.shape[0])
-                bnSize = np.prod(bn_dims)
-                batch_norm = np.reshape(netWeights[count:count+bnSize], bn_dims)
-                count = count + bnSize
-            # weights
-            dims = net.params[pr][0].data.shape
-            weightSize = np.prod(dims)
-            net.params[pr][0].data[...] = np.reshape(netWeights[count:count+weightSize], dims)
-            count = count + weightSize
-            
-        elif layer.type == 'InnerProduct':
-            #print(pr+"(fc)")
-            # bias
-            biasSize = np.prod(net.params[pr][1].data.shape)
-            net.params[pr][1].data[...] = np.reshape(netWeights[count:count+biasSize], net.params[pr][1].data.shape)
-            count = count + biasSize
-            # weights
-            dims = net.params[pr][0].data.shape
-            weightSize = np.prod(dims)
-            if transFlag:
-                net.params[pr][0].data[...] = np.reshape(netWeights[count:count+weightSize], (dims[1], dims[0])).transpose()
+
+    # layer names of convertCfgToPrototxt: conv<n>, bn<n>, scale<n> and fc<n>,
+    # n counts the convolutional and connected layers
+    lnum = 0
+    for layer in weights.paramLayers():
+        lnum += 1
+        params = layer['params']
+        if layer['type'] == 'convolutional':
+            name = "conv"+str(lnum)
+            if 'scales' in params and not ("bn"+str(lnum)) in net.params:
+                # prototxt with folded batch norm
+                net.params[name][0].data[...], net.params[name][1].data[...] = foldBatchNormParams(params)
+            elif 'scales' in params:
+                net.params[name][0].data[...] = params['weights']
+                net.params["bn"+str(lnum)][0].data[...] = params['mean']
+                net.params["bn"+str(lnum)][1].data[...] = params['variance']
+                net.params["bn"+str(lnum)][2].data[...] = 1.0   # scale factor
+                net.params["scale"+str(lnum)][0].data[...] = params['scales']
+                net.params["scale"+str(lnum)][1].data[...] = params['biases']
             else:
-                net.params[pr][0].data[...] = np.reshape(netWeights[count:count+weightSize], dims)
-            count = count + weightSize
-        elif layer.type == 'BatchNorm':
-            #print(pr+"(batchnorm)")
-            net.params[pr][0].data[...] = batch_norm[1] # mean
-            net.params[pr][1].data[...] = batch_norm[2] # variance
-            net.params[pr][2].data[...] = 1.0   # scale factor
-        elif layer.type == 'Scale':
-            #print(pr+"(scale)")
-            if batch_norm is not None:
-                net.params[pr][0].data[...] = batch_norm[0] # scale
-            batch_norm = None
-            if len(net.params[pr]) > 1:
-                net.params[pr][1].data[...] = conv_bias # bias
-                conv_bias = None
-        else:
-            print("WARNING: unsupported layer, "+pr)
-    if np.prod(netWeights.shape) != count:
-        print("ERROR: size mismatch: %d" % count)
+                net.params[name][0].data[...] = params['weights']
+                net.params[name][1].data[...] = params['biases']
+        elif layer['type'] == 'connected':
+            name = "fc"+str(lnum)
+            net.params[name][0].data[...] = params['weights']
+            net.params[name][1].data[...] = params['biases']
     net.save(caffeFile)
     return caffeFile    
 
     
 
-def convertYoloToCaffe(cfgFile=None, weightsFile = None, targetDir=None):
+def exportPrecisions(cfgFile, weightsFile, targetDir=None, precisions=['fp16'], calibImages=None,
+                     prototxtFile=None, numCalibImages=32):
+    # writes the weights rounded to every precision to <name>-<precision>.weights,
+    # for int8 the activation scales of the calibration images (list of files
+    # or directories) to <name>-int8.json. With prototxtFile a caffemodel of
+    # every variant is written, too (int8 only with quantized weights).
+    # Returns the written weights files.
+    if targetDir == None:
+        targetDir = os.path.dirname(weightsFile)
+    targetDir = os.path.abspath(targetDir)
+    name = os.path.splitext(os.path.basename(weightsFile))[0]
+
+    weights = DarknetWeights(cfgFile, weightsFile)
+    files = []
+    for precision in precisions:
+        if not precision in PRECISIONS:
+            print("Unknown precision {}, use one of {}".format(precision, PRECISIONS))
+            continue
+        fn = os.path.join(targetDir, "{}-{}.weights".format(name, precision))
+        weights.save(fn, weights.quantize(precision))
+        print("Successfully created {}".format(fn))
+        files.append(fn)
+        if precision == 'int8':
+            if calibImages:
+                ref = DarknetReference(cfgFile, fn)
+                data, names = loadImages(calibImages, ref.inputShape, numCalibImages)
+                calibFile = os.path.splitext(fn)[0] + ".json"
+                with open(calibFile, "w") as fh:
+                    json.dump({'images': names, 'actScales': calibrateActivations(ref, data)}, fh, indent=2)
+                print("Successfully created {}".format(calibFile))
+            else:
+                print("No calibration images: int8 only for the weights")
+        if prototxtFile != None:
+            caffeFile = convertWeightsToCaffemodel(fn, targetDir, prototxtFile, cfgFile)
+            if caffeFile != None:
+                print("Successfully created {}".format(caffeFile))
+    return files
+
+def convertYoloToCaffe(cfgFile=None, weightsFile = None, targetDir=None, foldBatchNorm=False,
+                       precisions=None, calibImages=None):
+    # foldBatchNorm: fold the batch norm into the convolutions, the network
+    # has only Convolution, ReLU and Pooling layers and runs faster on the NCS
+    # precisions: also export the weights in these precisions (fp16, int8),
+    # see exportPrecisions and precisionReport
+    # Converting the weights needs the cfg: without cfgFile the .cfg next to
+    # weightsFile is used, nothing is converted if it is missing.
     if (cfgFile==None) and (weightsFile==None):
         print("No yolo files specified. Nothing to do.")
         return
@@ -424,7 +560,9 @@ def convertYoloToCaffe(cfgFile=None, weightsFile = None, targetDir=None):
     prototxtFile = None
     if cfgFile != None:
         if os.path.isfile(cfgFile):
-            prototxtFile = convertCfgToPrototxt(cfgFile, targetDir)
+            prototxtFile = convertCfgToPrototxt(cfgFile, targetDir, foldBatchNorm)
+            if prototxtFile == None:
+                return
             print("Successfully created {}".format(prototxtFile))
         else:
             print("Could not find file {}".format(cfgFile))
@@ -432,9 +570,11 @@ def convertYoloToCaffe(cfgFile=None, weightsFile = None, targetDir=None):
     
     if weightsFile != None:
         if os.path.isfile(weightsFile):
-            fn = convertWeightsToCaffemodel(weightsFile, targetDir, prototxtFile)
+            fn = convertWeightsToCaffemodel(weightsFile, targetDir, prototxtFile, cfgFile)
             if fn != None:
                 print("Successfully created {}".format(fn))
+            if precisions and cfgFile != None:
+                exportPrecisions(cfgFile, weightsFile, targetDir, precisions, calibImages, prototxtFile)
         else:
             print("Could not find file {}".format(weightsFile))
             return
@@ -1,38 +1,80 @@
-import json
+import array
+import glob
+import hashlib
 import os
 import sys
 import shutil
-import threading
+import multiprocessing
+import numpy as np
+from .utils import iterJsonObject
+from .packedDataset import writePackedDataset
+from .letterboxCache import createLetterboxCache
 
-def convertCocoYolo(jsonfile, classFilter=None, skipCrowd = False, balance = False):
-            
+def readCocoJson(jsonfile):
     if not os.path.exists(jsonfile):
         print("Json-File does not exist {}".format(jsonfile))
         return
     
     jsonfile = os.path.abspath(jsonfile)
-            
-    fh = open(jsonfile, "r")
-    if fh == -1:
+    
+    # the json file is streamed and only the fields we need are kept in compact
+    # columnar arrays. The categories come last in coco files, so annotations 
+    # of all categories are buffered and filtered later (see filterCocoYolo)
+    imgIds     = array.array('q')
+    imgWidths  = array.array('i')
+    imgHeights = array.array('i')
+    fileNames  = []
+    annoImgIds = array.array('q')
+    annoCatIds = array.array('h')
+    annoCrowd  = array.array('b')
+    annoBboxes = array.array('d')
+    cats = []
+    
+    print("Reading json file...")
+    try:
+        fh = open(jsonfile, "r")
+    except IOError:
         print("Could not open Json-File {}".format(jsonfile))
         return
     
-    print("Reading json file...")
-    jdb = json.load(fh)
-    fh.close()
-    print("    done!")
+    with fh:
+        for key, item in iterJsonObject(fh):
+            if key == 'annotations':
+                annoImgIds.append(item['image_id'])
+                annoCatIds.append(item['category_id'])
+                annoCrowd.append(item['iscrowd'])
+                annoBboxes.extend(item['bbox'])
+            elif key == 'images':
+                imgIds.append(item['id'])
+                imgWidths.append(item['width'])
+                imgHeights.append(item['height'])
+                fileNames.append(item['file_name'])
+            elif key == 'categories':
+                cats.append({'id': item['id'], 'name': item['name']})
+    print("    done! Number of images: {}, annotations: {}".format(len(imgIds), len(annoImgIds)))
     
-    imgs = jdb['images']
-    annos = jdb['annotations']
-    cats = jdb['categories']
+    # bboxes are kept as float64 so that label files do not change 
+    # compared to the values parsed by json
+    return {'imgIds':     np.array(imgIds,     dtype=np.int64),
+            'widths':     np.array(imgWidths,  dtype=np.int32),
+            'heights':    np.array(imgHeights, dtype=np.int32),
+            'fileNames':  fileNames,
+            'annoImgIds': np.array(annoImgIds, dtype=np.int64),
+            'annoCatIds': np.array(annoCatIds, dtype=np.int16),
+            'annoCrowd':  np.array(annoCrowd,  dtype=np.int8),
+            'bboxes':     np.array(annoBboxes, dtype=np.float64).reshape(-1, 4),
+            'categories': cats}
+
+def filterCocoYolo(coco, classFilter=None, skipCrowd = False, balance = False):
+    cats = coco['categories']
     
     # remove gaps from category indices
     catsNames = [x['name'] for x in cats]
     if classFilter == None:
         classFilter = catsNames
         
-    maxCatId = cats[-1]['id']
-    catIdToYolo = [-1]*(maxCatId+1)
+    maxCatId = max([x['id'] for x in cats])
+    catIdToYolo = np.full(maxCatId+1, -1, dtype=np.int16)
     yoloId = 0
     for x in classFilter:
         try:
@@ -47,106 +89,125 @@ def convertCocoYolo(jsonfile, classFilter=None, skipCrowd = False, balance = Fal
     personCatIdx = catsNames.index('person')
     personYoloId = catIdToYolo[cats[personCatIdx]['id']]
     print("Processing annotations...")
-    annoMap = {}
-    totalAnnosCreated = 0
-    for i in range(len(annos)):        
-        anno = annos[i]
-        
-        catId = anno['category_id']
-        yoloId = catIdToYolo[catId]        
-        if yoloId == -1:
-            continue
-        
-        imgId = anno['image_id']
-        bbox = anno['bbox']
-        isCrowd = anno['iscrowd']
-                                
-        newElem = {'yoloId': yoloId, 'bbox': bbox, 'iscrowd': isCrowd}
-        if imgId in annoMap:
-            annoMap[imgId]['labels'].append(newElem)
-        else:
-            annoMap[imgId] =  {'labels': [newElem]}
-            
-        totalAnnosCreated += 1
-        
-    print("    done! Number of annotations created: {}".format(totalAnnosCreated))
+    yoloIds = catIdToYolo[coco['annoCatIds']]
+    annoIdx = np.flatnonzero(yoloIds >= 0)
+    # group annotations by image but keep their order within an image
+    annoIdx = annoIdx[np.argsort(coco['annoImgIds'][annoIdx], kind='stable')]
+    annoImgIds = coco['annoImgIds'][annoIdx]
+    yoloIds    = yoloIds[annoIdx]
+    isCrowd    = coco['annoCrowd'][annoIdx]
+    bboxes     = coco['bboxes'][annoIdx]
+    print("    done! Number of annotations created: {}".format(len(annoIdx)))
     
     print("Adding image infos to annotations...")
-    totalImages = 0
+    annoImgs, starts, numLabels = np.unique(annoImgIds, return_index=True, return_counts=True)
+    
+    # find image infos, annotations of unknown images are dropped
+    keep = np.isin(annoImgs, coco['imgIds'])
+    imgOrder = np.argsort(coco['imgIds'], kind='stable')
+    infoIdx = np.zeros(len(annoImgs), dtype=np.int64)
+    infoIdx[keep] = imgOrder[np.searchsorted(coco['imgIds'], annoImgs[keep], sorter=imgOrder)]
+    
     crowdSkipCnt = 0
-    classCnt = [0]*len(catsNames)
-    for i in range(len(imgs)):
-        img = imgs[i]
-
-        imgId = img['id']
-        if not imgId in annoMap:
-            continue
-        
-        removeId = False
-        if skipCrowd:
-            for l in annoMap[imgId]['labels']:
-                if l['iscrowd']:
-                    removeId = True
-                    crowdSkipCnt += 1
-                    break
-                
-        if (not removeId) and (balance):
-            labels = annoMap[imgId]['labels']
-            numPers = 0
-            numTotal = len(labels)
-            for l in labels:
-                classId = l['yoloId']
-                if classId == personYoloId:
-                    numPers += 1
-            ratio = 0. if numTotal == 0 else float(numPers) / float(numTotal)
-            if ratio > 0.66:
-                removeId = True
+    if skipCrowd and len(starts):
+        hasCrowd = np.add.reduceat(isCrowd.astype(np.int32), starts) > 0
+        crowdSkipCnt = int(np.count_nonzero(keep & hasCrowd))
+        keep &= ~hasCrowd
                 
-        if removeId:
-            del annoMap[imgId]
-            continue
-        
-        for l in annoMap[imgId]['labels']:
-            yoloId = l['yoloId']
-            classCnt[yoloId] += 1
-        
-        annoMap[imgId]['file_name'] = img['file_name'];
-        annoMap[imgId]['width']     = img['width'];
-        annoMap[imgId]['height']    = img['height'];
-        totalImages += 1
+    if balance and len(starts):
+        numPers = np.add.reduceat((yoloIds == personYoloId).astype(np.int32), starts)
+        ratio = numPers / numLabels.astype(np.float64)
+        keep &= ~(ratio > 0.66)
+    
+    annoKeep = np.repeat(keep, numLabels)
+    infoIdx = infoIdx[keep]
+    numLabels = numLabels[keep]
+    yoloIds = yoloIds[annoKeep]
+    classCnt = np.bincount(yoloIds, minlength=len(catsNames)).tolist()
+    totalImages = len(infoIdx)
     print("    done! Number of images: {}".format(totalImages))
     if skipCrowd:
         print("    Removed {} images with 'crowd'".format(crowdSkipCnt))
     
-    return {'annoMap': annoMap, 'classNames': classFilter, 'classCnt': classCnt}
+    # annotations are sorted by image, annoImgIdx points into the image arrays
+    return {'imgIds':     annoImgs[keep],
+            'fileNames':  [coco['fileNames'][i] for i in infoIdx],
+            'widths':     coco['widths'][infoIdx],
+            'heights':    coco['heights'][infoIdx],
+            'annoImgIdx': np.repeat(np.arange(totalImages, dtype=np.int32), numLabels),
+            'yoloIds':    yoloIds,
+            'bboxes':     bboxes[annoKeep],
+            'classNames': classFilter, 
+            'classCnt':   classCnt}
+
+def convertCocoYolo(jsonfile, classFilter=None, skipCrowd = False, balance = False):
+    coco = readCocoJson(jsonfile)
+    if coco is None:
+        return
+    return filterCocoYolo(coco, classFilter, skipCrowd, balance)
     
-def writeYoloAnno(anno, filename):
-    labels = anno['labels']
-    width = anno['width']
-    height = anno['height']
+def normalizeYoloAnnos(annoImgIdx, bboxes, widths, heights):
+    # create yolo label data for all annotations at once
+    w = widths[annoImgIdx].astype(np.float64)
+    h = heights[annoImgIdx].astype(np.float64)
+    labels = np.empty((len(bboxes), 4), dtype=np.float64)
+    labels[:,0] = (bboxes[:,0] + bboxes[:,2]/2.) / w
+    labels[:,1] = (bboxes[:,1] + bboxes[:,3]/2.) / h
+    labels[:,2] = bboxes[:,2] / w
+    labels[:,3] = bboxes[:,3] / h
+    return labels
 
-    fh = None
-    for label in labels:
-        yoloId = label['yoloId']
-        bbox = label['bbox']
-        
-        if yoloId < 0:
-            continue
-        
-        if fh == None:
-            fh = open(filename, "w")
-        
-        # create yolo label data
-        x = bbox[0] + bbox[2]/2.
-        x = x / width
-        y = bbox[1] + bbox[3]/2.
-        y = y / height
-        w = bbox[2] / width
-        h = bbox[3] / height
+def formatYoloAnnos(annoImgIdx, yoloIds, bboxes, widths, heights):
+    labels = normalizeYoloAnnos(annoImgIdx, bboxes, widths, heights)
+    lineFmt = u"%d %6f %6f %6f %6f\n"
+    return [lineFmt % ((c,) + tuple(l)) for c, l in zip(yoloIds.tolist(), labels.tolist())]
 
-        fh.write(u"{} {:6f} {:6f} {:6f} {:6f}\n".format(yoloId, x, y, w, h))
-    if fh != None:
-        fh.close()
+def writeYoloAnnos(data, targetDir, oldHashes=None):
+    # label files whose hash is found in oldHashes (txt filename -> hash) are
+    # not written again. Returns the label paths and the hashes of their content
+    lines = formatYoloAnnos(data['annoImgIdx'], data['yoloIds'], data['bboxes'],
+                            data['widths'], data['heights'])
+    if oldHashes == None:
+        oldHashes = {}
+    
+    # annotations are sorted by image, so each label file is a contiguous block
+    bounds = np.searchsorted(data['annoImgIdx'], np.arange(len(data['fileNames'])+1)).tolist()
+    txtPaths = []
+    hashes = []
+    for i, imgFilename in enumerate(data['fileNames']):
+        txtFilename = imgFilename.replace('.jpg', '.txt')
+        txtPath = os.path.join(targetDir, txtFilename)
+        txt = u"".join(lines[bounds[i]:bounds[i+1]])
+        txtHash = hashlib.sha1(txt.encode('utf-8')).hexdigest()
+        if oldHashes.get(txtFilename) != txtHash:
+            with open(txtPath, "w") as fh:
+                fh.write(txt)
+        txtPaths.append(txtPath)
+        hashes.append(txtHash)
+    return txtPaths, hashes
+
+def readManifest(filename):
+    # image filename -> (label hash, source image size, source image mtime)
+    manifest = {}
+    if not os.path.isfile(filename):
+        return manifest
+    with open(filename, "r") as fh:
+        for line in fh:
+            toks = line.split()
+            if len(toks) != 4:
+                continue
+            manifest[toks[0]] = (toks[1], int(toks[2]), int(toks[3]))
+    return manifest
+
+def writeManifest(manifest, filename):
+    # write to a temp file first, so an interrupted run never leaves a 
+    # manifest which claims files that were not written
+    tmpFilename = filename + ".tmp"
+    with open(tmpFilename, "w") as fh:
+        for name in sorted(manifest):
+            labelHash, size, mtime = manifest[name]
+            fh.write("{} {} {} {}\n".format(name, labelHash, size, mtime))
+    os.replace(tmpFilename, filename)
         
 def writeFilelist(filelist, filename):
     with open(filename, "w") as fh:
@@ -168,37 +229,76 @@ def writeStats(classCnt, classNames, filename):
                 fh.write("{} {}\n".format(classNames[i], cnt))
                 print("  {} {}".format(classNames[i], cnt))
 
-def thrdCopyFiles(jpgFiles, targetDir, isOutputThread):
-    n = len(jpgFiles)
-    outputAt = int(n/100)
-    cnt = 0
-    cntPerc = 0
-    for f in jpgFiles:
-        shutil.copy2(f, targetDir)
-        cnt += 1
-        if (cnt >= outputAt):
-            cntPerc += 1
-            cnt = 0
-            if isOutputThread and (cntPerc <= 100):
-                #print(" {}%".format(cntPerc)),
-                sys.stdout.write(" {}%".format(cntPerc))
+# ioctl request number of FICLONE on linux
+FICLONE = 0x40049409
+COPY_MODES = ['copy', 'hardlink', 'symlink', 'reflink']
+OUTPUT_FORMATS = ['files', 'packed']
 
-def _createDb(cocoDir, targetDir, db, newDb, classFilter, balance, skipCrowd):
-    cocoImgDir = os.path.join(cocoDir, db)
-    if not os.path.isdir(cocoImgDir):
-        print("Could not find coco image directory {}".format(cocoImgDir))
-        return
-    
-    annoDir = os.path.join(cocoDir, "annotations")
-    if not os.path.isdir(annoDir):
-        print("Could not find annotation folder {}".format(annoDir))
-        return
+def _reflinkFile(src, dst):
+    import fcntl
+    with open(src, "rb") as fhSrc:
+        with open(dst, "wb") as fhDst:
+            fcntl.ioctl(fhDst.fileno(), FICLONE, fhSrc.fileno())
 
-    annoFile = os.path.join(annoDir, "instances_{}.json".format(db))
-    if not os.path.isfile(annoFile):
-        print("Could not find annotation file {}".format(annoFile))
+def materializeFile(src, dst, copyMode):
+    # returns the mode that was actually used: if linking is not possible
+    # (e.g. different file systems) the file is copied
+    try:
+        if copyMode == 'hardlink':
+            os.link(src, dst)
+            return copyMode
+        elif copyMode == 'symlink':
+            os.symlink(src, dst)
+            return copyMode
+        elif copyMode == 'reflink':
+            _reflinkFile(src, dst)
+            return copyMode
+    except (OSError, IOError, ImportError):
+        pass
+    shutil.copy2(src, dst)
+    return 'copy'
+
+def _materializeWorker(args):
+    return materializeFile(*args)
+
+def materializeFiles(files, targetDir, copyMode='copy', numWorkers=None):
+    if not copyMode in COPY_MODES:
+        print("Unknown copy mode {}: must be one of {}".format(copyMode, COPY_MODES))
         return
     
+    if len(files) == 0:
+        return {}
+    
+    if numWorkers == None:
+        numWorkers = multiprocessing.cpu_count()
+    numWorkers = max(1, min(numWorkers, len(files)))
+    
+    tasks = [(f, os.path.join(targetDir, os.path.basename(f)), copyMode) for f in files]
+    
+    # workers fetch small chunks from a shared queue, so fast workers 
+    # take over the work of slow ones
+    chunksize = max(1, min(64, int(len(tasks)/(numWorkers*16))))
+    modeCnt = {}
+    cntPerc = 0
+    pool = multiprocessing.Pool(numWorkers)
+    try:
+        for cnt, mode in enumerate(pool.imap_unordered(_materializeWorker, tasks, chunksize)):
+            modeCnt[mode] = modeCnt.get(mode, 0) + 1
+            perc = int(100*(cnt+1)/len(tasks))
+            if perc > cntPerc:
+                cntPerc = perc
+                sys.stdout.write(" {}%".format(cntPerc))
+                sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+    print("")
+    
+    if copyMode != 'copy' and modeCnt.get('copy', 0) > 0:
+        print("Could not {} {} files, copied them instead".format(copyMode, modeCnt['copy']))
+    return modeCnt
+
+def _makeTargetDir(targetDir, db, newDb):
     targetImgFolder = "{}_{}".format(db, newDb)
     targetImgDir = os.path.join(targetDir, targetImgFolder)
     maxTry = 1000
@@ -213,79 +313,176 @@ def _createDb(cocoDir, targetDir, db, newDb, classFilter, balance, skipCrowd):
         return
     
     os.makedirs(targetImgDir)
-    print("target dir will be {}".format(targetImgDir))
-    
-    data = convertCocoYolo(annoFile, classFilter, skipCrowd, balance)
-    annos = data['annoMap']
-    classCnt = data['classCnt']
-    classNames = data['classNames']
+    return targetImgDir
 
-    print("Writing yolo annotation files...")    
-    txtPaths = []
-    for imgId in annos:
-        anno = annos[imgId]
-        imgFilename = anno['file_name']
-        txtFilename = imgFilename.replace('.jpg', '.txt')
-        txtPath = os.path.join(targetImgDir, txtFilename)
-        
-        writeYoloAnno(anno, txtPath)
-        txtPaths.append(txtPath)
-    print("...done! Files written: {}".format(len(txtPaths)))        
-    txtPaths.sort()
-    
-    print("Writing filelist, stats and class names...")
-    filelistPath = os.path.join(targetImgDir, '_filelist.txt')
+def _scanImageDir(imgDir):
+    with os.scandir(imgDir) as it:
+        return set([e.name for e in it if e.is_file()])
+
+def _removeFile(path):
+    if os.path.lexists(path):
+        os.remove(path)
+
+def _writeDbInfo(targetImgDir, classCnt, classNames, classFilter):
     statsPath    = os.path.join(targetImgDir, '_stats.txt')
     classesPath  = os.path.join(targetImgDir, '_classes.names')
     
-    writeFilelist(txtPaths,     filelistPath)    
     writeStats(classCnt, classNames, statsPath)
     
     if classFilter == None:
         writeClassNames(classNames, classesPath)
     else:
         writeClassNames(classFilter, classesPath)
+
+def _createDbLetterboxCache(data, cocoImgDir, cocoImgs, targetImgDir, dim, numWorkers):
+    imgPaths = []
+    imgIds = []
+    for imgId, imgFilename in zip(data['imgIds'].tolist(), data['fileNames']):
+        if imgFilename in cocoImgs:
+            imgPaths.append(os.path.join(cocoImgDir, imgFilename))
+            imgIds.append(imgId)
+    print("Creating letterbox cache for {} images...".format(len(imgPaths)))
+    indexFile = createLetterboxCache(imgPaths, imgIds, targetImgDir, dim, numWorkers)
+    if indexFile != None:
+        print("...done! Index written to {}".format(indexFile))
+
+def _createTargetDb(coco, cocoImgDir, cocoImgs, targetDir, db, newDb, classFilter, 
+                    balance, skipCrowd, copyMode, numWorkers, incremental, outputFormat, 
+                    letterboxDim):
+    if incremental:
+        # update the database in place, only changed files are rewritten
+        targetImgDir = os.path.join(targetDir, "{}_{}".format(db, newDb))
+        if not os.path.isdir(targetImgDir):
+            os.makedirs(targetImgDir)
+    else:
+        targetImgDir = _makeTargetDir(targetDir, db, newDb)
+        if targetImgDir is None:
+            return
+    print("target dir will be {}".format(targetImgDir))
+    
+    data = filterCocoYolo(coco, classFilter, skipCrowd, balance)
+    if data is None:
+        return
+    classCnt = data['classCnt']
+    classNames = data['classNames']
+    
+    if outputFormat == 'packed':
+        # shards are always rewritten completely
+        for f in glob.glob(os.path.join(targetImgDir, "shard_*.rpd")):
+            os.remove(f)
+        print("Writing packed shards...")
+        labels = normalizeYoloAnnos(data['annoImgIdx'], data['bboxes'], data['widths'], data['heights'])
+        shardFiles, numSamples = writePackedDataset(data, labels, cocoImgDir, cocoImgs, targetImgDir)
+        print("...done! Samples written: {}, shards: {}".format(numSamples, len(shardFiles)))
+        _writeDbInfo(targetImgDir, classCnt, classNames, classFilter)
+        if letterboxDim != None:
+            _createDbLetterboxCache(data, cocoImgDir, cocoImgs, targetImgDir, letterboxDim, numWorkers)
+        print("Finished creating database in {}".format(targetImgDir))
+        print("")
+        return
+    
+    manifestPath = os.path.join(targetImgDir, '_manifest.txt')
+    oldManifest = readManifest(manifestPath) if incremental else {}
+    targetFiles = _scanImageDir(targetImgDir)
+    oldHashes = {}
+    for jpgFile in oldManifest:
+        txtFile = jpgFile.replace(".jpg", ".txt")
+        if txtFile in targetFiles:
+            oldHashes[txtFile] = oldManifest[jpgFile][0]
+
+    print("Writing yolo annotation files...")    
+    txtPaths, labelHashes = writeYoloAnnos(data, targetImgDir, oldHashes)
+    numUnchanged = len([h for f, h in zip(txtPaths, labelHashes) if oldHashes.get(os.path.basename(f)) == h])
+    print("...done! Files written: {}, unchanged: {}".format(len(txtPaths)-numUnchanged, numUnchanged))
+    
+    print("Writing filelist, stats and class names...")
+    filelistPath = os.path.join(targetImgDir, '_filelist.txt')
+    writeFilelist(sorted(txtPaths), filelistPath)    
+    _writeDbInfo(targetImgDir, classCnt, classNames, classFilter)
     print("...done!")
         
-    print("Copying {} image files to target dir {}...".format(len(txtPaths), targetImgDir))
+    print("Adding {} image files to target dir {}...".format(len(txtPaths), targetImgDir))
+    manifest = {}
     jpgPaths = []
-    for i in range(len(txtPaths)):
-        f = txtPaths[i]
+    for f, labelHash in sorted(zip(txtPaths, labelHashes)):
         jpgFile = os.path.basename(f)
         jpgFile = jpgFile.replace(".txt", ".jpg")
-        jpgFile = os.path.join(cocoImgDir, jpgFile)
-        if os.path.exists(jpgFile):
-            jpgPaths.append(jpgFile)
+        srcStat = (-1, -1)
+        if jpgFile in cocoImgs:
+            srcPath = os.path.join(cocoImgDir, jpgFile)
+            st = os.stat(srcPath)
+            srcStat = (st.st_size, st.st_mtime_ns)
+            old = oldManifest.get(jpgFile)
+            if (old is None) or (old[1:] != srcStat) or (not jpgFile in targetFiles):
+                _removeFile(os.path.join(targetImgDir, jpgFile))
+                jpgPaths.append(srcPath)
         else:
-            print("Could not find image file {}".format(jpgFile))
-            continue
+            print("Could not find image file {}".format(os.path.join(cocoImgDir, jpgFile)))
+        manifest[jpgFile] = (labelHash,) + srcStat
         
-    numThreads = 4
-    startIdx = 0
-    endIdx = 0
-    numPerThread = int(len(jpgPaths)/numThreads)
-    thrds = []
-    print("Start copying image files using {} threads...this might take a while...".format(numThreads))
-    for i in range(numThreads):
-        startIdx = endIdx
-        endIdx += numPerThread
-        if (i==numThreads-1):
-            endIdx = len(jpgPaths)            
-        workSet = jpgPaths[startIdx:endIdx]
-        isOutputThread = (i==0)
-        t = threading.Thread(target=thrdCopyFiles, args=(workSet,targetImgDir,isOutputThread,))
-        t.start()
-        thrds.append(t)
+    # remove images and labels which are not part of the database anymore
+    numRemoved = 0
+    for f in targetFiles:
+        name, ext = os.path.splitext(f)
+        if name.startswith("_") or not ext in (".jpg", ".txt"):
+            continue
+        if not (name + ".jpg") in manifest:
+            _removeFile(os.path.join(targetImgDir, f))
+            numRemoved += 1
+    if numRemoved > 0:
+        print("Removed {} outdated files".format(numRemoved))
         
-    for t in thrds:
-        t.join()
-    print("")
+    print("Start materializing {} image files (mode {})...this might take a while...".format(len(jpgPaths), copyMode))
+    materializeFiles(jpgPaths, targetImgDir, copyMode, numWorkers)
+    writeManifest(manifest, manifestPath)
+    if letterboxDim != None:
+        _createDbLetterboxCache(data, cocoImgDir, cocoImgs, targetImgDir, letterboxDim, numWorkers)
     print("Finished creating database in {}".format(targetImgDir))
     print("")
-                
+
+def _createDb(cocoDir, targetDir, db, dbSpecs, copyMode, numWorkers, incremental, outputFormat,
+              letterboxDim):
+    cocoImgDir = os.path.join(cocoDir, db)
+    if not os.path.isdir(cocoImgDir):
+        print("Could not find coco image directory {}".format(cocoImgDir))
+        return
+    
+    annoDir = os.path.join(cocoDir, "annotations")
+    if not os.path.isdir(annoDir):
+        print("Could not find annotation folder {}".format(annoDir))
+        return
+
+    annoFile = os.path.join(annoDir, "instances_{}.json".format(db))
+    if not os.path.isfile(annoFile):
+        print("Could not find annotation file {}".format(annoFile))
+        return
+    
+    # annotations and image dir are read only once for all target databases
+    coco = readCocoJson(annoFile)
+    if coco is None:
+        return
+    cocoImgs = _scanImageDir(cocoImgDir)
+    
+    for newDb, classFilter, balance, skipCrowd in dbSpecs:
+        print("creating database {}_{}".format(db, newDb))
+        _createTargetDb(coco, cocoImgDir, cocoImgs, targetDir, db, newDb, classFilter,
+                        balance, skipCrowd, copyMode, numWorkers, incremental, outputFormat,
+                        letterboxDim)
 
 def createYoloDatabase(cocoDir, targetDir=None, classFilter=None, newDbName=None, 
-                       balance=False, skipCrowd=True, valOnly=False):
+                       balance=False, skipCrowd=True, valOnly=False, 
+                       copyMode='copy', numWorkers=None, dbSpecs=None, incremental=False,
+                       outputFormat='files', letterboxDim=None):
+    # dbSpecs: list of (newDbName, classFilter, balance, skipCrowd) to create 
+    # several databases in one run. If None, a single database is created 
+    # from newDbName, classFilter, balance and skipCrowd.
+    # incremental: update existing databases in place using their manifest 
+    # instead of creating new ones
+    # outputFormat: 'files' writes a label and an image file per sample,
+    # 'packed' writes a few large shard files (see packedDataset)
+    # letterboxDim: if set (e.g. 208 or (208, 208)), an additional cache of 
+    # letterboxed images at network resolution is created (see letterboxCache)
+    
     # check paths
     if not os.path.exists(cocoDir):
         print("Could not find dir {}".format(cocoDir))
@@ -306,11 +503,27 @@ def createYoloDatabase(cocoDir, targetDir=None, classFilter=None, newDbName=None
     
     targetDir = os.path.abspath(targetDir)
     
+    if not copyMode in COPY_MODES:
+        print("Unknown copy mode {}: must be one of {}".format(copyMode, COPY_MODES))
+        return
+    
+    if not outputFormat in OUTPUT_FORMATS:
+        print("Unknown output format {}: must be one of {}".format(outputFormat, OUTPUT_FORMATS))
+        return
+    
+    if dbSpecs == None:
+        dbSpecs = [(newDbName, classFilter, balance, skipCrowd)]
+    
+    for spec in dbSpecs:
+        if len(spec) != 4:
+            print("Invalid database spec {}: must be (newDbName, classFilter, balance, skipCrowd)".format(spec))
+            return
+    
     cocoDbs = ['val2017']
     if not valOnly:
         cocoDbs.append('train2017')
         
     for db in cocoDbs:
         print("processing database {}".format(db))
-        _createDb(cocoDir, targetDir, db, newDbName, classFilter, balance, skipCrowd)
-        
\ No newline at end of file
+        _createDb(cocoDir, targetDir, db, dbSpecs, copyMode, numWorkers, incremental, outputFormat,
+                  letterboxDim)
@@ -0,0 +1,163 @@
+import os
+import glob
+import time
+import numpy as np
+from .darknetWeights import DarknetWeights, parseCfg
+
+# NumPy forward pass of a darknet network, computed like darknet does on
+# the cpu. It is the reference for converted models: forward() returns the
+# output of every darknet layer. The region layer is not applied, its
+# output is the raw output of the last convolution like on the NCS.
+
+IMG_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+def imageFiles(images, numImages=None):
+    # images: list of image files or directories
+    files = []
+    for path in images:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, "*")))
+        else:
+            files.append(path)
+    return [f for f in files if f.lower().endswith(IMG_EXTS)][:numImages]
+
+def loadImages(images, shape, numImages=4, seed=0):
+    # images: list of image files or directories, None for random images.
+    # Returns the network inputs (channels x height x width, RGB in [0,1])
+    # and their names.
+    if not images:
+        rng = np.random.RandomState(seed)
+        return [rng.rand(*shape).astype(np.float32) for i in range(numImages)], \
+               ["random{}".format(i) for i in range(numImages)]
+    files = imageFiles(images, numImages)
+    import cv2
+    data = []
+    for f in files:
+        img = cv2.imread(f)
+        img = cv2.resize(img, (shape[2], shape[1]))
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.
+        data.append(np.ascontiguousarray(np.transpose(img, (2, 0, 1))))
+    return data, [os.path.splitext(os.path.basename(f))[0] for f in files]
+
+def _activate(x, activation):
+    if activation == 'leaky':
+        return np.where(x > 0, x, .1 * x)
+    elif activation == 'relu':
+        return np.maximum(x, 0)
+    elif activation == 'logistic':
+        return 1. / (1. + np.exp(-x))
+    return x
+
+def _batchNorm(x, params):
+    shape = (-1,) + (1,) * (x.ndim - 1)
+    x = (x - params['mean'].reshape(shape)) / (np.sqrt(params['variance']).reshape(shape) + .000001)
+    return x * params['scales'].reshape(shape)
+
+def _windows(x, size, stride):
+    # view of all size x size windows of x (c, h, w): (c, size, size, outH, outW)
+    c, h, w = x.shape
+    outH = (h - size) // stride + 1
+    outW = (w - size) // stride + 1
+    s = x.strides
+    return np.lib.stride_tricks.as_strided(x, (c, size, size, outH, outW),
+                                           (s[0], s[1], s[2], s[1]*stride, s[2]*stride))
+
+def _convolution(x, weights, size, stride, pad, groups):
+    if pad > 0:
+        x = np.pad(x, ((0, 0), (pad, pad), (pad, pad)), 'constant')
+    cols = _windows(np.ascontiguousarray(x), size, stride)
+    if groups == 1:
+        return np.tensordot(weights, cols, axes=3)
+    n = weights.shape[0] // groups
+    c = x.shape[0] // groups
+    return np.concatenate([np.tensordot(weights[g*n:(g+1)*n], cols[g*c:(g+1)*c], axes=3)
+                           for g in range(groups)])
+
+def _maxpool(x, size, stride, pad):
+    c, h, w = x.shape
+    outH = (h + pad - size) // stride + 1
+    outW = (w + pad - size) // stride + 1
+    # darknet pads pad/2 at the start and the rest at the end with -inf
+    xp = np.full((c, max(h + pad, (outH - 1)*stride + size), max(w + pad, (outW - 1)*stride + size)),
+                 -np.inf, dtype=x.dtype)
+    xp[:, pad//2:pad//2+h, pad//2:pad//2+w] = x
+    return _windows(xp, size, stride)[:, :, :, :outH, :outW].max(axis=(1, 2))
+
+def _reorg(x, stride):
+    # darknet's reorg layer (reorg_cpu with forward=0)
+    c, h, w = x.shape
+    outC = c // (stride*stride)
+    xr = x.reshape(outC, h, stride, w, stride)
+    return np.ascontiguousarray(xr.transpose(2, 4, 0, 1, 3)).reshape(c*stride*stride, h // stride, w // stride)
+
+class DarknetReference(object):
+    # actScales: max. absolute output per layer for int8 activations (see
+    # calibrateActivations), None for float activations
+    def __init__(self, cfgFile, weightsFile, actScales=None):
+        self.actScales = actScales
+        self.sections = parseCfg(cfgFile)
+        self.weights = DarknetWeights(cfgFile, weightsFile)
+        self.layers = self.weights.layers
+        net = self.sections[0][1]
+        self.inputShape = (int(net.get('channels', 3)), int(net['height']), int(net['width']))
+
+    def forward(self, data, times=None):
+        # data: input image (channels x height x width, RGB in [0,1]).
+        # Returns the outputs of all layers, times gets the seconds per layer.
+        outputs = []
+        x = np.asarray(data, dtype=np.float32)
+        for layer, (ltype, items) in zip(self.layers, self.sections[1:]):
+            t = time.time()
+            params = layer['params']
+            if ltype == 'convolutional':
+                size = int(items.get('size', 1))
+                stride = int(items.get('stride', 1))
+                pad = size // 2 if int(items.get('pad', 0)) else int(items.get('padding', 0))
+                x = _convolution(x, params['weights'], size, stride, pad, int(items.get('groups', 1)))
+                if 'scales' in params:
+                    x = _batchNorm(x, params)
+                x = _activate(x + params['biases'].reshape(-1, 1, 1), items.get('activation', 'logistic'))
+            elif ltype == 'connected':
+                x = params['weights'].dot(x.reshape(-1))
+                if 'scales' in params:
+                    x = _batchNorm(x, params)
+                x = _activate(x + params['biases'], items.get('activation', 'logistic')).reshape(-1, 1, 1)
+            elif ltype == 'maxpool':
+                stride = int(items.get('stride', 1))
+                size = int(items.get('size', stride))
+                x = _maxpool(x, size, stride, int(items.get('padding', size - 1)))
+            elif ltype == 'avgpool':
+                x = x.mean(axis=(1, 2)).reshape(-1, 1, 1)
+            elif ltype == 'route':
+                idx = [int(i) for i in items['layers'].split(',')]
+                x = np.concatenate([outputs[i if i >= 0 else len(outputs) + i] for i in idx])
+            elif ltype == 'reorg':
+                x = _reorg(x, int(items.get('stride', 1)))
+            elif ltype == 'shortcut':
+                i = int(items['from'])
+                x = _activate(x + outputs[i if i >= 0 else len(outputs) + i], items.get('activation', 'linear'))
+            elif ltype == 'upsample':
+                stride = int(items.get('stride', 2))
+                x = x.repeat(stride, axis=1).repeat(stride, axis=2)
+            elif ltype == 'softmax':
+                e = np.exp(x - x.max())
+                x = e / e.sum()
+            x = x.astype(np.float32)
+            if self.actScales is not None and self.actScales[len(outputs)] > 0:
+                s = self.actScales[len(outputs)] / 127.
+                x = np.clip(np.round(x / s), -127, 127).astype(np.float32) * s
+            outputs.append(x)
+            if times is not None:
+                times.append(time.time() - t)
+        return outputs
+
+    def layerNames(self):
+        return ["{}{}".format(ltype, i) for i, (ltype, items) in enumerate(self.sections[1:len(self.layers)+1])]
+
+def calibrateActivations(ref, data, percentile=99.99):
+    # int8 scales of all layer outputs of ref for the calibration images data
+    values = [[] for l in ref.layers]
+    for x in data:
+        for i, out in enumerate(ref.forward(x)):
+            values[i].append(np.percentile(np.abs(out), percentile))
+    return [float(np.max(v)) for v in values]
@@ -0,0 +1,167 @@
+from configparser import ConfigParser
+from collections import OrderedDict
+import logging
+import numpy as np
+
+PRECISIONS = ['fp32', 'fp16', 'int8']
+
+# Reads darknet .weights files without caffe. The file is memory mapped
+# once and every layer gets views of its parameters, the shapes are derived
+# from the .cfg file. The file starts with major, minor and revision (int32)
+# and the number of seen images (int64 since version 0.2, int32 before),
+# followed by the float32 parameters of all layers in cfg order:
+#   convolutional: biases, [scales, mean, variance], weights
+#   connected:     biases, weights, [scales, mean, variance]
+
+class uniqdict(OrderedDict):
+    _unique = 0
+    def __setitem__(self, key, val):
+        if isinstance(val, OrderedDict):
+            self._unique += 1
+            key += "_"+str(self._unique)
+        OrderedDict.__setitem__(self, key, val)
+
+def parseCfg(cfgFile):
+    # returns the sections of a darknet cfg file as a list of (type, items)
+    parser = ConfigParser(dict_type=uniqdict, strict=False)
+    parser.read(cfgFile)
+    return [(section.split('_')[0], dict(parser.items(section))) for section in parser.sections()]
+
+def _int(items, key, default):
+    return int(items[key]) if key in items else default
+
+class DarknetWeights(object):
+    def __init__(self, cfgFile, weightsFile):
+        self.mm = np.memmap(weightsFile, dtype=np.uint8, mode='r')
+        self.major, self.minor, self.revision = [int(v) for v in self.mm[:12].view(np.int32)]
+        if self.major*10 + self.minor >= 2:
+            self.seen = int(self.mm[12:20].view(np.int64)[0])
+            headerSize = 20
+        else:
+            self.seen = int(self.mm[12:16].view(np.int32)[0])
+            headerSize = 16
+        # weights of connected layers are stored transposed
+        self.transpose = self.major > 1000 or self.minor > 1000
+        self.headerSize = headerSize
+        numFloats = (len(self.mm) - headerSize) // 4
+        self.data = self.mm[headerSize:headerSize+numFloats*4].view(np.float32)
+        self.count = 0
+        self.offsets = []
+        self.layers = []
+        self._parse(parseCfg(cfgFile))
+        if self.count != len(self.data):
+            print("ERROR: size mismatch: {} of {} weights used".format(self.count, len(self.data)))
+
+    def _take(self, shape):
+        size = int(np.prod(shape))
+        if self.count + size > len(self.data):
+            raise ValueError("no weights left")
+        self.offsets.append(self.count)
+        view = self.data[self.count:self.count+size].reshape(shape)
+        self.count += size
+        return view
+
+    def _takeBatchNorm(self, n, params):
+        params['scales'] = self._take((n,))
+        params['mean'] = self._take((n,))
+        params['variance'] = self._take((n,))
+
+    def _parse(self, sections):
+        net = sections[0][1]
+        # output shape (channels, height, width) of every layer
+        shapes = []
+        shape = (_int(net, 'channels', 3), _int(net, 'height', 0), _int(net, 'width', 0))
+        for ltype, items in sections[1:]:
+            c, h, w = shape
+            params = OrderedDict()
+            weights = None
+            try:
+                if ltype == 'convolutional':
+                    n = int(items['filters'])
+                    size = _int(items, 'size', 1)
+                    stride = _int(items, 'stride', 1)
+                    groups = _int(items, 'groups', 1)
+                    pad = size // 2 if _int(items, 'pad', 0) else _int(items, 'padding', 0)
+                    params['biases'] = self._take((n,))
+                    if _int(items, 'batch_normalize', 0):
+                        self._takeBatchNorm(n, params)
+                    params['weights'] = self._take((n, c // groups, size, size))
+                    weights = (self.offsets[-1], (n, -1))
+                    shape = (n, (h + 2*pad - size) // stride + 1, (w + 2*pad - size) // stride + 1)
+                elif ltype == 'connected':
+                    n = int(items['output'])
+                    params['biases'] = self._take((n,))
+                    if self.transpose:
+                        params['weights'] = self._take((c*h*w, n)).T
+                        weights = (self.offsets[-1], (-1, n))
+                    else:
+                        params['weights'] = self._take((n, c*h*w))
+                        weights = (self.offsets[-1], (n, -1))
+                    if _int(items, 'batch_normalize', 0):
+                        self._takeBatchNorm(n, params)
+                    shape = (n, 1, 1)
+                elif ltype == 'maxpool':
+                    stride = _int(items, 'stride', 1)
+                    size = _int(items, 'size', stride)
+                    pad = _int(items, 'padding', size - 1)
+                    shape = (c, (h + pad - size) // stride + 1, (w + pad - size) // stride + 1)
+                elif ltype == 'avgpool':
+                    shape = (c, 1, 1)
+                elif ltype == 'reorg':
+                    stride = _int(items, 'stride', 1)
+                    shape = (c*stride*stride, h // stride, w // stride)
+                elif ltype == 'upsample':
+                    stride = _int(items, 'stride', 2)
+                    shape = (c, h*stride, w*stride)
+                elif ltype == 'route':
+                    idx = [int(i) for i in items['layers'].split(',')]
+                    idx = [i if i >= 0 else len(shapes) + i for i in idx]
+                    shape = (sum(shapes[i][0] for i in idx), shapes[idx[0]][1], shapes[idx[0]][2])
+                elif not ltype in ['dropout', 'softmax', 'region', 'shortcut', 'cost', 'crop']:
+                    logging.warning("{} layer is not supported".format(ltype))
+            except ValueError as e:
+                print("WARNING: {} for layer {} ({})".format(e, len(shapes), ltype))
+                break
+            # weights: offset and shape of the weights in the file, for quantize
+            self.layers.append({'type': ltype, 'index': len(shapes), 'params': params, 'weights': weights})
+            shapes.append(shape)
+        self.shapes = shapes
+
+    def paramLayers(self):
+        # layers with parameters, in the order of the file
+        return [l for l in self.layers if len(l['params']) > 0]
+
+    def quantize(self, precision):
+        # returns a copy of all parameters rounded to precision: fp16, or
+        # int8 weights with one symmetric scale per output channel (biases
+        # and batch norm stay float, like int8 inference keeps them in int32)
+        data = np.array(self.data)
+        if precision == 'fp16':
+            return data.astype(np.float16).astype(np.float32)
+        elif precision == 'int8':
+            for layer in self.paramLayers():
+                offset, shape = layer['weights']
+                size = layer['params']['weights'].size
+                w = data[offset:offset+size].reshape(shape)
+                if shape[0] == -1:
+                    w = w.T
+                scale = np.abs(w).max(axis=1, keepdims=True) / 127.
+                scale[scale == 0] = 1.
+                w[...] = np.round(w / scale) * scale
+        return data
+
+    def save(self, filename, data=None):
+        # writes a .weights file with the header of this file and data
+        with open(filename, "wb") as fh:
+            fh.write(self.mm[:self.headerSize].tobytes())
+            fh.write(np.asarray(self.data if data is None else data, dtype=np.float32).tobytes())
+
+def foldBatchNormParams(params):
+    # folds the batch norm of a convolutional layer into its weights and
+    # biases, like darknet: y = scales * (x - mean) / (sqrt(variance) + .000001) + biases
+    if not 'scales' in params:
+        return params['weights'], params['biases']
+    factor = params['scales'] / (np.sqrt(params['variance']) + .000001)
+    weights = params['weights'] * factor.reshape((-1,) + (1,) * (params['weights'].ndim - 1))
+    biases = params['biases'] - params['mean'] * factor
+    return weights.astype(np.float32), biases.astype(np.float32)
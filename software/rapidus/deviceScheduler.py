@@ -0,0 +1,182 @@
+import time
+import threading
+from collections import deque
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+# Dispatches tensors to several graphs (one per Neural Compute Stick) and
+# returns the results in submission order. Every graph is driven by its own
+# thread, so all sticks compute in parallel. A graph is any object with the
+# methods LoadTensor(tensor, userobj) and GetResult() -> (out, userobj) of
+# the NCAPI graph, e.g. FakeGraph below. If a graph fails, the result of
+# the tensor is an InferenceError instead of the output.
+POLICIES = ['roundrobin', 'leastloaded']
+
+_STOP = object()
+
+class InferenceError(Exception):
+    # delivered as out for a tensor which could not be computed
+    def __init__(self, graph, error):
+        super(InferenceError, self).__init__("graph {}: {}".format(graph, error))
+        self.graph = graph
+        self.error = error
+
+class FakeGraph(object):
+    # in-process stand-in for a NCAPI graph: computes func(tensor) and
+    # needs computeTime seconds per tensor, one tensor after the other
+    def __init__(self, computeTime=0.01, func=None, maxQueue=2):
+        self.computeTime = computeTime
+        self.func = func
+        self.maxQueue = maxQueue
+        self.queue = deque()
+        self.busyUntil = 0.
+        self.lock = threading.Lock()
+
+    def LoadTensor(self, tensor, userobj):
+        with self.lock:
+            if len(self.queue) >= self.maxQueue:
+                raise RuntimeError("FakeGraph: queue is full")
+            self.busyUntil = max(time.time(), self.busyUntil) + self.computeTime
+            out = tensor if self.func is None else self.func(tensor)
+            self.queue.append((self.busyUntil, out, userobj))
+
+    def GetResult(self):
+        with self.lock:
+            readyAt, out, userobj = self.queue.popleft()
+        time.sleep(max(0., readyAt - time.time()))
+        return out, userobj
+
+    def DeallocateGraph(self):
+        pass
+
+class DeviceScheduler(object):
+    def __init__(self, graphs, policy='leastloaded', maxInFlight=2):
+        if not policy in POLICIES:
+            raise ValueError("Unknown scheduling policy {}, use one of {}".format(policy, POLICIES))
+        self.graphs = graphs
+        self.policy = policy
+        self.maxInFlight = maxInFlight
+        # tensors which are queued or computed per graph
+        self.load = [0] * len(graphs)
+        self.nextGraph = 0
+        self.nextSeq = 0
+        self.nextOut = 0
+        # reorder buffer: seq -> (out, userobj)
+        self.done = {}
+        self.cond = threading.Condition()
+        self.queues = [Queue() for g in graphs]
+        self.threads = []
+        for i in range(len(graphs)):
+            thrd = threading.Thread(target=self._worker, args=(i,))
+            thrd.daemon = True
+            thrd.start()
+            self.threads.append(thrd)
+
+    def _worker(self, i):
+        graph = self.graphs[i]
+        queue = self.queues[i]
+        inFlight = deque()
+        stop = False
+        while not stop or len(inFlight) > 0:
+            item = None
+            if not stop and len(inFlight) < self.maxInFlight:
+                try:
+                    # only wait for new tensors if the graph is idle
+                    item = queue.get(block=(len(inFlight) == 0))
+                except Empty:
+                    pass
+            if item is _STOP:
+                stop = True
+                continue
+            if item is not None:
+                seq, tensor, userobj = item
+                try:
+                    graph.LoadTensor(tensor, userobj)
+                    inFlight.append((seq, userobj))
+                except Exception as e:
+                    print("Error: Could not load tensor on graph {}: {}".format(i, e))
+                    self._finish(i, seq, InferenceError(i, e), userobj)
+                # transfer the next tensor while this one is computed
+                if len(inFlight) < self.maxInFlight and not queue.empty():
+                    continue
+            if len(inFlight) > 0:
+                seq, userobj = inFlight.popleft()
+                try:
+                    out, userobj = graph.GetResult()
+                except Exception as e:
+                    # the graph returns the results in order, so the failed
+                    # one belongs to the oldest tensor in flight
+                    print("Error: Could not get result from graph {}: {}".format(i, e))
+                    out = InferenceError(i, e)
+                self._finish(i, seq, out, userobj)
+
+    def _finish(self, i, seq, out, userobj):
+        with self.cond:
+            self.done[seq] = (out, userobj)
+            self.load[i] -= 1
+            self.cond.notify_all()
+
+    def _selectGraph(self):
+        numGraphs = len(self.graphs)
+        if self.policy == 'roundrobin':
+            for k in range(numGraphs):
+                i = (self.nextGraph + k) % numGraphs
+                if self.load[i] < self.maxInFlight:
+                    break
+        else:
+            # least loaded graph, ties are broken round robin
+            order = [(self.nextGraph + k) % numGraphs for k in range(numGraphs)]
+            i = min(order, key=lambda j: self.load[j])
+        self.nextGraph = (i + 1) % numGraphs
+        return i
+
+    def _ready(self):
+        # results which are next in sequence, must hold self.cond
+        results = []
+        while self.nextOut in self.done:
+            results.append(self.done.pop(self.nextOut))
+            self.nextOut += 1
+        return results
+
+    def pending(self):
+        return self.nextSeq - self.nextOut
+
+    def Submit(self, tensor, userobj=None):
+        # queues tensor and returns the results which are finished in
+        # sequence so far as a list of (out, userobj), oldest first
+        with self.cond:
+            while min(self.load) >= self.maxInFlight:
+                self.cond.wait()
+            i = self._selectGraph()
+            self.load[i] += 1
+            seq = self.nextSeq
+            self.nextSeq += 1
+            self.queues[i].put((seq, tensor, userobj))
+            return self._ready()
+
+    def Collect(self):
+        # waits for the oldest submitted tensor, returns (out, userobj)
+        with self.cond:
+            if self.nextOut == self.nextSeq:
+                return None
+            while not self.nextOut in self.done:
+                self.cond.wait()
+            res = self.done.pop(self.nextOut)
+            self.nextOut += 1
+            return res
+
+    def Flush(self):
+        done = []
+        while self.pending() > 0:
+            done.append(self.Collect())
+        return done
+
+    def Close(self):
+        self.Flush()
+        for queue in self.queues:
+            queue.put(_STOP)
+        for thrd in self.threads:
+            thrd.join()
+        self.threads = []
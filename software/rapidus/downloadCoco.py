@@ -1,48 +1,512 @@
-def downloadCoco(targetDir, valOnly=False):
-    annosUrl = "http://images.cocodataset.org/annotations/annotations_trainval2017.zip"
-    valUrl   = "http://images.cocodataset.org/zips/val2017.zip"
-    trainUrl = "http://images.cocodataset.org/zips/train2017.zip"
-    
+import os
+import sys
+import struct
+import zlib
+import hashlib
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from urllib.request import Request, urlopen
+
+COCO_URL   = "http://images.cocodataset.org"
+ANNOS_PATH = "/annotations/annotations_trainval2017.zip"
+VAL_PATH   = "/zips/val2017.zip"
+TRAIN_PATH = "/zips/train2017.zip"
+
+# published md5 sums of the COCO zips, used by downloadCoco by default
+COCO_CHECKSUMS = {
+    "annotations_trainval2017.zip": "md5:f4bbac642086de4f52a3fdda2de5fa2c",
+    "val2017.zip":                  "md5:442b8da7639aecaf257c1dceb8ba8c80",
+    "train2017.zip":                "md5:cced6f7f71b7629ddf16f17bbcfab6b2",
+}
+
+LOCAL_HEADER_SIG = 0x04034b50
+LOCAL_HEADER_LEN = 30
+BLOCK_SIZE = 1<<20
+
+class _DownloadProgress(object):
+    # keeps track of the downloaded chunks and of the contiguous part at the
+    # beginning of the file, which can already be read by the extractor
+    def __init__(self, size, chunkSize, doneChunks):
+        self.size = size
+        self.chunkSize = chunkSize
+        self.numChunks = int((size + chunkSize - 1) / chunkSize)
+        self.done = [False]*self.numChunks
+        for i in doneChunks:
+            self.done[i] = True
+        self.firstMissing = 0
+        self.failed = False
+        self.finished = False
+        self.cond = threading.Condition()
+        self.percent = -1
+        self._advance()
+
+    def _advance(self):
+        while self.firstMissing < self.numChunks and self.done[self.firstMissing]:
+            self.firstMissing += 1
+
+    def available(self):
+        return min(self.size, self.firstMissing * self.chunkSize)
+
+    def chunkDone(self, i):
+        with self.cond:
+            self.done[i] = True
+            self._advance()
+            self.cond.notify_all()
+            percent = int(100 * sum(self.done) / max(1, self.numChunks))
+            if percent > self.percent:
+                self.percent = percent
+                sys.stdout.write(" {}%".format(percent))
+                sys.stdout.flush()
+
+    def setFailed(self):
+        with self.cond:
+            self.failed = True
+            self.cond.notify_all()
+
+    def setFinished(self):
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+
+    def waitFor(self, end):
+        # blocks until the first end bytes are downloaded, returns False if
+        # they will never be available
+        with self.cond:
+            while self.available() < end and not self.failed:
+                if self.finished and self.available() < end:
+                    return False
+                self.cond.wait()
+            return self.available() >= end
+
+def _urlInfo(url):
+    req = Request(url, method="HEAD")
+    resp = urlopen(req, timeout=60)
+    size = int(resp.headers.get("Content-Length", -1))
+    acceptRanges = resp.headers.get("Accept-Ranges", "none").lower() == "bytes"
+    resp.close()
+    return size, acceptRanges
+
+def _readState(stateFile, size, chunkSize):
+    # the state file contains "size chunkSize" followed by the finished chunks
+    if not os.path.isfile(stateFile):
+        return []
+    with open(stateFile, "r") as fh:
+        lines = fh.read().split("\n")
+    if lines[0] != "{} {}".format(size, chunkSize):
+        return []
+    doneChunks = []
+    for line in lines[1:]:
+        try:
+            doneChunks.append(int(line))
+        except ValueError:
+            pass
+    return doneChunks
+
+def _downloadChunks(url, partFile, queue, progress, stateFh, stateLock, retries):
+    with open(partFile, "r+b") as fh:
+        while not progress.failed:
+            try:
+                i = queue.get_nowait()
+            except Empty:
+                return
+            start = i * progress.chunkSize
+            end = min(progress.size, start + progress.chunkSize)
+            ok = False
+            for attempt in range(retries):
+                try:
+                    req = Request(url, headers={"Range": "bytes={}-{}".format(start, end-1)})
+                    resp = urlopen(req, timeout=60)
+                    if resp.status != 206:
+                        raise IOError("server ignored range request (status {})".format(resp.status))
+                    fh.seek(start)
+                    pos = start
+                    while pos < end:
+                        data = resp.read(min(BLOCK_SIZE, end - pos))
+                        if not data:
+                            break
+                        fh.write(data)
+                        pos += len(data)
+                    resp.close()
+                    if pos != end:
+                        raise IOError("incomplete chunk {}".format(i))
+                    ok = True
+                    break
+                except (IOError, OSError) as e:
+                    err = e
+            if not ok:
+                print("Could not download chunk {} of {}: {}".format(i, url, err))
+                progress.setFailed()
+                return
+            fh.flush()
+            with stateLock:
+                stateFh.write("{}\n".format(i))
+                stateFh.flush()
+            progress.chunkDone(i)
+
+def _downloadStream(url, partFile, progress):
+    # fallback for servers without range support: one connection, no resume
+    try:
+        resp = urlopen(url, timeout=60)
+        with open(partFile, "r+b") as fh:
+            pos = 0
+            chunk = 0
+            while True:
+                data = resp.read(BLOCK_SIZE)
+                if not data:
+                    break
+                fh.write(data)
+                pos += len(data)
+                while (chunk < progress.numChunks) and (pos >= min(progress.size, (chunk+1)*progress.chunkSize)):
+                    fh.flush()
+                    progress.chunkDone(chunk)
+                    chunk += 1
+        resp.close()
+        # size 0: the server did not send the size
+        if progress.size > 0 and pos != progress.size:
+            print("Incomplete download of {}".format(url))
+            progress.setFailed()
+    except (IOError, OSError) as e:
+        print("Could not download {}: {}".format(url, e))
+        progress.setFailed()
+
+def _fileChecksum(filename, algo):
+    h = hashlib.new(algo)
+    with open(filename, "rb") as fh:
+        while True:
+            data = fh.read(BLOCK_SIZE)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+def verifyChecksum(filename, checksum):
+    # checksum: "<algo>:<hexdigest>", e.g. "md5:0123..."
+    algo, digest = checksum.split(":", 1)
+    return _fileChecksum(filename, algo) == digest.lower()
+
+def _memberPath(targetDir, name):
+    # never write outside of targetDir
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    return os.path.join(targetDir, *parts)
+
+def _extractMember(zipFile, dataOffset, compSize, size, method, crc, targetPath):
+    try:
+        return _extractMemberData(zipFile, dataOffset, compSize, size, method, crc, targetPath)
+    except (IOError, OSError, zlib.error) as e:
+        print("Could not extract {}: {}".format(targetPath, e))
+        return False
+
+def _extractMemberData(zipFile, dataOffset, compSize, size, method, crc, targetPath):
+    if os.path.isfile(targetPath) and os.path.getsize(targetPath) == size:
+        return True
+    dirname = os.path.dirname(targetPath)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname, exist_ok=True)
+
+    if method == zipfile.ZIP_DEFLATED:
+        decomp = zlib.decompressobj(-15)
+    elif method != zipfile.ZIP_STORED:
+        return False
+
+    tmpPath = targetPath + ".tmp"
+    crcOut = 0
+    with open(zipFile, "rb") as fhIn, open(tmpPath, "wb") as fhOut:
+        fhIn.seek(dataOffset)
+        left = compSize
+        while left > 0:
+            data = fhIn.read(min(BLOCK_SIZE, left))
+            if not data:
+                break
+            left -= len(data)
+            if method == zipfile.ZIP_DEFLATED:
+                data = decomp.decompress(data)
+            crcOut = zlib.crc32(data, crcOut)
+            fhOut.write(data)
+        if method == zipfile.ZIP_DEFLATED:
+            data = decomp.flush()
+            crcOut = zlib.crc32(data, crcOut)
+            fhOut.write(data)
+    if (crcOut & 0xffffffff) != crc:
+        print("CRC error in {}".format(targetPath))
+        os.remove(tmpPath)
+        return False
+    os.replace(tmpPath, targetPath)
+    return True
+
+def _streamingUnzip(zipFile, progress, targetDir, pool, memberFilter, jobs):
+    # walks the local file headers of a zip file while it is downloaded and
+    # extracts each member as soon as its data is complete. Stops at the
+    # central directory or at entries whose sizes are not known in advance
+    # (these are handled by extractZip after the download).
+    offset = 0
+    with open(zipFile, "rb") as fh:
+        while True:
+            if not progress.waitFor(offset + LOCAL_HEADER_LEN):
+                return
+            fh.seek(offset)
+            header = fh.read(LOCAL_HEADER_LEN)
+            (sig, _, flags, method, _, _, crc, compSize, size,
+             nameLen, extraLen) = struct.unpack("<IHHHHHIIIHH", header)
+            if sig != LOCAL_HEADER_SIG:
+                return
+            if not progress.waitFor(offset + LOCAL_HEADER_LEN + nameLen + extraLen):
+                return
+            name = fh.read(nameLen)
+            extra = fh.read(extraLen)
+            if (flags & 0x08) or (flags & 0x01):
+                # data descriptor or encryption
+                return
+            if compSize == 0xffffffff or size == 0xffffffff:
+                # both sizes are in the zip64 extra field
+                pos = 0
+                while pos + 4 <= len(extra):
+                    tag, tagLen = struct.unpack("<HH", extra[pos:pos+4])
+                    if tag == 0x0001:
+                        size, compSize = struct.unpack("<QQ", extra[pos+4:pos+20])
+                        break
+                    pos += 4 + tagLen
+            name = name.decode("utf-8" if flags & 0x800 else "cp437")
+            dataOffset = offset + LOCAL_HEADER_LEN + nameLen + extraLen
+            offset = dataOffset + compSize
+            if name.endswith("/"):
+                continue
+            if (memberFilter is not None) and not memberFilter(name):
+                continue
+            if not progress.waitFor(offset):
+                return
+            jobs[name] = pool.submit(_extractMember, zipFile, dataOffset, compSize, size,
+                                     method, crc, _memberPath(targetDir, name))
+
+def _extractWithZipfile(zipFile, name, targetDir, handles):
+    # every thread uses its own handle of the zip file
+    zf = getattr(handles.local, "zf", None)
+    if zf is None:
+        zf = zipfile.ZipFile(zipFile, "r")
+        handles.local.zf = zf
+        with handles.lock:
+            handles.all.append(zf)
+    info = zf.getinfo(name)
+    targetPath = _memberPath(targetDir, name)
+    if os.path.isfile(targetPath) and os.path.getsize(targetPath) == info.file_size:
+        return True
+    dirname = os.path.dirname(targetPath)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    with zf.open(info) as fhIn, open(targetPath + ".tmp", "wb") as fhOut:
+        while True:
+            data = fhIn.read(BLOCK_SIZE)
+            if not data:
+                break
+            fhOut.write(data)
+    os.replace(targetPath + ".tmp", targetPath)
+    return True
+
+class _ZipHandles(object):
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.all = []
+
+def extractZip(zipFile, targetDir, numExtractors=None, memberFilter=None, skip=None):
+    # parallel extraction using the central directory. Members in skip are
+    # assumed to be extracted already.
+    if numExtractors == None:
+        numExtractors = os.cpu_count() or 1
+    with zipfile.ZipFile(zipFile, "r") as zf:
+        names = [n for n in zf.namelist() if not n.endswith("/")]
+    if memberFilter is not None:
+        names = [n for n in names if memberFilter(n)]
+    if skip is not None:
+        names = [n for n in names if not n in skip]
+    handles = _ZipHandles()
     try:
-        import wget
-    except:
-        print("Missing module 'wget': Please run")
-        print("    pip install wget")
-        return
-
-    import os.path
-    import zipfile
-    import tempfile
-    
+        with ThreadPoolExecutor(numExtractors) as pool:
+            results = list(pool.map(lambda n: _extractWithZipfile(zipFile, n, targetDir, handles), names))
+    finally:
+        for zf in handles.all:
+            zf.close()
+    return len(names), all(results)
+
+def downloadFile(url, filename, numConnections=8, chunkSize=8<<20, checksum=None,
+                 extractDir=None, numExtractors=None, memberFilter=None, retries=3):
+    # Downloads url with several connections (http range requests) into
+    # filename. Finished chunks are recorded in a state file, so an
+    # interrupted download is resumed. If extractDir is set the file is a
+    # zip file which is extracted while it is downloaded.
+    found = os.path.isfile(filename)
+    if found and checksum is not None and not verifyChecksum(filename, checksum):
+        # a corrupt file is downloaded again from scratch
+        print("Checksum mismatch for {}, downloading it again".format(filename))
+        os.remove(filename)
+        if os.path.isfile(filename + ".state"):
+            os.remove(filename + ".state")
+        found = False
+    if found:
+        print("Found {}, skipping download".format(filename))
+        size = os.path.getsize(filename)
+        progress = None
+    else:
+        try:
+            size, acceptRanges = _urlInfo(url)
+        except (IOError, OSError) as e:
+            print("Could not access {}: {}".format(url, e))
+            return False
+        if size < 0:
+            acceptRanges = False
+
+    if extractDir is not None:
+        if numExtractors == None:
+            numExtractors = os.cpu_count() or 1
+        pool = ThreadPoolExecutor(numExtractors)
+        jobs = {}
+
+    if not found:
+        partFile = filename + ".part"
+        stateFile = filename + ".state"
+        if size < 0:
+            # unknown size: no progress tracking and no resume
+            doneChunks = []
+            size = 0
+        else:
+            doneChunks = _readState(stateFile, size, chunkSize) if acceptRanges else []
+        if not os.path.isfile(partFile) or len(doneChunks) == 0:
+            with open(partFile, "wb") as fh:
+                fh.truncate(size)
+            doneChunks = []
+        if len(doneChunks) > 0:
+            print("Resuming download of {} ({} chunks done)".format(url, len(doneChunks)))
+        progress = _DownloadProgress(size, chunkSize, doneChunks)
+
+        if extractDir is not None:
+            unzipThread = threading.Thread(target=_streamingUnzip,
+                                           args=(partFile, progress, extractDir, pool, memberFilter, jobs))
+            unzipThread.start()
+        else:
+            unzipThread = None
+
+        if acceptRanges:
+            queue = Queue()
+            for i in range(progress.numChunks):
+                if not progress.done[i]:
+                    queue.put(i)
+            stateLock = threading.Lock()
+            with open(stateFile, "w") as stateFh:
+                stateFh.write("{} {}\n".format(size, chunkSize))
+                for i in range(progress.numChunks):
+                    if progress.done[i]:
+                        stateFh.write("{}\n".format(i))
+                stateFh.flush()
+                thrds = []
+                for _ in range(max(1, min(numConnections, queue.qsize()))):
+                    t = threading.Thread(target=_downloadChunks,
+                                         args=(url, partFile, queue, progress, stateFh, stateLock, retries))
+                    t.start()
+                    thrds.append(t)
+                for t in thrds:
+                    t.join()
+        else:
+            _downloadStream(url, partFile, progress)
+        progress.setFinished()
+        print("")
+        if unzipThread is not None:
+            unzipThread.join()
+        if extractDir is not None:
+            # members are extracted from the part file, so wait for them
+            pool.shutdown(wait=True)
+
+        if progress.failed or progress.available() < progress.size:
+            print("Download of {} failed, run again to resume".format(url))
+            return False
+        if checksum is not None and not verifyChecksum(partFile, checksum):
+            print("Checksum mismatch for {}".format(url))
+            os.remove(partFile)
+            if os.path.isfile(stateFile):
+                os.remove(stateFile)
+            return False
+        os.replace(partFile, filename)
+        if os.path.isfile(stateFile):
+            os.remove(stateFile)
+
+    if extractDir is None:
+        return True
+
+    # members which could not be extracted while downloading are extracted
+    # now using the central directory
+    pool.shutdown(wait=True)
+    done = set([name for name, job in jobs.items() if job.result()])
+    try:
+        num, ok = extractZip(filename, extractDir, numExtractors, memberFilter, done)
+    except zipfile.BadZipfile as e:
+        print("Could not extract {}: {}".format(filename, e))
+        return False
+    print("Extracted {} files from {} ({} while downloading)".format(len(done) + num, filename, len(done)))
+    return ok
+
+def _imageFilter(targetDir, db, classFilter):
+    # returns a member filter for the image zip of db which accepts only
+    # images with at least one annotation of the classes in classFilter
+    from .createYoloDatabase import readCocoJson, filterCocoYolo
+    annoFile = os.path.join(targetDir, "annotations", "instances_{}.json".format(db))
+    coco = readCocoJson(annoFile)
+    if coco is None:
+        return None
+    data = filterCocoYolo(coco, classFilter)
+    if data is None:
+        return None
+    names = set(["{}/{}".format(db, f) for f in data['fileNames']])
+    print("Extracting {} of {} images of {}".format(len(names), len(coco['fileNames']), db))
+    return lambda name: name in names
+
+def downloadCoco(targetDir, valOnly=False, downloadDir=None, baseUrl=COCO_URL,
+                 numConnections=8, numExtractors=None, checksums=COCO_CHECKSUMS, keepZips=False,
+                 classFilter=None):
+    # checksums: dict zip filename -> "<algo>:<hexdigest>", the zips without
+    # an entry are not verified (None: no verification, e.g. for a mirror
+    # serving other files)
+    # classFilter: if set, only images with annotations of these classes are
+    # extracted from the image zips (the annotations are downloaded first)
     if not os.path.isdir(targetDir):
         try:
-            os.makedirs(targetDir)        
+            os.makedirs(targetDir)
         except:
             print("Could not find and create target dir {}".format(targetDir))
             return
-        
+
     targetDir = os.path.abspath(targetDir)
-    tempDir = tempfile.gettempdir()
-    
+    if downloadDir == None:
+        downloadDir = tempfile.gettempdir()
+    if checksums == None:
+        checksums = {}
+
     if valOnly:
-        urls = [annosUrl, valUrl]
+        paths = [ANNOS_PATH, VAL_PATH]
     else:
-        urls = [annosUrl, valUrl, trainUrl]
+        paths = [ANNOS_PATH, VAL_PATH, TRAIN_PATH]
     fnames = []
-    
+
     print("Start downloading COCO data. This might take a long time!")
-    for u in urls:
+    for p in paths:
+        u = baseUrl + p
+        fname = os.path.join(downloadDir, os.path.basename(p))
+        memberFilter = None
+        if classFilter != None and p != ANNOS_PATH:
+            db = os.path.splitext(os.path.basename(p))[0]
+            memberFilter = _imageFilter(targetDir, db, classFilter)
+            if memberFilter is None:
+                print("Could not select images of {}".format(db))
+                return
         print("downloading {}".format(u))
-        fname = wget.download(u, tempDir)
+        if not downloadFile(u, fname, numConnections, checksum=checksums.get(os.path.basename(p)),
+                            extractDir=targetDir, numExtractors=numExtractors, memberFilter=memberFilter):
+            print("Failed downloading COCO data")
+            return
         fnames.append(fname)
     print("Finished downloading COCO data")
-    
-    for f in fnames:
-        print("Unzipping {} to dir {}".format(f, targetDir))
-        zipRef = zipfile.ZipFile(f, 'r')
-        zipRef.extractall(targetDir)
-        zipRef.close()
-        
-    print("Cleaning up zip files")
-    for f in fnames:
-        os.remove(f)
\ No newline at end of file
+
+    if not keepZips:
+        print("Cleaning up zip files")
+        for f in fnames:
+            os.remove(f)
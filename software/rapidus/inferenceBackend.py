@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import deque
+import numpy as np
+try:
+    from .deviceScheduler import FakeGraph
+except ImportError:
+    # imported as a plain module by the mvdemo
+    from deviceScheduler import FakeGraph
+
+# An inference backend provides a list of graphs, objects with the methods
+# LoadTensor(tensor, userobj) and GetResult() -> (out, userobj) of the NCAPI
+# graph, which can be driven by the DeviceScheduler. The input tensor is the
+# image from prepareImage (height x width x 3, RGB in [0,1]), out is the flat
+# output of the last layer in HWC order, as returned by the NCS.
+BACKENDS = ['ncs', 'cpu', 'sim']
+
+class InferenceBackend(object):
+    def __init__(self):
+        self.graphs = []
+
+    def Close(self):
+        for graph in self.graphs:
+            graph.DeallocateGraph()
+        self.graphs = []
+
+class NcsBackend(InferenceBackend):
+    # one graph on every Neural Compute Stick
+    def __init__(self, graphfile, logLevel=2):
+        super(NcsBackend, self).__init__()
+        from mvnc import mvncapi as mvnc
+        self.devHandle = []
+        mvnc.SetGlobalOption(mvnc.GlobalOption.LOG_LEVEL, logLevel)
+        devices = mvnc.EnumerateDevices()
+        if len(devices) == 0:
+            print('No MVNC devices found')
+            return
+
+        with open(graphfile, mode='rb') as f:
+            blob = f.read()
+        for device in devices:
+            devHandle = mvnc.Device(device)
+            devHandle.OpenDevice()
+            graph = devHandle.AllocateGraph(blob)
+            graph.SetGraphOption(mvnc.GraphOption.ITERATIONS, 1)
+            self.devHandle.append(devHandle)
+            self.graphs.append(graph)
+
+    def Close(self):
+        super(NcsBackend, self).Close()
+        for devHandle in self.devHandle:
+            devHandle.CloseDevice()
+        self.devHandle = []
+
+class CpuGraph(object):
+    # runs the caffe model of convertYoloToCaffe on the cpu, with the dnn
+    # module of OpenCV or with caffe if OpenCV is not available
+    def __init__(self, prototxtFile, caffemodelFile):
+        self.queue = deque()
+        self.lock = threading.Lock()
+        try:
+            import cv2
+            self.net = cv2.dnn.readNetFromCaffe(prototxtFile, caffemodelFile)
+            self.useCaffe = False
+        except (ImportError, AttributeError):
+            os.environ['GLOG_minloglevel'] = '2'
+            import caffe
+            caffe.set_mode_cpu()
+            self.net = caffe.Net(prototxtFile, 1, weights=caffemodelFile)
+            self.useCaffe = True
+
+    def LoadTensor(self, tensor, userobj):
+        with self.lock:
+            self.queue.append((tensor, userobj))
+
+    def GetResult(self):
+        with self.lock:
+            tensor, userobj = self.queue.popleft()
+        data = np.transpose(np.asarray(tensor, dtype=np.float32), (2, 0, 1))[np.newaxis]
+        if self.useCaffe:
+            self.net.blobs[self.net.inputs[0]].data[...] = data
+            out = self.net.forward()[self.net.outputs[0]]
+        else:
+            self.net.setInput(data)
+            out = self.net.forward()
+        # NCHW -> flat HWC like the NCS
+        out = np.transpose(out[0], (1, 2, 0)).reshape(-1)
+        return out.astype(np.float16), userobj
+
+    def DeallocateGraph(self):
+        self.net = None
+
+class CpuBackend(InferenceBackend):
+    def __init__(self, prototxtFile, caffemodelFile=None, numGraphs=1):
+        super(CpuBackend, self).__init__()
+        if caffemodelFile is None:
+            caffemodelFile = prototxtFile.replace(".prototxt", ".caffemodel")
+        for f in [prototxtFile, caffemodelFile]:
+            if not os.path.exists(f):
+                print("Error: Could not find caffe model file {}".format(f))
+                return
+        self.graphs = [CpuGraph(prototxtFile, caffemodelFile) for i in range(numGraphs)]
+
+class SimBackend(InferenceBackend):
+    # simulated sticks which need latency seconds per frame. The output is
+    # deterministic: the same random values (from seed) for every frame.
+    def __init__(self, outputSize, numDevices=1, latency=0.03, seed=0):
+        super(SimBackend, self).__init__()
+        rng = np.random.RandomState(seed)
+        self.output = rng.randn(outputSize).astype(np.float16)
+        self.graphs = [FakeGraph(latency, self._compute) for i in range(numDevices)]
+
+    def _compute(self, tensor):
+        return self.output.copy()
+
+def createBackend(name, graphfile, outputSize=None, **kwargs):
+    # graphfile is the NCS graph, the caffe model of the cpu backend has to
+    # lie next to it with the same name
+    if name == 'ncs':
+        if not os.path.exists(graphfile):
+            print("Error: Could not find graph file {}".format(graphfile))
+            return None
+        return NcsBackend(graphfile, **kwargs)
+    elif name == 'cpu':
+        return CpuBackend(os.path.splitext(graphfile)[0] + ".prototxt", **kwargs)
+    elif name == 'sim':
+        return SimBackend(outputSize, **kwargs)
+    print("Error: Unknown inference backend {}, use one of {}".format(name, BACKENDS))
+    return None
@@ -0,0 +1,144 @@
+import os
+import glob
+import multiprocessing
+import numpy as np
+
+# The letterbox cache stores images already resized to network resolution
+# as uint8 RGB arrays in .npy shards (shape: numImages x height x width x 3),
+# so they can be memory mapped with np.load(..., mmap_mode='r').
+# The geometry is the same as in prepareImage of the mvdemo, the padding
+# value 128 corresponds to the 0.5 fill value used there.
+CACHE_PATTERN = "letterbox_{}x{}_{:04}.npy"
+CACHE_GLOB    = "letterbox_{}x{}_[0-9]*.npy"
+INDEX_PATTERN = "letterbox_{}x{}_index.npy"
+PAD_VALUE = 128
+
+INDEX_DTYPE = np.dtype([('imgId', '<i8'),
+                        ('shard', '<i4'),
+                        ('row',   '<i4'),
+                        ('offx',  '<i4'),
+                        ('offy',  '<i4'),
+                        ('neww',  '<i4'),
+                        ('newh',  '<i4')])
+
+def letterboxGeometry(imgw, imgh, dim):
+    if imgh/imgw > dim[1]/dim[0]:
+        neww = int(imgw * dim[1] / imgh)
+        newh = dim[1]
+    else:
+        newh = int(imgh * dim[0] / imgw)
+        neww = dim[0]
+    offx = int((dim[0] - neww)/2)
+    offy = int((dim[1] - newh)/2)
+    return offx, offy, neww, newh
+
+def letterboxImage(img, dim, out):
+    # img: BGR uint8 image as loaded by cv2, out: (dim[1], dim[0], 3) uint8 RGB
+    import cv2
+    offx, offy, neww, newh = letterboxGeometry(img.shape[1], img.shape[0], dim)
+    out.fill(PAD_VALUE)
+    imgNet = cv2.resize(img, (neww, newh), interpolation=cv2.INTER_LINEAR)
+    out[offy:offy+newh,offx:offx+neww,:] = imgNet[:,:,::-1]
+    return offx, offy, neww, newh
+
+def _letterboxWorker(args):
+    import cv2
+    shardFile, rowStart, imgPaths, dim = args
+    cache = np.load(shardFile, mmap_mode='r+')
+    geometry = []
+    for i, path in enumerate(imgPaths):
+        img = cv2.imread(path)
+        if img is None:
+            print("Could not read image file {}".format(path))
+            cache[rowStart+i].fill(PAD_VALUE)
+            geometry.append((0, 0, 0, 0))
+            continue
+        geometry.append(letterboxImage(img, dim, cache[rowStart+i]))
+    cache.flush()
+    del cache
+    return geometry
+
+def createLetterboxCache(imgPaths, imgIds, targetDir, dim, numWorkers=None, imgsPerShard=4096):
+    try:
+        import cv2
+    except ImportError:
+        print("Missing module 'cv2': Please install OpenCV for python")
+        return
+
+    if isinstance(dim, int):
+        dim = (dim, dim)
+
+    for f in glob.glob(os.path.join(targetDir, CACHE_GLOB.format(dim[0], dim[1]))):
+        os.remove(f)
+
+    numImgs = len(imgPaths)
+    index = np.zeros(numImgs, dtype=INDEX_DTYPE)
+    index['imgId'] = imgIds
+    index['shard'] = np.arange(numImgs) // imgsPerShard
+    index['row']   = np.arange(numImgs) % imgsPerShard
+
+    # create all shards first, the workers fill them through memory maps
+    tasks = []
+    chunk = 64
+    for shard in range(int((numImgs + imgsPerShard - 1) / imgsPerShard)):
+        start = shard * imgsPerShard
+        end = min(start + imgsPerShard, numImgs)
+        shardFile = os.path.join(targetDir, CACHE_PATTERN.format(dim[0], dim[1], shard))
+        cache = np.lib.format.open_memmap(shardFile, mode='w+', dtype=np.uint8,
+                                          shape=(end-start, dim[1], dim[0], 3))
+        del cache
+        for s in range(start, end, chunk):
+            e = min(s + chunk, end)
+            tasks.append((shardFile, s - start, imgPaths[s:e], dim))
+
+    if numWorkers == None:
+        numWorkers = multiprocessing.cpu_count()
+    numWorkers = max(1, min(numWorkers, len(tasks)))
+
+    if len(tasks) > 0:
+        pool = multiprocessing.Pool(numWorkers)
+        try:
+            # imap keeps the order of the tasks, so the geometry can be stored in place
+            pos = 0
+            for geometry in pool.imap(_letterboxWorker, tasks):
+                g = np.array(geometry, dtype=np.int32).reshape(-1, 4)
+                index['offx'][pos:pos+len(g)] = g[:,0]
+                index['offy'][pos:pos+len(g)] = g[:,1]
+                index['neww'][pos:pos+len(g)] = g[:,2]
+                index['newh'][pos:pos+len(g)] = g[:,3]
+                pos += len(g)
+        finally:
+            pool.close()
+            pool.join()
+
+    indexFile = os.path.join(targetDir, INDEX_PATTERN.format(dim[0], dim[1]))
+    np.save(indexFile, index)
+    return indexFile
+
+class LetterboxCache(object):
+    def __init__(self, dbDir, dim):
+        if isinstance(dim, int):
+            dim = (dim, dim)
+        self.dim = dim
+        indexFile = os.path.join(dbDir, INDEX_PATTERN.format(dim[0], dim[1]))
+        self.index = np.load(indexFile)
+        numShards = int(self.index['shard'].max()) + 1 if len(self.index) > 0 else 0
+        self.shards = [np.load(os.path.join(dbDir, CACHE_PATTERN.format(dim[0], dim[1], i)), mmap_mode='r')
+                       for i in range(numShards)]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        # returns the letterboxed RGB image (a view into the memory map)
+        # and its geometry (offx, offy, neww, newh)
+        e = self.index[i]
+        img = self.shards[e['shard']][e['row']]
+        return img, (int(e['offx']), int(e['offy']), int(e['neww']), int(e['newh']))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def imageIds(self):
+        return self.index['imgId']
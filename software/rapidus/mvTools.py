@@ -1,49 +1,35 @@
-from mvnc import mvncapi as mvnc
 from .utils import cfgGetVal
+from .regionDecoder import RegionDecoder
+from .deviceScheduler import DeviceScheduler, InferenceError
+from .inferenceBackend import InferenceBackend, createBackend
 import os.path
 
 # todo: get this value from .graph file (which is possible)
 BLOCK_WD = 13
+# tensors queued per graph, the NCS processes them one after the other while
+# the host transfers the next one
+MAX_IN_FLIGHT = 2
 
 class MvDetector():
-    def __init__(self, graphfile, cfgfile = None):       
-        mvnc.SetGlobalOption(mvnc.GlobalOption.LOG_LEVEL, 2)
-        self.devices = mvnc.EnumerateDevices()
-        self.devNum = len(self.devices)
-        if len(self.devices) == 0:
-            print('No MVNC devices found')
-            quit()
-        self.devHandle = []
+    def __init__(self, graphfile, cfgfile = None, policy = 'leastloaded', backend = 'ncs', **backendArgs):
+        # backend: 'ncs', 'cpu' (caffe model next to the graph file), 'sim'
+        # or an InferenceBackend instance
+        self.backend = None
         self.graphHandle = []
+        self.scheduler = None
 
         if cfgfile == None:
             cfgfile = graphfile.replace(".graph", ".cfg")
 
-        if not os.path.exists(graphfile):
-            print("Error: Could not find graph file {}".format(graphfile))
-            return
         if not os.path.exists(cfgfile):
             print("Error: Could not find darknet config file {}".format(cfgfile))
             return
 
-        for i in range(self.devNum):
-            self.devHandle.append(mvnc.Device(self.devices[i]))
-            self.devHandle[i].OpenDevice()
-
-            # load blob
-            with open(graphfile, mode='rb') as f:
-                blob = f.read()
-            self.graphHandle.append(self.devHandle[i].AllocateGraph(blob))
-            self.graphHandle[i].SetGraphOption(mvnc.GraphOption.ITERATIONS, 1)
-            #MvDetector.graphHandle[i].SetGraphOption(mvnc.GraphOption.DONTBLOCK, 1)
-
         imgWidth   = cfgGetVal(cfgfile, "net", "width")
         imgHeight  = cfgGetVal(cfgfile, "net", "height")
         numClasses = cfgGetVal(cfgfile, "region", "classes")
         anchors    = cfgGetVal(cfgfile, "region", "anchors")
 
-        #self.detector = createYoloDetector(numClasses, anchors)
-
         self.dim = (imgWidth, imgHeight)
         self.blockwd = BLOCK_WD
         self.wh = BLOCK_WD*BLOCK_WD
@@ -51,13 +37,69 @@ class MvDetector():
         self.classes = numClasses
         self.nms = 0.4
 
+        self.detector = RegionDecoder(numClasses, anchors, self.nms)
+
+        if isinstance(backend, InferenceBackend):
+            self.backend = backend
+        else:
+            outputSize = self.wh * (numClasses+5) * 5
+            self.backend = createBackend(backend, graphfile, outputSize, **backendArgs)
+        if self.backend is None or len(self.backend.graphs) == 0:
+            print("Error: No graphs available for inference")
+            return
+        self.graphHandle = self.backend.graphs
+        self.devNum = len(self.graphHandle)
+
+        # frames are distributed over all sticks
+        self.scheduler = DeviceScheduler(self.graphHandle, policy, MAX_IN_FLIGHT)
+
     def __del__(self):
-        for i in range(self.devNum):
-            self.graphHandle[i].DeallocateGraph()
-            self.devHandle[i].CloseDevice()
+        if self.scheduler is not None:
+            self.scheduler.Close()
+        if self.backend is not None:
+            self.backend.Close()
 
-    def Detect(self, img):
-        self.graphHandle[0].LoadTensor(img, 'user object')
-        out, userobj = self.graphHandle[0].GetResult()
+    def GetDetector(self):
+        return self.detector
+
+    def _output(self, results):
+        # failed frames are reported and skipped
+        outputs = []
+        for out, userobj in results:
+            if isinstance(out, InferenceError):
+                print("Error: Skipping frame, inference failed on {}".format(out))
+            else:
+                outputs.append((out, userobj))
+        return outputs
+
+    def Submit(self, img, userobj=None):
+        # queues img on one of the sticks and returns the results which are
+        # finished in sequence as a list of (out, userobj), oldest first.
+        # Failed frames are reported and skipped.
+        return self._output(self.scheduler.Submit(img, userobj))
+
+    def Collect(self):
+        # waits for the oldest submitted tensor which did not fail,
+        # returns (out, userobj) or None if nothing is pending
+        while self.scheduler.pending() > 0:
+            res = self._output([self.scheduler.Collect()])
+            if len(res) > 0:
+                return res[0]
+        return None
 
-        return out
\ No newline at end of file
+    def Flush(self):
+        return self._output(self.scheduler.Flush())
+
+    def DetectBatch(self, imgs):
+        # keeps up to MAX_IN_FLIGHT tensors per device in flight,
+        # the outputs are returned in the order of imgs, None for failed ones.
+        # Don't mix with Submit: pending results are dropped here.
+        self.Flush()
+        results = []
+        for img in imgs:
+            results.extend(self.scheduler.Submit(img))
+        results.extend(self.scheduler.Flush())
+        return [None if isinstance(out, InferenceError) else out for out, userobj in results]
+
+    def Detect(self, img):
+        return self.DetectBatch([img])[0]
\ No newline at end of file
@@ -0,0 +1,183 @@
+import os
+import glob
+import numpy as np
+
+# A packed dataset is a directory of shard files. Each shard contains
+#   header | jpeg data | index table | label table
+# The tables are fixed width, so a shard can be memory mapped and every
+# sample can be accessed without copying.
+SHARD_MAGIC = b"RPDSHRD1"
+SHARD_VERSION = 1
+SHARD_PATTERN = "shard_{:04}.rpd"
+
+HEADER_DTYPE = np.dtype([('magic',       'S8'),
+                         ('version',     '<u4'),
+                         ('numSamples',  '<u4'),
+                         ('numLabels',   '<u8'),
+                         ('dataOffset',  '<u8'),
+                         ('indexOffset', '<u8'),
+                         ('labelOffset', '<u8')])
+
+# offset of the jpeg data is relative to dataOffset
+INDEX_DTYPE = np.dtype([('imgId',      '<i8'),
+                        ('offset',     '<u8'),
+                        ('size',       '<u4'),
+                        ('labelStart', '<u4'),
+                        ('labelCount', '<u4'),
+                        ('width',      '<u4'),
+                        ('height',     '<u4')])
+
+# box is x, y, w, h in yolo format (center and size relative to image size)
+LABEL_DTYPE = np.dtype([('box', '<f4', (4,)),
+                        ('cls', '<i2')])
+
+class PackedDatasetWriter(object):
+    def __init__(self, targetDir, maxShardSize=1<<30):
+        self.targetDir = targetDir
+        self.maxShardSize = maxShardSize
+        self.shardFiles = []
+        self.numSamples = 0
+        self.fh = None
+
+    def _openShard(self):
+        filename = os.path.join(self.targetDir, SHARD_PATTERN.format(len(self.shardFiles)))
+        self.fh = open(filename, "wb")
+        self.fh.write(np.zeros(1, dtype=HEADER_DTYPE).tobytes())
+        self.shardFiles.append(filename)
+        self.dataSize = 0
+        self.index = []
+        self.labels = []
+        self.numLabels = 0
+
+    def _closeShard(self):
+        fh = self.fh
+        dataOffset = HEADER_DTYPE.itemsize
+        indexOffset = dataOffset + self.dataSize
+        # keep the tables 8 byte aligned
+        pad = (-indexOffset) % 8
+        fh.write(b"\0" * pad)
+        indexOffset += pad
+        index = np.array(self.index, dtype=INDEX_DTYPE)
+        fh.write(index.tobytes())
+        labelOffset = indexOffset + index.nbytes
+        if len(self.labels) > 0:
+            fh.write(np.concatenate(self.labels).tobytes())
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic']       = SHARD_MAGIC
+        header['version']     = SHARD_VERSION
+        header['numSamples']  = len(index)
+        header['numLabels']   = self.numLabels
+        header['dataOffset']  = dataOffset
+        header['indexOffset'] = indexOffset
+        header['labelOffset'] = labelOffset
+        fh.seek(0)
+        fh.write(header.tobytes())
+        fh.close()
+        self.fh = None
+
+    def add(self, imgId, jpeg, width, height, classes, boxes):
+        if (self.fh is not None) and (self.dataSize + len(jpeg) > self.maxShardSize) and (len(self.index) > 0):
+            self._closeShard()
+        if self.fh is None:
+            self._openShard()
+
+        labels = np.empty(len(classes), dtype=LABEL_DTYPE)
+        labels['cls'] = classes
+        labels['box'] = boxes
+        self.labels.append(labels)
+        self.index.append((imgId, self.dataSize, len(jpeg), self.numLabels, len(labels), width, height))
+        self.fh.write(jpeg)
+        self.dataSize += len(jpeg)
+        self.numLabels += len(labels)
+        self.numSamples += 1
+
+    def close(self):
+        if self.fh is not None:
+            self._closeShard()
+        return self.shardFiles
+
+class PackedDataset(object):
+    def __init__(self, path):
+        # path is a packed dataset directory or a single shard file
+        if os.path.isdir(path):
+            shardFiles = sorted(glob.glob(os.path.join(path, "shard_*.rpd")))
+        else:
+            shardFiles = [path]
+
+        self.shardFiles = shardFiles
+        self.shards = []
+        starts = [0]
+        for f in shardFiles:
+            shard = self._openShard(f)
+            self.shards.append(shard)
+            starts.append(starts[-1] + len(shard['index']))
+        self.starts = np.array(starts, dtype=np.int64)
+
+    def _openShard(self, filename):
+        mm = np.memmap(filename, dtype=np.uint8, mode='r')
+        header = mm[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if header['magic'] != SHARD_MAGIC:
+            raise ValueError("Not a packed dataset shard: {}".format(filename))
+        if header['version'] != SHARD_VERSION:
+            raise ValueError("Unsupported shard version {} in {}".format(header['version'], filename))
+
+        numSamples = int(header['numSamples'])
+        numLabels = int(header['numLabels'])
+        indexOffset = int(header['indexOffset'])
+        labelOffset = int(header['labelOffset'])
+        index = mm[indexOffset:indexOffset+numSamples*INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+        labels = mm[labelOffset:labelOffset+numLabels*LABEL_DTYPE.itemsize].view(LABEL_DTYPE)
+        data = mm[int(header['dataOffset']):indexOffset]
+        return {'index': index, 'labels': labels, 'data': data}
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("sample index out of range")
+        shardIdx = int(np.searchsorted(self.starts, i, side='right')) - 1
+        shard = self.shards[shardIdx]
+        e = shard['index'][i - self.starts[shardIdx]]
+        offset = int(e['offset'])
+        labelStart = int(e['labelStart'])
+        labels = shard['labels'][labelStart:labelStart+int(e['labelCount'])]
+
+        # all arrays are views into the memory mapped shard
+        return {'imgId':   int(e['imgId']),
+                'width':   int(e['width']),
+                'height':  int(e['height']),
+                'jpeg':    shard['data'][offset:offset+int(e['size'])],
+                'classes': labels['cls'],
+                'boxes':   labels['box']}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def imageIds(self):
+        return np.concatenate([s['index']['imgId'] for s in self.shards]) if self.shards else np.zeros(0, dtype=np.int64)
+
+    def readImage(self, i):
+        import cv2
+        return cv2.imdecode(np.asarray(self[i]['jpeg']), cv2.IMREAD_COLOR)
+
+def writePackedDataset(data, labels, imgDir, imgFiles, targetDir, maxShardSize=1<<30):
+    # data is the output of filterCocoYolo, labels the normalized yolo boxes
+    # of all annotations. Images which are not in imgFiles are skipped.
+    writer = PackedDatasetWriter(targetDir, maxShardSize)
+    bounds = np.searchsorted(data['annoImgIdx'], np.arange(len(data['fileNames'])+1)).tolist()
+    for i, imgFilename in enumerate(data['fileNames']):
+        if not imgFilename in imgFiles:
+            print("Could not find image file {}".format(os.path.join(imgDir, imgFilename)))
+            continue
+        with open(os.path.join(imgDir, imgFilename), "rb") as fh:
+            jpeg = fh.read()
+        s, e = bounds[i], bounds[i+1]
+        writer.add(int(data['imgIds'][i]), jpeg, int(data['widths'][i]), int(data['heights'][i]),
+                   data['yoloIds'][s:e], labels[s:e])
+    shardFiles = writer.close()
+    return shardFiles, writer.numSamples
@@ -0,0 +1,213 @@
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+from .darknetWeights import PRECISIONS
+from .darknetReference import DarknetReference, imageFiles, loadImages
+from .regionDecoder import RegionDecoder, boxIou
+from .utils import cfgGetVal
+from .convertYoloToCaffe import exportPrecisions
+
+# Compares the detections of the weights variants of exportPrecisions with
+# the fp32 model on a validation set: mAP against the yolo labels next to
+# the images (or against the fp32 detections if there are none), drift of
+# the boxes matched to the fp32 boxes, size of the weights and latency of
+# the reference forward pass. Run with
+#   python -m rapidus.precisionReport model.cfg model.weights valdir
+
+def _toXywh(dets):
+    # left, right, top, bottom -> center x, center y, width, height
+    return np.stack([(dets[:,0] + dets[:,1]) / 2., (dets[:,2] + dets[:,3]) / 2.,
+                     dets[:,1] - dets[:,0], dets[:,3] - dets[:,2]], axis=1)
+
+def readLabels(imgFile):
+    # yolo labels (class, x, y, w, h) of an image as (n,6) like the detections
+    txtFile = os.path.splitext(imgFile)[0] + ".txt"
+    if not os.path.isfile(txtFile):
+        return None
+    labels = np.loadtxt(txtFile, ndmin=2).reshape(-1, 5)
+    gt = np.empty((len(labels), 6), dtype=np.float32)
+    gt[:,0] = labels[:,1] - labels[:,3]/2.
+    gt[:,1] = labels[:,1] + labels[:,3]/2.
+    gt[:,2] = labels[:,2] - labels[:,4]/2.
+    gt[:,3] = labels[:,2] + labels[:,4]/2.
+    gt[:,4] = 1.
+    gt[:,5] = labels[:,0]
+    return gt
+
+def _match(dets, gt, iouThresh):
+    # greedy matching of dets (sorted by confidence) to gt boxes of the same
+    # class, returns the index of the matched gt box or -1 per detection
+    matches = np.full(len(dets), -1, dtype=np.int64)
+    used = np.zeros(len(gt), dtype=bool)
+    if len(gt) == 0:
+        return matches
+    gtBoxes = _toXywh(gt)
+    for i in np.argsort(-dets[:,4], kind='stable'):
+        iou = boxIou(_toXywh(dets[i:i+1])[0], gtBoxes)
+        iou[(gt[:,5] != dets[i,5]) | used] = -1.
+        j = int(np.argmax(iou))
+        if iou[j] >= iouThresh:
+            matches[i] = j
+            used[j] = True
+    return matches
+
+def meanAveragePrecision(allDets, allGt, iouThresh=0.5):
+    # all point interpolated AP per class, averaged over the classes of gt
+    classes = np.unique(np.concatenate([gt[:,5] for gt in allGt])) if len(allGt) > 0 else []
+    aps = []
+    for c in classes:
+        conf = []
+        tp = []
+        numGt = 0
+        for dets, gt in zip(allDets, allGt):
+            dets = dets[dets[:,5] == c]
+            gt = gt[gt[:,5] == c]
+            numGt += len(gt)
+            conf.append(dets[:,4])
+            tp.append(_match(dets, gt, iouThresh) >= 0)
+        if numGt == 0:
+            continue
+        order = np.argsort(-np.concatenate(conf), kind='stable')
+        tp = np.concatenate(tp)[order]
+        tpCum = np.cumsum(tp)
+        recall = tpCum / float(numGt)
+        precision = tpCum / np.arange(1., len(tp) + 1.)
+        # precision envelope, summed at every recall change
+        mpre = np.concatenate([[0.], precision, [0.]])
+        mrec = np.concatenate([[0.], recall, [1.]])
+        mpre = np.maximum.accumulate(mpre[::-1])[::-1]
+        idx = np.flatnonzero(mrec[1:] != mrec[:-1])
+        aps.append(float(np.sum((mrec[idx+1] - mrec[idx]) * mpre[idx+1])))
+    return float(np.mean(aps)) if len(aps) > 0 else 0.
+
+def boxDrift(allDets, allRef, width, height, iouThresh=0.5):
+    # differences of the detections to the matched reference detections
+    iou = []
+    drift = []
+    confDelta = []
+    lost = 0
+    added = 0
+    for dets, ref in zip(allDets, allRef):
+        matches = _match(dets, ref, iouThresh)
+        sel = np.flatnonzero(matches >= 0)
+        m = matches[sel]
+        added += len(dets) - len(sel)
+        lost += len(ref) - len(sel)
+        for i, j in zip(sel, m):
+            iou.append(boxIou(_toXywh(dets[i:i+1])[0], _toXywh(ref[j:j+1]))[0])
+        d = np.abs(dets[sel,:4] - ref[m,:4]) * np.array([width, width, height, height])
+        drift += d.max(axis=1).tolist() if len(d) > 0 else []
+        confDelta += (dets[sel,4] - ref[m,4]).tolist()
+    return {'matched': len(drift), 'lost': lost, 'added': added,
+            'meanIou': float(np.mean(iou)) if len(iou) > 0 else 0.,
+            'meanDriftPx': float(np.mean(drift)) if len(drift) > 0 else 0.,
+            'maxDriftPx': float(np.max(drift)) if len(drift) > 0 else 0.,
+            'meanConfDelta': float(np.mean(confDelta)) if len(confDelta) > 0 else 0.}
+
+def weightsSize(weights, precision):
+    # bytes of the parameters, biases and batch norm stay float for int8
+    numWeights = sum(l['params']['weights'].size for l in weights.paramLayers())
+    numOther = weights.count - numWeights
+    if precision == 'fp32':
+        return 4 * weights.count
+    elif precision == 'fp16':
+        return 2 * weights.count
+    return numWeights + 4 * numOther
+
+def _detect(ref, decoder, data, thresh):
+    dets = []
+    times = []
+    for x in data:
+        t = time.time()
+        out = ref.forward(x)[-1]
+        times.append(time.time() - t)
+        dets.append(decoder.Detect(out, thresh))
+    return dets, float(np.mean(times)) * 1000.
+
+def precisionReport(cfgFile, weightsFile, images, precisions=['fp16', 'int8'], numImages=100,
+                    thresh=0.25, iouThresh=0.5, reportFile=None):
+    # the variants are read from <name>-<precision>.weights next to
+    # weightsFile, see exportPrecisions
+    for f in [cfgFile, weightsFile]:
+        if not os.path.isfile(f):
+            print("Could not find file {}".format(f))
+            return None
+    files = imageFiles(images, numImages)
+    if len(files) == 0:
+        print("Could not find any images in {}".format(images))
+        return None
+
+    decoder = RegionDecoder(cfgGetVal(cfgFile, "region", "classes"), cfgGetVal(cfgFile, "region", "anchors"))
+    ref = DarknetReference(cfgFile, weightsFile)
+    channels, height, width = ref.inputShape
+    data, names = loadImages(files, ref.inputShape, numImages)
+    labels = [readLabels(f) for f in files]
+    if any(gt is None for gt in labels):
+        labels = None
+        print("No labels for all images, mAP is computed against the fp32 detections")
+
+    fp32Dets, fp32Ms = _detect(ref, decoder, data, thresh)
+    gt = labels if labels is not None else fp32Dets
+    fp32Map = meanAveragePrecision(fp32Dets, gt, iouThresh)
+    results = [{'precision': 'fp32', 'mAP': fp32Map, 'mAPDelta': 0., 'ms': fp32Ms,
+                'bytes': weightsSize(ref.weights, 'fp32'), 'drift': boxDrift(fp32Dets, fp32Dets, width, height, iouThresh)}]
+
+    base = os.path.splitext(weightsFile)[0]
+    for precision in precisions:
+        fn = "{}-{}.weights".format(base, precision)
+        if not os.path.isfile(fn):
+            print("Could not find file {}, run exportPrecisions first".format(fn))
+            continue
+        actScales = None
+        calibFile = "{}-{}.json".format(base, precision)
+        if precision == 'int8' and os.path.isfile(calibFile):
+            with open(calibFile, "r") as fh:
+                actScales = json.load(fh)['actScales']
+        variant = DarknetReference(cfgFile, fn, actScales)
+        dets, ms = _detect(variant, decoder, data, thresh)
+        m = meanAveragePrecision(dets, gt, iouThresh)
+        results.append({'precision': precision + ("" if actScales is None else "+act"), 'mAP': m,
+                        'mAPDelta': m - fp32Map, 'ms': ms, 'bytes': weightsSize(variant.weights, precision),
+                        'drift': boxDrift(dets, fp32Dets, width, height, iouThresh)})
+
+    print("{} images, mAP@{} against {}".format(len(data), iouThresh, "labels" if labels is not None else "fp32 detections"))
+    print("{:<10} {:>7} {:>8} {:>8} {:>9} {:>6} {:>6} {:>8} {:>10} {:>9}".format("precision", "mAP", "delta", "MB",
+          "host ms", "lost", "added", "mean IoU", "drift px", "max px"))
+    for r in results:
+        d = r['drift']
+        print("{:<10} {:>7.4f} {:>8.4f} {:>8.2f} {:>9.2f} {:>6} {:>6} {:>8.4f} {:>10.2f} {:>9.2f}".format(r['precision'],
+              r['mAP'], r['mAPDelta'], r['bytes'] / 1e6, r['ms'], d['lost'], d['added'], d['meanIou'],
+              d['meanDriftPx'], d['maxDriftPx']))
+
+    if reportFile != None:
+        with open(reportFile, "w") as fh:
+            json.dump({'images': names, 'labels': labels is not None, 'thresh': thresh,
+                       'iouThresh': iouThresh, 'results': results}, fh, indent=2)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the detections of fp16 and int8 weights with fp32')
+    parser.add_argument("cfg",              type=str,   help="darknet .cfg file")
+    parser.add_argument("weights",          type=str,   help="darknet .weights file (fp32)")
+    parser.add_argument("images",           type=str,   nargs="+", help="validation images or directories, yolo labels next to them")
+    parser.add_argument("-p", "--precisions", type=str, nargs="+", choices=PRECISIONS[1:], default=['fp16', 'int8'],
+                        help="precisions to compare, exported if missing")
+    parser.add_argument("-c", "--calib",    type=str,   nargs="*", help="calibration images for int8 activations", default=None)
+    parser.add_argument("-n", "--num-images", type=int, help="max. number of validation images", default=100)
+    parser.add_argument("-t", "--thresh",   type=float, help="threshold for object detection", default=0.25)
+    parser.add_argument("-r", "--report",   type=str,   help="save the report to a .json file", default=None)
+
+    args = parser.parse_args()
+    base = os.path.splitext(args.weights)[0]
+    missing = [p for p in args.precisions if not os.path.isfile("{}-{}.weights".format(base, p))]
+    if len(missing) > 0:
+        exportPrecisions(args.cfg, args.weights, None, missing, args.calib)
+    results = precisionReport(args.cfg, args.weights, args.images, args.precisions, args.num_images,
+                              args.thresh, reportFile=args.report)
+    sys.exit(0 if results is not None else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import numpy as np
+
+# Decodes the output of a darknet [region] layer (YOLOv2) with numpy.
+# Same results as Region::GetDetections of the C++ demo (region.cpp), but all
+# anchors are decoded at once. This module only depends on numpy, so the
+# mvdemo can use it without importing the rapidus package.
+
+# max. number of (box, class) entries suppressed together in one matrix
+NMS_GROUP = 1024
+
+def _sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+def boxIou(box, boxes):
+    # box: (4,) and boxes: (n,4) as center x, center y, width, height
+    left   = np.maximum(box[0] - box[2]/2., boxes[:,0] - boxes[:,2]/2.)
+    right  = np.minimum(box[0] + box[2]/2., boxes[:,0] + boxes[:,2]/2.)
+    top    = np.maximum(box[1] - box[3]/2., boxes[:,1] - boxes[:,3]/2.)
+    bottom = np.minimum(box[1] + box[3]/2., boxes[:,1] + boxes[:,3]/2.)
+    w = right - left
+    h = bottom - top
+    inter = np.where((w < 0) | (h < 0), 0., w*h)
+    union = box[2]*box[3] + boxes[:,2]*boxes[:,3] - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return inter / union
+
+def boxIous(boxes):
+    # iou of all pairs of boxes (n,4), computed like boxIou
+    left   = boxes[:,0] - boxes[:,2]/2.
+    right  = boxes[:,0] + boxes[:,2]/2.
+    top    = boxes[:,1] - boxes[:,3]/2.
+    bottom = boxes[:,1] + boxes[:,3]/2.
+    w = np.minimum(right[:,None], right[None,:]) - np.maximum(left[:,None], left[None,:])
+    h = np.minimum(bottom[:,None], bottom[None,:]) - np.maximum(top[:,None], top[None,:])
+    inter = np.where((w < 0) | (h < 0), 0., w*h)
+    area = boxes[:,2]*boxes[:,3]
+    union = area[:,None] + area[None,:] - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return inter / union
+
+class RegionDecoder(object):
+    # maxCandidates: only the most confident (box, class) probabilities over
+    # the threshold go into the nms, this bounds the time for noisy frames.
+    # The results are the same as region.cpp as long as there are not more
+    # candidates, None for no limit.
+    def __init__(self, numClasses, anchors, nms=0.4, numAnchors=5, maxCandidates=100):
+        if len(anchors) != 2*numAnchors:
+            raise ValueError("Number of anchor coordinates must be {} (is {})".format(2*numAnchors, len(anchors)))
+        self.classes = numClasses
+        self.num = numAnchors
+        self.nms = nms
+        self.maxCandidates = maxCandidates
+        anchors = np.array(anchors, dtype=np.float32).reshape(numAnchors, 2)
+        self.anchorW = anchors[:,0]
+        self.anchorH = anchors[:,1]
+        self.grids = {}
+
+    def _grid(self, h, w):
+        # cell offsets and anchors of all h*w*num boxes, cached per layer size
+        if not (h, w) in self.grids:
+            row, col, n = np.meshgrid(np.arange(h), np.arange(w), np.arange(self.num), indexing='ij')
+            grid = np.empty((h*w*self.num, 4), dtype=np.float32)
+            grid[:,0] = col.reshape(-1)
+            grid[:,1] = row.reshape(-1)
+            grid[:,2] = self.anchorW[n.reshape(-1)] / w
+            grid[:,3] = self.anchorH[n.reshape(-1)] / h
+            self.grids[(h, w)] = grid
+        return self.grids[(h, w)]
+
+    def _reshape(self, out, shape, layout):
+        size = 5 + self.classes
+        out = np.asarray(out, dtype=np.float32)
+        if shape is None:
+            if out.ndim == 3:
+                shape = out.shape[1:] if layout == 'chw' else out.shape[:2]
+            else:
+                wh = int(out.size / (self.num*size))
+                side = int(round(np.sqrt(wh)))
+                shape = (side, side)
+        h, w = shape
+        if layout == 'hwc':
+            # raw output of the NCS
+            return out.reshape(h*w*self.num, size), h, w
+        # (num*size, h, w) -> (h, w, num, size): same order as region.cpp
+        out = np.transpose(out.reshape(self.num, size, h, w), (2, 3, 0, 1))
+        return out.reshape(h*w*self.num, size), h, w
+
+    def decode(self, out, shape=None, layout='chw', thresh=None):
+        # returns the indices (in region.cpp order), boxes (n,4) as x, y, w, h
+        # and class probabilities (n,classes) before thresholding and nms.
+        # With thresh only boxes with an objectness >= thresh are decoded,
+        # all others can not have a class probability >= thresh.
+        out, h, w = self._reshape(out, shape, layout)
+        scale = _sigmoid(out[:,4])
+        if thresh is None:
+            idx = np.arange(len(out))
+        else:
+            idx = np.flatnonzero(scale >= thresh)
+            out = out[idx]
+            scale = scale[idx]
+        grid = self._grid(h, w)[idx]
+
+        boxes = np.empty((len(idx), 4), dtype=np.float32)
+        boxes[:,0] = (grid[:,0] + _sigmoid(out[:,0])) / w
+        boxes[:,1] = (grid[:,1] + _sigmoid(out[:,1])) / h
+        boxes[:,2:] = np.exp(out[:,2:4]) * grid[:,2:]
+
+        logits = out[:,5:]
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs *= (scale / probs.sum(axis=1))[:,None]
+        return idx, boxes, probs
+
+    def suppress(self, boxes, probs):
+        # greedy nms per class, suppressed probabilities are set to 0.
+        # The ious of all candidates are computed once and the classes are
+        # suppressed together: a box is kept if no kept box of its class
+        # before it overlaps it, this is iterated from "all kept" until
+        # nothing changes, which takes the length of the longest chain of
+        # overlapping boxes instead of one step per box.
+        cand = np.flatnonzero(probs.any(axis=1))
+        if len(cand) < 2:
+            return
+        over = boxIous(boxes[cand]) > self.nms
+        # (box, class) entries by class and descending probability
+        box, cls = np.nonzero(probs[cand])
+        order = np.lexsort((-probs[cand[box], cls], cls))
+        box = box[order]
+        cls = cls[order]
+        # whole classes in groups of up to NMS_GROUP entries
+        ends = np.r_[np.flatnonzero(cls[1:] != cls[:-1]) + 1, len(cls)]
+        begin = 0
+        for i, end in enumerate(ends):
+            if i + 1 < len(ends) and ends[i+1] - begin <= NMS_GROUP:
+                continue
+            b = box[begin:end]
+            c = cls[begin:end]
+            # s[i,j]: box i comes before box j in its class and overlaps it
+            s = np.triu(over[b[:,None], b[None,:]] & (c[:,None] == c[None,:]), 1).astype(np.float32)
+            keep = np.ones(len(b), dtype=np.float32)
+            while True:
+                newKeep = (keep.dot(s) == 0).astype(np.float32)
+                if np.array_equal(newKeep, keep):
+                    break
+                keep = newKeep
+            probs[cand[b[keep == 0]], c[keep == 0]] = 0
+            begin = end
+
+    def Detect(self, out, thresh, shape=None, layout='chw'):
+        # out: region layer input in CHW (like libpydetector) or HWC order,
+        # either flat or 3 dimensional
+        # returns (n,6) float32 array: left, right, top, bottom, confidence,
+        # class id with coordinates relative to the network input
+        idx, boxes, probs = self.decode(out, shape, layout, thresh)
+        probs[probs < thresh] = 0
+        if self.maxCandidates is not None:
+            flat = probs.reshape(-1)
+            nz = np.flatnonzero(flat)
+            if len(nz) > self.maxCandidates:
+                kth = -np.partition(-flat[nz], self.maxCandidates - 1)[self.maxCandidates - 1]
+                flat[flat < kth] = 0
+        self.suppress(boxes, probs)
+
+        classIds = probs.argmax(axis=1)
+        conf = probs[np.arange(len(probs)), classIds]
+        sel = np.flatnonzero(conf > thresh)
+        b = boxes[sel]
+        res = np.empty((len(sel), 6), dtype=np.float32)
+        res[:,0] = np.maximum(b[:,0] - b[:,2]/2., 0.)
+        res[:,1] = np.minimum(b[:,0] + b[:,2]/2., 1.)
+        res[:,2] = np.maximum(b[:,1] - b[:,3]/2., 0.)
+        res[:,3] = np.minimum(b[:,1] + b[:,3]/2., 1.)
+        res[:,4] = conf[sel]
+        res[:,5] = classIds[sel]
+        return res
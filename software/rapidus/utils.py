@@ -1,3 +1,5 @@
+import json
+
 def cfgGetVal(cfgfile, section, value):
     secStr = "[{}]".format(section)
     with open(cfgfile, "r") as fh:
@@ -31,3 +33,85 @@ def cfgGetVal(cfgfile, section, value):
                 return ret
     print("Error: Could not find section/val ({}/{}) in file {}".format(section, value, cfgfile))
     return None
+
+class _JsonStream(object):
+    def __init__(self, fh, chunkSize):
+        self.fh = fh
+        self.chunkSize = chunkSize
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read(self):
+        # drop consumed data so the buffer never grows beyond a few chunks
+        if self.pos > self.chunkSize:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        data = self.fh.read(self.chunkSize)
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read():
+                return ""
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise ValueError("Invalid json: expected '{}' at offset {}".format(c, self.pos))
+        self.pos += 1
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                val, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number might continue in the next chunk, so it is complete
+                # only if it is followed by a delimiter
+                isNumber = isinstance(val, (int, float)) and not isinstance(val, bool)
+                if (not isNumber) or self.eof or (end < len(self.buf) and self.buf[end] in " \t\r\n,]}"):
+                    self.pos = end
+                    return val
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read()
+
+def iterJsonObject(fh, chunkSize=1<<20):
+    # Walks the top level object of a json file without loading it completely.
+    # Yields (key, value) for each top level entry. Top level arrays are not
+    # materialized: each array element is yielded as (key, element) instead.
+    stream = _JsonStream(fh, chunkSize)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.decode()
+        stream.expect(":")
+        if stream.peek() == "[":
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.pos += 1
+            else:
+                while True:
+                    yield key, stream.decode()
+                    if stream.peek() == ",":
+                        stream.pos += 1
+                    else:
+                        stream.expect("]")
+                        break
+        else:
+            yield key, stream.decode()
+        if stream.peek() == ",":
+            stream.pos += 1
+        else:
+            stream.expect("}")
+            break
@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+from .darknetReference import DarknetReference, loadImages
+from .convertYoloToCaffe import createProtoGenerator, missingCaffeLayers
+
+# Compares a converted caffe model with the darknet model it was created
+# from: both run on the same images, the output of every darknet layer is
+# compared with the caffe blob holding it. Reports the error and the
+# latency per layer. Run with
+#   python -m rapidus.verifyCaffeModel model.cfg model.weights [images]
+
+def _caffeForward(net, data, layerNames, times):
+    net.blobs['data'].data[...] = data[np.newaxis]
+    for i, name in enumerate(layerNames):
+        t = time.time()
+        net.forward(start=name, end=name)
+        times[i] += time.time() - t
+
+def verifyCaffeModel(cfgFile, weightsFile, prototxtFile=None, caffemodelFile=None,
+                     images=None, numImages=4, tol=1e-3, dumpDir=None, reportFile=None):
+    # tol: max. error of a layer relative to the largest absolute value of
+    # its darknet output. Returns True if all layers are within tol.
+    if prototxtFile == None:
+        prototxtFile = os.path.splitext(weightsFile)[0] + ".prototxt"
+    if caffemodelFile == None:
+        caffemodelFile = os.path.splitext(prototxtFile)[0] + ".caffemodel"
+    for f in [cfgFile, weightsFile, prototxtFile, caffemodelFile]:
+        if not os.path.isfile(f):
+            print("Could not find file {}".format(f))
+            return False
+
+    os.environ['GLOG_minloglevel'] = '2'
+    import caffe
+    caffe.set_mode_cpu()
+    missing = missingCaffeLayers(caffe, prototxtFile)
+    if len(missing) > 0:
+        print("Error: caffe has no {} layers, use a caffe fork which implements them".format(", ".join(missing)))
+        print("Could not load {}".format(prototxtFile))
+        return False
+    net = caffe.Net(prototxtFile, caffe.TEST, weights=caffemodelFile)
+    caffeLayers = list(net._layer_names)
+
+    # the blob names depend on the batch norm being folded or not
+    foldBatchNorm = not 'BatchNorm' in [l.type for l in net.layers]
+    gen = createProtoGenerator(cfgFile, foldBatchNorm)
+    if gen == None:
+        return False
+    ref = DarknetReference(cfgFile, weightsFile)
+    names = ref.layerNames()
+    blobs = gen.tops[:len(names)]
+
+    data, imgNames = loadImages(images, ref.inputShape, numImages)
+    if len(data) == 0:
+        print("Could not find any images in {}".format(images))
+        return False
+    if dumpDir != None and not os.path.isdir(dumpDir):
+        os.makedirs(dumpDir)
+
+    errors = np.zeros((len(data), len(names)))
+    refTimes = []
+    caffeTimes = np.zeros(len(caffeLayers))
+    groups = [[caffeLayers.index(l) for l in group] for group in gen.groups[:len(names)]]
+    for k, x in enumerate(data):
+        t = []
+        outputs = ref.forward(x, t)
+        refTimes.append(t)
+        _caffeForward(net, x, caffeLayers, caffeTimes)
+        for i, (out, blob) in enumerate(zip(outputs, blobs)):
+            scale = max(np.abs(out).max(), 1e-6)
+            errors[k, i] = np.abs(net.blobs[blob].data[0].reshape(out.shape) - out).max() / scale
+        if dumpDir != None:
+            np.savez(os.path.join(dumpDir, imgNames[k] + "_darknet.npz"),
+                     **dict((name, out) for name, out in zip(names, outputs)))
+            np.savez(os.path.join(dumpDir, imgNames[k] + "_caffe.npz"),
+                     **dict((name, net.blobs[blob].data[0]) for name, blob in zip(names, blobs)))
+
+    refTimes = np.mean(refTimes, axis=0) * 1000.
+    caffeTimes = caffeTimes / len(data) * 1000.
+    maxErrors = errors.max(axis=0)
+    ok = bool(np.all(maxErrors <= tol))
+
+    print("{:<18} {:<12} {:>10} {:>12} {:>10}".format("layer", "caffe blob", "max error", "darknet ms", "caffe ms"))
+    for i, name in enumerate(names):
+        t = caffeTimes[groups[i]].sum()
+        print("{:<18} {:<12} {:>10.2e} {:>12.2f} {:>10.2f}{}".format(name, blobs[i], maxErrors[i], refTimes[i], t,
+              "" if maxErrors[i] <= tol else "  FAILED"))
+    print("Total: darknet {:.2f} ms, caffe {:.2f} ms per image ({} images)".format(refTimes.sum(), caffeTimes.sum(), len(data)))
+    print("Model {} within tolerance {}".format("is" if ok else "is NOT", tol))
+
+    if reportFile != None:
+        with open(reportFile, "w") as fh:
+            json.dump({'ok': ok, 'tol': tol, 'images': imgNames,
+                       'layers': [{'name': name, 'blob': blob, 'maxError': float(e), 'darknetMs': float(t),
+                                   'caffeMs': float(caffeTimes[group].sum())}
+                                  for name, blob, e, t, group in zip(names, blobs, maxErrors, refTimes, groups)],
+                       'caffeLayers': [{'name': l, 'ms': float(t)} for l, t in zip(caffeLayers, caffeTimes)],
+                       'darknetMs': float(refTimes.sum()), 'caffeMs': float(caffeTimes.sum())}, fh, indent=2)
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare a converted caffe model with its darknet model')
+    parser.add_argument("cfg",              type=str,   help="darknet .cfg file")
+    parser.add_argument("weights",          type=str,   help="darknet .weights file")
+    parser.add_argument("images",           type=str,   nargs="*", help="image files or directories (default: random images)")
+    parser.add_argument("-p", "--prototxt", type=str,   help="caffe .prototxt file (default: next to the weights)", default=None)
+    parser.add_argument("-m", "--caffemodel", type=str, help="caffe .caffemodel file (default: next to the prototxt)", default=None)
+    parser.add_argument("-n", "--num-images", type=int, help="number of images", default=4)
+    parser.add_argument("-t", "--tol",      type=float, help="max. error relative to the largest output of a layer", default=1e-3)
+    parser.add_argument("-d", "--dump",     type=str,   help="directory for the outputs of all layers as .npz files", default=None)
+    parser.add_argument("-r", "--report",   type=str,   help="save the report to a .json file", default=None)
+
+    args = parser.parse_args()
+    ok = verifyCaffeModel(args.cfg, args.weights, args.prototxt, args.caffemodel, args.images,
+                          args.num_images, args.tol, args.dump, args.report)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -3,5 +3,15 @@ import rapidus as rpd
 classes1 = ["person"]
 classes10 = ["person", "bicycle", "stop sign", "backpack", "tie", 
            "cup", "banana", "orange", "laptop", "cell phone"]
-rpd.createYoloDatabase("./coco", classFilter=classes1, newDbName="per", valOnly=False)
-rpd.createYoloDatabase("./coco", classFilter=classes10, newDbName="hagl10", valOnly=False)
\ No newline at end of file
+
+# (newDbName, classFilter, balance, skipCrowd)
+dbSpecs = [("per",    classes1,  False, True),
+           ("hagl10", classes10, False, True)]
+
+# both databases are created from one pass over the coco data. Images are 
+# hardlinked (falls back to copying if coco and the databases are on 
+# different file systems). Existing databases are updated in place, only 
+# changed labels and images are written.
+if __name__ == "__main__":
+    rpd.createYoloDatabase("./coco", dbSpecs=dbSpecs, valOnly=False, copyMode="hardlink",
+                           incremental=True)
@@ -1,3 +1,9 @@
 import rapidus as rpd
 
-rpd.downloadCoco("coco", valOnly=False)
\ No newline at end of file
+rpd.downloadCoco("coco", valOnly=False)
+
+# to extract only the images containing at least one of these classes, which
+# covers the databases created by runCreateDatabase.py:
+#classes10 = ["person", "bicycle", "stop sign", "backpack", "tie",
+#             "cup", "banana", "orange", "laptop", "cell phone"]
+#rpd.downloadCoco("coco", valOnly=False, classFilter=classes10)
\ No newline at end of file
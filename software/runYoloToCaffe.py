@@ -1,5 +1,7 @@
 import rapidus as rpd
 
+# the weights are converted with the layer shapes of their darknet cfg, so
+# the cfg is required: pass it here or put it next to the .weights file
 rpd.convertYoloToCaffe("./data/models/rapidus-1.cfg", "./data/models/rapidus-1.weights")
 print()
 rpd.convertYoloToCaffe("./data/models/rapidus-hagl10.cfg", "./data/models/rapidus-hagl10.weights")
\ No newline at end of file
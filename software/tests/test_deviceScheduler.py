@@ -0,0 +1,73 @@
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rapidus"))
+from deviceScheduler import DeviceScheduler, FakeGraph, InferenceError
+
+def _stick(computeTime, tag):
+    # the output is the tag of the stick and the tensor
+    return FakeGraph(computeTime, func=lambda tensor: np.array([tag, tensor[0]]))
+
+class FailingGraph(FakeGraph):
+    # GetResult fails for the tensors in fail
+    def __init__(self, fail, **kwargs):
+        super(FailingGraph, self).__init__(computeTime=0.001, **kwargs)
+        self.fail = fail
+
+    def GetResult(self):
+        out, userobj = super(FailingGraph, self).GetResult()
+        if int(out[0]) in self.fail:
+            raise RuntimeError("GetResult failed")
+        return out, userobj
+
+def _run(scheduler, num):
+    done = []
+    for i in range(num):
+        done.extend(scheduler.Submit(np.array([i], dtype=np.float32), "frame{}".format(i)))
+    done.extend(scheduler.Flush())
+    return done
+
+def test_results_in_order_with_different_latencies():
+    # the fast stick finishes frames before older frames of the slow one
+    scheduler = DeviceScheduler([_stick(0.002, 0), _stick(0.02, 1)])
+    done = _run(scheduler, 40)
+    scheduler.Close()
+    assert [userobj for out, userobj in done] == ["frame{}".format(i) for i in range(40)]
+    assert [int(out[1]) for out, userobj in done] == list(range(40))
+    sticks = [int(out[0]) for out, userobj in done]
+    assert sticks.count(0) > sticks.count(1) > 0
+
+def test_roundrobin_uses_all_sticks():
+    scheduler = DeviceScheduler([_stick(0.002, 0), _stick(0.01, 1), _stick(0.005, 2)], policy='roundrobin')
+    done = _run(scheduler, 30)
+    scheduler.Close()
+    assert [int(out[1]) for out, userobj in done] == list(range(30))
+    assert set(int(out[0]) for out, userobj in done) == set([0, 1, 2])
+
+def test_collect():
+    scheduler = DeviceScheduler([_stick(0.001, 0), _stick(0.003, 1)])
+    assert scheduler.Collect() is None
+    for i in range(3):
+        scheduler.Submit(np.array([i], dtype=np.float32), i)
+    assert [scheduler.Collect()[1] for i in range(3)] == [0, 1, 2]
+    assert scheduler.Collect() is None
+    scheduler.Close()
+
+def test_failed_result_keeps_userobj():
+    scheduler = DeviceScheduler([FailingGraph([2, 5])])
+    done = _run(scheduler, 8)
+    scheduler.Close()
+    assert [userobj for out, userobj in done] == ["frame{}".format(i) for i in range(8)]
+    for i, (out, userobj) in enumerate(done):
+        if i in [2, 5]:
+            assert isinstance(out, InferenceError)
+            assert isinstance(out.error, RuntimeError)
+        else:
+            assert int(out[0]) == i
+
+def test_failed_result_on_one_of_several_graphs():
+    scheduler = DeviceScheduler([FailingGraph([3]), FailingGraph([3])], policy='roundrobin')
+    done = _run(scheduler, 6)
+    scheduler.Close()
+    assert [userobj for out, userobj in done] == ["frame{}".format(i) for i in range(6)]
+    assert [isinstance(out, InferenceError) for out, userobj in done] == [i == 3 for i in range(6)]
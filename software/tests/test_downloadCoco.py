@@ -0,0 +1,104 @@
+import os
+import sys
+import hashlib
+import zipfile
+import threading
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rapidus"))
+import downloadCoco
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    # serves the files of the server with http range requests
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        start, end = 0, len(data)
+        rangeHeader = self.headers.get("Range")
+        if rangeHeader is not None:
+            first, last = rangeHeader.split("=")[1].split("-")
+            start, end = int(first), int(last) + 1
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end-1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        if body:
+            self.wfile.write(data[start:end])
+            self.server.requests += 1
+
+    def do_HEAD(self):
+        self._send(False)
+
+    def do_GET(self):
+        self._send(True)
+
+def _server(files):
+    server = HTTPServer(("127.0.0.1", 0), _RangeHandler)
+    server.files = files
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _zipData(tmpdir):
+    fn = str(tmpdir.join("src.zip"))
+    with zipfile.ZipFile(fn, "w", zipfile.ZIP_DEFLATED) as zf:
+        for i in range(20):
+            zf.writestr("val2017/{:04d}.jpg".format(i), os.urandom(3000) + b"x" * 5000)
+    with open(fn, "rb") as fh:
+        return fh.read()
+
+def test_download_and_extract(tmpdir):
+    data = _zipData(tmpdir)
+    server = _server({"/val2017.zip": data})
+    try:
+        url = "http://127.0.0.1:{}/val2017.zip".format(server.server_port)
+        fn = str(tmpdir.join("val2017.zip"))
+        checksum = "md5:" + hashlib.md5(data).hexdigest()
+        assert downloadCoco.downloadFile(url, fn, numConnections=4, chunkSize=16<<10, checksum=checksum,
+                                         extractDir=str(tmpdir.join("out")))
+    finally:
+        server.shutdown()
+    with open(fn, "rb") as fh:
+        assert fh.read() == data
+    assert len(os.listdir(str(tmpdir.join("out", "val2017")))) == 20
+    assert not os.path.isfile(fn + ".part") and not os.path.isfile(fn + ".state")
+
+def test_corrupt_file_is_downloaded_again(tmpdir):
+    data = _zipData(tmpdir)
+    fn = str(tmpdir.join("val2017.zip"))
+    with open(fn, "wb") as fh:
+        fh.write(data[:-100] + b"\0" * 100)
+    server = _server({"/val2017.zip": data})
+    try:
+        url = "http://127.0.0.1:{}/val2017.zip".format(server.server_port)
+        checksum = "md5:" + hashlib.md5(data).hexdigest()
+        assert downloadCoco.downloadFile(url, fn, numConnections=2, chunkSize=16<<10, checksum=checksum,
+                                         extractDir=str(tmpdir.join("out")))
+        assert server.requests > 0
+    finally:
+        server.shutdown()
+    assert downloadCoco.verifyChecksum(fn, checksum)
+    assert len(os.listdir(str(tmpdir.join("out", "val2017")))) == 20
+
+def test_existing_file_is_not_downloaded(tmpdir):
+    data = _zipData(tmpdir)
+    fn = str(tmpdir.join("val2017.zip"))
+    with open(fn, "wb") as fh:
+        fh.write(data)
+    server = _server({"/val2017.zip": data})
+    try:
+        url = "http://127.0.0.1:{}/val2017.zip".format(server.server_port)
+        assert downloadCoco.downloadFile(url, fn, checksum="md5:" + hashlib.md5(data).hexdigest())
+        assert server.requests == 0
+    finally:
+        server.shutdown()
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rapidus"))
+from regionDecoder import RegionDecoder, boxIou
+
+ANCHORS = [1.08, 1.19, 3.42, 4.41, 6.63, 11.38, 9.42, 5.11, 16.62, 10.52]
+
+def _noisy(classes, seed=0, objectness=3.):
+    # region layer input where (almost) every anchor is a candidate
+    rng = np.random.RandomState(seed)
+    out = rng.randn(5*(5+classes), 13, 13).astype(np.float32)
+    out.reshape(5, 5+classes, 13, 13)[:,4] += objectness
+    return out
+
+def _suppressLoop(dec, boxes, probs):
+    # greedy nms of region.cpp, one box after the other
+    for k in np.unique(np.nonzero(probs)[1]):
+        idx = np.flatnonzero(probs[:,k])
+        idx = idx[np.argsort(-probs[idx,k], kind='stable')]
+        keep = np.ones(len(idx), dtype=bool)
+        for i in range(len(idx)-1):
+            if keep[i]:
+                keep[i+1:] &= ~(boxIou(boxes[idx[i]], boxes[idx[i+1:]]) > dec.nms)
+        probs[idx[~keep],k] = 0
+
+def test_suppress_matches_greedy_loop():
+    for classes in [1, 10, 80]:
+        for seed in range(3):
+            for thresh in [0.05, 0.25]:
+                dec = RegionDecoder(classes, ANCHORS, maxCandidates=None)
+                out = _noisy(classes, seed, objectness=seed - 1.)
+                idx, boxes, probs = dec.decode(out, thresh=thresh)
+                probs[probs < thresh] = 0
+                expected = probs.copy()
+                _suppressLoop(dec, boxes, expected)
+                dec.suppress(boxes, probs)
+                assert np.array_equal(probs, expected)
+
+def test_max_candidates():
+    dec = RegionDecoder(10, ANCHORS, maxCandidates=50)
+    res = dec.Detect(_noisy(10), 0.25)
+    assert 0 < len(res) <= 50
+    full = RegionDecoder(10, ANCHORS, maxCandidates=None).Detect(_noisy(10), 0.25)
+    assert res[:,4].max() == full[:,4].max()
+
+def test_noisy_frame_time():
+    # decode and nms of a frame where all 845 anchors are candidates
+    dec = RegionDecoder(10, ANCHORS)
+    out = _noisy(10)
+    dec.Detect(out, 0.25)
+    times = []
+    for i in range(20):
+        t = time.time()
+        dec.Detect(out, 0.25)
+        times.append(time.time() - t)
+    assert min(times) < 0.001
@@ -0,0 +1,29 @@
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mvdemo", "python"))
+import Visualize
+from utils import convertToBBoxes, visualize
+
+def _boxes():
+    results = np.array([[0.1, 0.5, 0.2, 0.6, 0.9, 1],
+                        [0.3, 0.9, 0.1, 0.4, 0.7, 0]], dtype=np.float32)
+    return convertToBBoxes(results, [0, 0, 320, 240])
+
+def test_visualize_recarray_without_class_names():
+    img = np.zeros((240, 320, 3), dtype=np.uint8)
+    out = Visualize.Visualize(img, _boxes(), 2)
+    assert out.shape == img.shape
+    assert out.any()
+    assert not img.any()
+
+def test_visualize_recarray_with_class_names_in_place():
+    img = np.zeros((240, 320, 3), dtype=np.uint8)
+    out = visualize(img, _boxes(), 20., 2, ["car", "person"], inPlace=True)
+    assert out is img
+    assert img.any()
+
+def test_class_name_lookup():
+    boxes = _boxes()
+    assert Visualize.getClassName(boxes[0]) == "1"
+    assert Visualize.getClassName(boxes[0], ["car", "person"]) == "person"